@@ -3,19 +3,30 @@ from flask_migrate import Migrate
 from flask_login import LoginManager, current_user
 from flask_wtf import CSRFProtect
 from dotenv import load_dotenv
-from contextlib import contextmanager
 import logging
 import os
-from model import db, Uzytkownik, Prowadzacy, Zajecia
+from model import db, KSeFInvoice, Uzytkownik, Prowadzacy, Zajecia
 from utils import (
-    load_db_settings,
     purge_expired_tokens,
     email_do_koordynatora,
+    get_month_sessions,
+    in_month,
     month_name,
+    start_email_worker,
+)
+from utils.db_engine import engine_options, init_engine
+from utils.query_counter import init_query_counter
+from utils.settings import get_setting, init_settings, override_setting
+from utils.stats import (
+    PROJECT_HOURS_TOLERANCE,
+    check_project_hours,
+    init_stats,
+    rebuild_stats,
 )
 from doc_generator import generuj_raport_miesieczny
 from io import BytesIO
 import smtplib
+import time
 import click
 
 logger = logging.getLogger(__name__)
@@ -28,6 +39,157 @@ login_manager.login_view = "routes.login"  # Redirect to login page when unautho
 csrf = CSRFProtect()
 
 
+def _remove_invoice_files(xml_path):
+    """Delete an invoice XML saved by ``build_invoice_files`` and its PDF."""
+    for path in (xml_path, os.path.splitext(xml_path)[0] + ".pdf"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _report_invoice_files(job, result, counter):
+    """Return the worker-built invoice files, rebuilt if numbered other than ``counter``.
+
+    The files the worker saved under the old number are removed.
+    """
+    from invoice_helper import build_invoice_files
+
+    if job.invoice_counter != counter:
+        files = build_invoice_files(
+            hours=job.hours,
+            month=job.month,
+            year=job.year,
+            trainer_name=job.trainer_name,
+            counter=counter,
+        )
+        if result.invoice_path and result.invoice_path != files[3]:
+            _remove_invoice_files(result.invoice_path)
+        return files
+    return result.invoice, result.invoice_xml, BytesIO(result.invoice_pdf), result.invoice_path
+
+
+def _submit_report_invoice(job, result, next_counter):
+    """Submit a worker-built invoice, returning its PDF buffer on success.
+
+    Invoices are numbered up front; when an earlier submission failed the
+    counter did not advance, so the invoice is rebuilt with the number the
+    counter now points at to keep the sequence gap-free.
+    """
+    from invoice_helper import NO_HOURS_ERROR, report_invoice_outcome, submit_invoice
+
+    if job.invoice_counter is None:
+        if job.hours <= 0:
+            _, invoice_msg, _ = report_invoice_outcome(False, None, NO_HOURS_ERROR, None)
+            click.echo(f"Invoice error: {invoice_msg}", err=True)
+        return None
+    if result.invoice is None:
+        click.echo("Invoice error: invoice was not generated", err=True)
+        return None
+    try:
+        outcome = submit_invoice(
+            *_report_invoice_files(job, result, next_counter), prowadzacy_id=job.trainer_id
+        )
+    except Exception as exc:
+        logger.exception("Error generating/sending invoice")
+        outcome = (False, None, str(exc), None)
+
+    invoice_success, invoice_msg, invoice_pdf_buffer = report_invoice_outcome(*outcome)
+    if invoice_success:
+        click.echo(f"Invoice: {invoice_msg}")
+        invoice_pdf_buffer.seek(0)
+        return invoice_pdf_buffer
+    click.echo(f"Invoice error: {invoice_msg}", err=True)
+    return None
+
+
+def _submit_report_invoices(jobs, results, next_counter):
+    """Send the invoices of all rendered reports through one KSeF session.
+
+    Invoices are renumbered consecutively from ``next_counter`` when a report
+    before them has no invoice, and those rejected after the last accepted
+    one are resent on their own. Returns the PDF buffer of every accepted
+    invoice keyed by trainer id.
+    """
+    from invoice_helper import NO_HOURS_ERROR, report_invoice_outcome, submit_invoices
+
+    batch = []
+    batch_jobs = []
+    for job, result in zip(jobs, results):
+        if result.error:
+            continue
+        if job.invoice_counter is None:
+            if job.hours <= 0:
+                _, invoice_msg, _ = report_invoice_outcome(False, None, NO_HOURS_ERROR, None)
+                click.echo(f"Invoice error for {job.trainer_name}: {invoice_msg}", err=True)
+            continue
+        if result.invoice is None:
+            click.echo(
+                f"Invoice error for {job.trainer_name}: invoice was not generated", err=True
+            )
+            continue
+        try:
+            batch.append(_report_invoice_files(job, result, next_counter + len(batch)))
+        except Exception as exc:
+            logger.exception("Error generating invoice")
+            click.echo(f"Invoice error for {job.trainer_name}: {exc}", err=True)
+            continue
+        batch_jobs.append(job)
+    if not batch:
+        return {}
+
+    try:
+        outcomes = submit_invoices(batch, [job.trainer_id for job in batch_jobs])
+    except Exception as exc:
+        logger.exception("Error sending invoice batch")
+        outcomes = [(False, None, str(exc), None)] * len(batch)
+    else:
+        _resend_report_invoices(batch_jobs, batch, outcomes, next_counter)
+
+    buffers = {}
+    for job, outcome in zip(batch_jobs, outcomes):
+        invoice_success, invoice_msg, invoice_pdf_buffer = report_invoice_outcome(*outcome)
+        if invoice_success:
+            click.echo(f"Invoice for {job.trainer_name}: {invoice_msg}")
+            invoice_pdf_buffer.seek(0)
+            buffers[job.trainer_id] = invoice_pdf_buffer
+        else:
+            click.echo(f"Invoice error for {job.trainer_name}: {invoice_msg}", err=True)
+    return buffers
+
+
+def _resend_report_invoices(jobs, batch, outcomes, next_counter):
+    """Send the invoices rejected after the last accepted one of a batch again.
+
+    ``submit_invoices`` leaves the counter at the first of them, so they go
+    through ``submit_invoice`` one by one, rebuilt with the number the counter
+    points at whenever an earlier resend failed. ``outcomes`` is updated in place.
+    """
+    from invoice_helper import build_invoice_files, submit_invoice
+
+    accepted = [index for index, outcome in enumerate(outcomes) if outcome[0]]
+    counter = next_counter + (accepted[-1] + 1 if accepted else 0)
+    for index in range(counter - next_counter, len(batch)):
+        job, files = jobs[index], batch[index]
+        try:
+            if counter != next_counter + index:
+                if files[3]:
+                    _remove_invoice_files(files[3])
+                files = build_invoice_files(
+                    hours=job.hours,
+                    month=job.month,
+                    year=job.year,
+                    trainer_name=job.trainer_name,
+                    counter=counter,
+                )
+            outcomes[index] = submit_invoice(*files, prowadzacy_id=job.trainer_id)
+        except Exception as exc:
+            logger.exception("Error resending invoice")
+            outcomes[index] = (False, None, str(exc), None)
+        if outcomes[index][0]:
+            counter += 1
+
+
 def inject_is_admin():
     """Expose an ``is_admin`` flag to all templates."""
     return {"is_admin": current_user.is_authenticated and current_user.role == "admin"}
@@ -40,23 +202,7 @@ def inject_table_widths():
 
 def inject_course_name():
     """Expose the configurable project name to all templates."""
-    return {"course_name": os.getenv("COURSE_NAME", "ShareOKO")}
-
-
-@contextmanager
-def temporary_env_var(name: str, value: str | None):
-    previous = os.environ.get(name)
-    if value is None:
-        yield
-        return
-    os.environ[name] = value
-    try:
-        yield
-    finally:
-        if previous is None:
-            os.environ.pop(name, None)
-        else:
-            os.environ[name] = previous
+    return {"course_name": get_setting("course_name", "ShareOKO")}
 
 
 def create_app():
@@ -73,16 +219,22 @@ def create_app():
         "DATABASE_URL", default_database_url
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"]
+    )
 
     # Inicjalizacja rozszerzeń
     db.init_app(app)
+    init_engine(app)
     migrate.init_app(app, db)
-    load_db_settings(app)
+    init_settings(app)
+    init_query_counter(app)
+    init_stats()
 
-    smtp_host = os.getenv("SMTP_HOST")
-    smtp_port = os.getenv("SMTP_PORT")
-    email_login = os.getenv("EMAIL_LOGIN")
-    email_password = os.getenv("EMAIL_PASSWORD")
+    smtp_host = get_setting("smtp_host")
+    smtp_port = get_setting("smtp_port")
+    email_login = get_setting("email_login")
+    email_password = get_setting("email_password")
 
     try:
         int(smtp_port or "")
@@ -123,6 +275,12 @@ def create_app():
     app.context_processor(inject_course_name)
     app.add_template_filter(month_name, "month_name")
 
+    @app.before_request
+    def ensure_email_worker():
+        # Deliver mail queued before a restart without waiting for a new e-mail.
+        if not app.testing:
+            start_email_worker()
+
     @app.get("/healthz")
     def healthz():
         return jsonify({"status": "ok"})
@@ -133,65 +291,226 @@ def create_app():
         purge_expired_tokens()
         click.echo("Expired tokens removed")
 
+    @app.cli.command("send-outbox")
+    @click.option("--retry-dead", is_flag=True, help="Requeue dead-lettered messages first")
+    def send_outbox_command(retry_dead: bool) -> None:
+        """Deliver all e-mails from the outbox that are due now.
+
+        Web workers deliver queued mail in the background on their own; use
+        this from cron when no web worker runs or to retry dead messages.
+        """
+        from utils import _send_outbox_message
+        from utils.outbox import drain_outbox, requeue_dead
+
+        with app.app_context():
+            if retry_dead:
+                click.echo(f"Requeued {requeue_dead()} dead-lettered e-mails")
+            total = 0
+            while True:
+                attempted = drain_outbox(_send_outbox_message)
+                if not attempted:
+                    break
+                total += attempted
+            click.echo(f"Processed {total} e-mails")
+
+    @app.cli.command("poll-ksef")
+    def poll_ksef_command() -> None:
+        """Check the KSeF status of every uploaded invoice that is due now."""
+        from utils.ksef_poller import poll_pending_invoices
+
+        with app.app_context():
+            total = 0
+            while True:
+                polled = poll_pending_invoices()
+                if not polled:
+                    break
+                total += polled
+            pending = KSeFInvoice.query.filter_by(status="pending").count()
+        click.echo(f"Polled {total} invoices, {pending} still pending")
+
+    @app.cli.command("rebuild-stats")
+    def rebuild_stats_command() -> None:
+        """Recompute the trainer and participant statistics tables."""
+        with app.app_context():
+            months, participants = rebuild_stats()
+        click.echo(f"Rebuilt stats for {months} trainer months and {participants} participants")
+
+    @app.cli.command("check-project-hours")
+    @click.option("--check-only", is_flag=True, help="Report drift without repairing it")
+    def check_project_hours_command(check_only: bool) -> None:
+        """Compare the cached project-hours total with the sessions table."""
+        with app.app_context():
+            cached, actual = check_project_hours(repair=not check_only)
+        if cached is None:
+            click.echo(f"Project hours counter missing or stale; actual {actual:g}h")
+        elif abs(cached - actual) > PROJECT_HOURS_TOLERANCE:
+            click.echo(f"Project hours drift: cached {cached:g}h, actual {actual:g}h")
+        else:
+            click.echo(f"Project hours consistent: {actual:g}h")
+            return
+        if check_only:
+            raise SystemExit(1)
+        click.echo("Counter repaired")
+
+    @app.cli.command("import-attendance")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option(
+        "--format",
+        "fmt",
+        type=click.Choice(["csv", "json"]),
+        help="Input format (default: from the file extension)",
+    )
+    @click.option(
+        "--create-participants", is_flag=True, help="Add participants missing from the database"
+    )
+    def import_attendance_command(path: str, fmt: str | None, create_participants: bool) -> None:
+        """Import sessions with attendance from a CSV or JSON file."""
+        from attendance_import import (
+            AttendanceImportError,
+            format_from_filename,
+            import_records,
+            read_records,
+        )
+
+        with app.app_context():
+            try:
+                fmt = fmt or format_from_filename(path)
+                with open(path, "rb") as fh:
+                    records, rows = read_records(fh, fmt)
+                result = import_records(records, create_participants, rows=rows)
+            except AttendanceImportError as exc:
+                for error in exc.errors:
+                    click.echo(error, err=True)
+                raise click.ClickException("Nothing was imported")
+        click.echo(
+            f"Imported {result.sessions} sessions, {result.attendance} attendance rows, "
+            f"{result.participants_created} new participants"
+        )
+
     @app.cli.command("generate-reports")
     @click.option("--month", required=True, type=int, help="Month number (1-12)")
     @click.option("--year", required=True, type=int, help="Full year")
     @click.option("--email", is_flag=True, help="Send reports via e-mail")
-    def generate_reports_command(month: int, year: int, email: bool) -> None:
+    @click.option(
+        "--jobs",
+        default=1,
+        show_default=True,
+        type=click.IntRange(min=1),
+        help="Number of worker processes rendering reports and invoices",
+    )
+    @click.option(
+        "--force", is_flag=True, help="Regenerate reports even if their inputs are unchanged"
+    )
+    @click.option(
+        "--batch-invoices",
+        is_flag=True,
+        help="With --email, send all invoices to KSeF through one online session",
+    )
+    def generate_reports_command(
+        month: int, year: int, email: bool, jobs: int, force: bool, batch_invoices: bool
+    ) -> None:
         """Generate monthly reports for all trainers."""
         if not 1 <= month <= 12 or year < 2000:
             raise click.BadParameter("Invalid month or year")
 
+        from report_jobs import (
+            ReportJob,
+            ReportManifest,
+            report_fingerprint,
+            run_report_jobs,
+        )
+
         reports_dir = os.path.join("reports")
         os.makedirs(reports_dir, exist_ok=True)
+        manifest = ReportManifest(os.path.join(reports_dir, "manifest.json"))
 
         with app.app_context():
             trainers = (
                 db.session.query(Prowadzacy)
                 .join(Zajecia)
-                .filter(
-                    db.extract("month", Zajecia.data) == month,
-                    db.extract("year", Zajecia.data) == year,
-                )
+                .filter(in_month(Zajecia.data, month, year))
                 .distinct()
                 .all()
             )
 
+            next_counter = None
+            if email:
+                next_counter = int(get_setting("invoice_number_counter", "1") or "1")
+
+            report_jobs = []
+            job_trainers = []
+            fingerprints = []
+            counter = next_counter
             for trainer in trainers:
-                sessions = Zajecia.query.filter_by(prowadzacy_id=trainer.id).all()
-                doc = generuj_raport_miesieczny(
-                    trainer, sessions, "rejestr.docx", "static", month, year
+                sessions = get_month_sessions(trainer.id, month, year)
+                job = ReportJob(
+                    trainer_id=trainer.id,
+                    imie=trainer.imie,
+                    nazwisko=trainer.nazwisko,
+                    numer_umowy=trainer.numer_umowy,
+                    podpis_filename=trainer.podpis_filename,
+                    sessions=[(z.data, z.czas_trwania) for z in sessions],
+                    month=month,
+                    year=year,
+                    output_path=os.path.join(
+                        reports_dir, f"raport_{trainer.id}_{month}_{year}.docx"
+                    ),
                 )
+                fingerprint = report_fingerprint(job)
+                if not force and manifest.is_current(job, fingerprint):
+                    if not email:
+                        click.echo(f"Up to date {job.output_path}")
+                        continue
+                    job.reuse_report = True
+                if email and job.hours > 0:
+                    job.invoice_counter = counter
+                    counter += 1
+                report_jobs.append(job)
+                job_trainers.append(trainer)
+                fingerprints.append(fingerprint)
+
+            results = run_report_jobs(
+                report_jobs, workers=jobs, render=generuj_raport_miesieczny
+            )
 
-                filename = f"raport_{trainer.id}_{month}_{year}.docx"
-                path = os.path.join(reports_dir, filename)
-                doc.save(path)
-                click.echo(f"Saved {path}")
+            for job, fingerprint, result in zip(report_jobs, fingerprints, results):
+                if not result.error and not job.reuse_report:
+                    manifest.record(job, fingerprint, result.report)
+            manifest.save()
+
+            invoice_buffers = None
+            if email and batch_invoices:
+                started = time.perf_counter()
+                invoice_buffers = _submit_report_invoices(report_jobs, results, next_counter)
+                click.echo(f"Invoice batch: {time.perf_counter() - started:.2f}s")
+
+            summary = []
+            for trainer, job, result in zip(job_trainers, report_jobs, results):
+                filename = os.path.basename(result.path)
+                if result.error:
+                    click.echo(f"Failed to generate {filename}: {result.error}", err=True)
+                    summary.append((trainer, result.timings))
+                    continue
+                if job.reuse_report:
+                    click.echo(f"Reusing unchanged {result.path}")
+                else:
+                    click.echo(f"Saved {result.path}")
 
                 if email:
-                    buf = BytesIO()
-                    doc.save(buf)
-                    buf.seek(0)
-
-                    # Automatyczne generowanie faktury
-                    invoice_pdf_buffer = None
-                    from invoice_helper import generate_invoice_for_report
-                    invoice_success, invoice_msg, invoice_pdf_buffer = generate_invoice_for_report(
-                        month=month,
-                        year=year,
-                        prowadzacy_id=trainer.id,
-                        trainer_name=f"{trainer.imie} {trainer.nazwisko}"
-                    )
-
-                    if invoice_success:
-                        click.echo(f"Invoice: {invoice_msg}")
+                    started = time.perf_counter()
+                    if invoice_buffers is not None:
+                        invoice_pdf_buffer = invoice_buffers.get(job.trainer_id)
                     else:
-                        click.echo(f"Invoice error: {invoice_msg}", err=True)
+                        invoice_pdf_buffer = _submit_report_invoice(
+                            job, result, next_counter
+                        )
+                        if invoice_pdf_buffer is not None:
+                            next_counter += 1
 
                     # Wysyłanie emaila z raportem i fakturą
                     try:
                         email_do_koordynatora(
-                            buf,
+                            BytesIO(result.report),
                             f"{month}_{year}",
                             typ="raport",
                             trainer=trainer,
@@ -204,6 +523,18 @@ def create_app():
                     except smtplib.SMTPException:
                         logger.exception("Failed to send report e-mail")
                         click.echo(f"Failed to send e-mail for {filename}", err=True)
+                    result.timings["send"] = time.perf_counter() - started
+                summary.append((trainer, result.timings))
+
+            if summary:
+                click.echo("Timing summary:")
+                for trainer, timings in summary:
+                    parts = ", ".join(
+                        f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()
+                    )
+                    click.echo(
+                        f"  {trainer.imie} {trainer.nazwisko}: {parts or 'no stages completed'}"
+                    )
 
     @app.cli.command("send-demo-invoice")
     @click.option("--month", required=True, type=int, help="Month number (1-12)")
@@ -220,7 +551,7 @@ def create_app():
             if trainer is None:
                 raise click.BadParameter(f"Trainer {trainer_id} not found")
 
-            sessions = Zajecia.query.filter_by(prowadzacy_id=trainer.id).all()
+            sessions = get_month_sessions(trainer.id, month, year)
             doc = generuj_raport_miesieczny(
                 trainer,
                 sessions,
@@ -248,7 +579,7 @@ def create_app():
 
             click.echo(invoice_message)
 
-            with temporary_env_var("EMAIL_RECIPIENT", email_to):
+            with override_setting("email_recipient", email_to):
                 try:
                     email_do_koordynatora(
                         report_buffer,
@@ -0,0 +1,292 @@
+"""Bulk import of past sessions and their attendance.
+
+Used by ``flask import-attendance`` and the admin upload form. Records are
+read from CSV or JSON, every row is validated before anything is written, and
+the sessions and attendance rows are inserted with batched ``executemany``
+calls in a single transaction.
+
+CSV files need the columns ``prowadzacy_id``, ``data`` and ``obecni``
+(participant names separated by ``;``) and may have ``czas_trwania``. JSON
+files contain a list of objects with the same keys, ``obecni`` being a list.
+A missing ``czas_trwania`` falls back to the trainer's default session length.
+"""
+import csv
+import io
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from model import db, obecnosci, Prowadzacy, Uczestnik, Zajecia
+from utils.stats import adjust_project_hours, refresh_stats
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+NAME_SEPARATOR = ";"
+
+
+class AttendanceImportError(ValueError):
+    """Raised when the input has errors; nothing has been written."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__(f"{len(errors)} error(s) in import file")
+        self.errors = errors
+
+
+@dataclass
+class ImportedSession:
+    row: int
+    prowadzacy_id: int
+    data: datetime
+    czas_trwania: float
+    obecni: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ImportResult:
+    sessions: int = 0
+    attendance: int = 0
+    participants_created: int = 0
+
+
+def read_records(stream, fmt: str) -> Tuple[List[dict], List[int]]:
+    """Read raw records from a binary or text ``stream`` in ``csv`` or ``json``.
+
+    Returns the records and the number errors report for each: the file line
+    the record starts on for CSV (quoted fields may span lines), its position
+    in the list for JSON.
+    """
+    data = stream.read()
+    if isinstance(data, bytes):
+        try:
+            data = data.decode("utf-8-sig")
+        except UnicodeDecodeError as exc:
+            raise AttendanceImportError([f"File is not UTF-8 encoded: {exc}"])
+    if fmt == "json":
+        try:
+            records = json.loads(data)
+        except json.JSONDecodeError as exc:
+            raise AttendanceImportError([f"Invalid JSON: {exc}"])
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            raise AttendanceImportError(["JSON must be a list of objects"])
+        return records, list(range(1, len(records) + 1))
+    if fmt == "csv":
+        return _read_csv(data)
+    raise AttendanceImportError([f"Unsupported format: {fmt}"])
+
+
+def format_from_filename(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+
+def _read_csv(data: str) -> Tuple[List[dict], List[int]]:
+    reader = csv.reader(io.StringIO(data))
+    header = next(reader, [])
+    records, rows = [], []
+    line = reader.line_num
+    for values in reader:
+        # Blank lines are skipped like csv.DictReader does.
+        if values:
+            records.append(dict(zip(header, values)))
+            rows.append(line + 1)
+        line = reader.line_num
+    return records, rows
+
+
+def _parse_names(value) -> List[str]:
+    if value is None:
+        return []
+    names = value if isinstance(value, list) else str(value).split(NAME_SEPARATOR)
+    unique = {}
+    for name in names:
+        name = str(name).strip()
+        if name:
+            unique.setdefault(name.lower(), name)
+    return list(unique.values())
+
+
+def _parse_record(
+    record: dict, row: int, trainers: dict
+) -> Tuple[Optional[ImportedSession], List[str]]:
+    errors = []
+    try:
+        trainer_id = int(str(record.get("prowadzacy_id", "")).strip())
+    except ValueError:
+        return None, [f"Row {row}: invalid prowadzacy_id {record.get('prowadzacy_id')!r}"]
+    trainer = trainers.get(trainer_id)
+    if trainer is None:
+        errors.append(f"Row {row}: trainer {trainer_id} does not exist")
+
+    try:
+        data = datetime.fromisoformat(str(record.get("data", "")).strip())
+    except ValueError:
+        errors.append(f"Row {row}: invalid date {record.get('data')!r}")
+        data = None
+    else:
+        # Session dates are naive local time; an offset would break comparisons.
+        if data.tzinfo is not None:
+            errors.append(f"Row {row}: date {record.get('data')!r} must not have a time zone")
+            data = None
+
+    raw_czas = record.get("czas_trwania")
+    czas = None
+    if raw_czas not in (None, ""):
+        try:
+            czas = float(str(raw_czas).replace(",", "."))
+        except ValueError:
+            errors.append(f"Row {row}: invalid czas_trwania {raw_czas!r}")
+    elif trainer is not None:
+        czas = trainer.domyslny_czas
+        if czas is None:
+            errors.append(f"Row {row}: czas_trwania missing and trainer has no default")
+    if czas is not None and czas <= 0:
+        errors.append(f"Row {row}: czas_trwania must be positive")
+
+    if errors:
+        return None, errors
+    return ImportedSession(row, trainer_id, data, czas, _parse_names(record.get("obecni"))), []
+
+
+def validate_records(
+    records: Iterable[dict],
+    create_participants: bool = False,
+    rows: Optional[Iterable[int]] = None,
+) -> Tuple[List[ImportedSession], dict, List[Tuple[int, str]]]:
+    """Check every record against the database without writing anything.
+
+    Errors name each record by its number in ``rows`` (as returned by
+    :func:`read_records`), by default its position counted from 1.
+
+    Returns the parsed sessions, a ``{(trainer_id, lower-case name): id}``
+    map of existing participants and the participants that must be created.
+    Raises :class:`AttendanceImportError` listing every problem found.
+    """
+    records = list(records)
+    rows = list(rows) if rows is not None else range(1, len(records) + 1)
+    trainer_ids = set()
+    for record in records:
+        try:
+            trainer_ids.add(int(str(record.get("prowadzacy_id", "")).strip()))
+        except ValueError:
+            pass
+    trainers = {
+        t.id: t for t in Prowadzacy.query.filter(Prowadzacy.id.in_(trainer_ids)).all()
+    }
+    participants = {
+        (u.prowadzacy_id, (u.imie_nazwisko or "").strip().lower()): u.id
+        for u in Uczestnik.query.filter(Uczestnik.prowadzacy_id.in_(trainers)).all()
+    }
+
+    sessions, errors, missing = [], [], {}
+    for row, record in zip(rows, records):
+        session, record_errors = _parse_record(record, row, trainers)
+        errors.extend(record_errors)
+        if session is None:
+            continue
+        for name in session.obecni:
+            key = (session.prowadzacy_id, name.lower())
+            if key in participants or key in missing:
+                continue
+            if create_participants:
+                missing[key] = (session.prowadzacy_id, name)
+            else:
+                errors.append(
+                    f"Row {row}: participant {name!r} not found for trainer {session.prowadzacy_id}"
+                )
+        sessions.append(session)
+    if not records:
+        errors.append("No records to import")
+    if errors:
+        raise AttendanceImportError(errors)
+    return sessions, participants, list(missing.values())
+
+
+def _batches(rows: list, size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def _insert_returning_ids(conn, table, rows: list, batch_size: int) -> List[int]:
+    ids = []
+    for batch in _batches(rows, batch_size):
+        result = conn.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True), batch
+        )
+        ids.extend(result.scalars().all())
+    return ids
+
+
+def import_records(
+    records: Iterable[dict],
+    create_participants: bool = False,
+    batch_size: int = BATCH_SIZE,
+    rows: Optional[Iterable[int]] = None,
+) -> ImportResult:
+    """Validate ``records`` and insert them in one transaction.
+
+    Stats and the project-hours counter are refreshed in the same
+    transaction, as the inserts bypass the ORM flush hooks.
+    """
+    sessions, participants, missing = validate_records(records, create_participants, rows)
+    conn = db.session.connection()
+    try:
+        new_ids = _insert_returning_ids(
+            conn,
+            Uczestnik.__table__,
+            [{"imie_nazwisko": name, "prowadzacy_id": trainer_id} for trainer_id, name in missing],
+            batch_size,
+        )
+        for (trainer_id, name), new_id in zip(missing, new_ids):
+            participants[(trainer_id, name.lower())] = new_id
+
+        session_ids = _insert_returning_ids(
+            conn,
+            Zajecia.__table__,
+            [
+                {
+                    "prowadzacy_id": s.prowadzacy_id,
+                    "data": s.data,
+                    "czas_trwania": s.czas_trwania,
+                    "wyslano": False,
+                }
+                for s in sessions
+            ],
+            batch_size,
+        )
+        attendance = [
+            {
+                "zajecia_id": session_id,
+                "uczestnik_id": participants[(s.prowadzacy_id, name.lower())],
+            }
+            for s, session_id in zip(sessions, session_ids)
+            for name in s.obecni
+        ]
+        for batch in _batches(attendance, batch_size):
+            conn.execute(insert(obecnosci), batch)
+
+        refresh_stats(
+            conn,
+            {(s.prowadzacy_id, s.data.year, s.data.month) for s in sessions},
+            {row["uczestnik_id"] for row in attendance} | set(new_ids),
+        )
+        adjust_project_hours(
+            conn, current=[(s.prowadzacy_id, s.data, s.czas_trwania) for s in sessions]
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info(
+        "Imported %s sessions with %s attendance rows", len(sessions), len(attendance)
+    )
+    return ImportResult(len(sessions), len(attendance), len(missing))
+
+
+def import_file(stream, filename: str, create_participants: bool = False) -> ImportResult:
+    """Import a CSV or JSON upload, choosing the format from ``filename``."""
+    records, rows = read_records(stream, format_from_filename(filename))
+    return import_records(records, create_participants, rows=rows)
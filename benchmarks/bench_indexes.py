@@ -0,0 +1,216 @@
+"""Query-plan benchmark for the trainer/date/attendance lookup indexes.
+
+Seeds a temporary SQLite database with synthetic trainers, participants,
+sessions and attendance, then runs the application's hot queries twice: once
+without the lookup indexes and once with them. For every query it prints the
+``EXPLAIN QUERY PLAN`` and the best-of-N timing, so the switch from full
+table scans to index searches is visible.
+
+    python benchmarks/bench_indexes.py --trainers 50 --sessions 20000 --repeat 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import and_, create_engine, func, insert, or_, select  # noqa: E402
+
+from model import (  # noqa: E402
+    db,
+    obecnosci,
+    PasswordResetToken,
+    Prowadzacy,
+    Uczestnik,
+    Uzytkownik,
+    Zajecia,
+)
+
+# Indexes added by migration d51acc5577e9.
+LOOKUP_INDEXES = (
+    "ix_zajecia_prowadzacy_id_data",
+    "ix_zajecia_data",
+    "ix_uczestnik_prowadzacy_id",
+    "uq_obecnosci_zajecia_id_uczestnik_id",
+    "ix_obecnosci_uczestnik_id",
+    "ix_password_reset_token_expires_at",
+)
+
+
+def _indexes():
+    return [
+        index
+        for table in db.metadata.tables.values()
+        for index in table.indexes
+        if index.name in LOOKUP_INDEXES
+    ]
+
+
+def seed(conn, trainers: int, sessions: int, participants: int, rng: random.Random) -> None:
+    conn.execute(
+        insert(Prowadzacy.__table__),
+        [{"id": i, "imie": f"Imie{i}", "nazwisko": f"Nazwisko{i}"} for i in range(1, trainers + 1)],
+    )
+    conn.execute(
+        insert(Uczestnik.__table__),
+        [
+            {"id": i, "imie_nazwisko": f"Uczestnik {i}", "prowadzacy_id": rng.randint(1, trainers)}
+            for i in range(1, participants + 1)
+        ],
+    )
+    by_trainer: dict[int, list[int]] = {}
+    for uid in range(1, participants + 1):
+        by_trainer.setdefault(rng.randint(1, trainers), []).append(uid)
+
+    start = datetime(2023, 1, 1, 10)
+    session_rows = []
+    attendance_rows = []
+    for zid in range(1, sessions + 1):
+        trainer = rng.randint(1, trainers)
+        session_rows.append(
+            {
+                "id": zid,
+                "prowadzacy_id": trainer,
+                "data": start + timedelta(hours=rng.randrange(3 * 365 * 24)),
+                "czas_trwania": rng.choice([1.0, 1.5, 2.0]),
+                "wyslano": False,
+            }
+        )
+        group = by_trainer.get(trainer, [])
+        for uid in rng.sample(group, k=min(len(group), rng.randint(5, 12))):
+            attendance_rows.append({"zajecia_id": zid, "uczestnik_id": uid})
+    conn.execute(insert(Zajecia.__table__), session_rows)
+    conn.execute(insert(obecnosci), attendance_rows)
+
+    conn.execute(
+        insert(Uzytkownik.__table__),
+        [
+            {"id": i, "login": f"user{i}", "haslo_hash": "x", "role": "prowadzacy", "approved": True}
+            for i in range(1, trainers + 1)
+        ],
+    )
+    now = datetime.utcnow()
+    conn.execute(
+        insert(PasswordResetToken.__table__),
+        [
+            {
+                "user_id": rng.randint(1, trainers),
+                "token": f"token{i}",
+                "expires_at": now + timedelta(minutes=rng.randint(-60 * 24 * 90, 60)),
+            }
+            for i in range(sessions)
+        ],
+    )
+
+
+def hot_queries(trainer_id: int, participant_id: int) -> dict:
+    """The lookups the panel, admin views and report generation run most."""
+    month_start, month_end = datetime(2024, 5, 1), datetime(2024, 6, 1)
+    return {
+        "month sessions of trainer": select(Zajecia.__table__)
+        .where(
+            Zajecia.prowadzacy_id == trainer_id,
+            Zajecia.data >= month_start,
+            Zajecia.data < month_end,
+        )
+        .order_by(Zajecia.data),
+        "latest session of trainer": select(Zajecia.__table__)
+        .where(Zajecia.prowadzacy_id == trainer_id)
+        .order_by(Zajecia.data.desc())
+        .limit(1),
+        "deep keyset page of trainer": select(Zajecia.__table__)
+        .where(
+            Zajecia.prowadzacy_id == trainer_id,
+            or_(
+                Zajecia.data < month_start,
+                and_(Zajecia.data == month_start, Zajecia.id < 1),
+            ),
+        )
+        .order_by(Zajecia.data.desc(), Zajecia.id.desc())
+        .limit(11),
+        "sessions in date range": select(func.count())
+        .select_from(Zajecia.__table__)
+        .where(Zajecia.data >= month_start, Zajecia.data < month_end),
+        "attendance stats of trainer": select(
+            obecnosci.c.uczestnik_id, func.count(obecnosci.c.zajecia_id)
+        )
+        .join(Zajecia.__table__, Zajecia.id == obecnosci.c.zajecia_id)
+        .where(Zajecia.prowadzacy_id == trainer_id)
+        .group_by(obecnosci.c.uczestnik_id),
+        "sessions of participant": select(obecnosci.c.zajecia_id).where(
+            obecnosci.c.uczestnik_id == participant_id
+        ),
+        "participants of trainer": select(Uczestnik.__table__).where(
+            Uczestnik.prowadzacy_id == trainer_id
+        ),
+        "expired reset tokens": select(func.count())
+        .select_from(PasswordResetToken.__table__)
+        .where(PasswordResetToken.expires_at < datetime.utcnow() - timedelta(days=30)),
+    }
+
+
+def explain(conn, query) -> str:
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    return "; ".join(row[-1] for row in rows)
+
+
+def run(conn, queries: dict, repeat: int) -> dict:
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(query).all()
+            timings.append(time.perf_counter() - started)
+        results[name] = (min(timings), explain(conn, query))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trainers", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--participants", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        with engine.begin() as conn:
+            db.metadata.create_all(conn)
+            for index in _indexes():
+                index.drop(conn)
+            seed(conn, args.trainers, args.sessions, args.participants, rng)
+            attendance = conn.execute(select(func.count()).select_from(obecnosci)).scalar()
+        print(
+            f"{args.trainers} trainers, {args.participants} participants, "
+            f"{args.sessions} sessions, {attendance} attendance rows, best of {args.repeat}"
+        )
+
+        queries = hot_queries(trainer_id=args.trainers // 2 or 1, participant_id=1)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+            before = run(conn, queries, args.repeat)
+        with engine.begin() as conn:
+            for index in _indexes():
+                index.create(conn)
+            conn.exec_driver_sql("ANALYZE")
+        with engine.connect() as conn:
+            after = run(conn, queries, args.repeat)
+        engine.dispose()
+
+    for name in queries:
+        (t_before, plan_before), (t_after, plan_after) = before[name], after[name]
+        print(f"\n{name}: {t_before * 1000:.2f}ms -> {t_after * 1000:.2f}ms")
+        print(f"  before: {plan_before}")
+        print(f"  after:  {plan_after}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""End-to-end KSeF invoice throughput benchmark against the local fake API.
+
+Starts :mod:`ksef_fake_server` in-process (or as a subprocess with
+``--subprocess``, or uses a running one with ``--url``) and sends FA(3)
+invoices through :class:`ksef_client.KSeFClient`: authentication, online
+session, encrypted upload and status polling. Prints the wall time,
+invoices per second, per-invoice latency percentiles, the outcome counts and
+the HTTP requests made per invoice, by endpoint.
+
+    python benchmarks/bench_ksef.py --invoices 200 --concurrency 4 --latency 0.02
+    python benchmarks/bench_ksef.py --mode batch --batch-size 50 --processing-time 1
+    python benchmarks/bench_ksef.py --failure-rate 0.02 --fail-endpoint send_invoice
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ksef_client import KSeFClient, KSeFException, clear_public_key_cache  # noqa: E402
+from ksef_fake_server import (  # noqa: E402
+    FakeKSeFServer,
+    add_service_arguments,
+    service_options,
+)
+from ksef_invoice import create_invoice_from_monthly_report, generate_fa3_xml  # noqa: E402
+
+
+def build_invoices(count: int) -> list[str]:
+    return [
+        generate_fa3_xml(
+            create_invoice_from_monthly_report(
+                hours=1 + index % 40, month=1 + index % 12, year=2025, counter=index + 1
+            )
+        )
+        for index in range(count)
+    ]
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[start : start + size] for start in range(0, len(items), size)]
+
+
+def run(client: KSeFClient, invoices: list[str], args: argparse.Namespace) -> tuple:
+    """Send ``invoices``; return (wall seconds, per-invoice seconds, outcomes)."""
+    wait = not args.no_wait
+
+    def send_one(xml):
+        started = time.perf_counter()
+        try:
+            result = client.send_invoice(xml, wait_for_completion=wait)
+        except (KSeFException, OSError):
+            return [(time.perf_counter() - started, "error")]
+        return [(time.perf_counter() - started, _outcome(result, wait))]
+
+    def send_batch(batch):
+        started = time.perf_counter()
+        try:
+            results = client.send_invoices(batch, wait_for_completion=wait)
+        except (KSeFException, OSError):
+            return [(time.perf_counter() - started, "error")] * len(batch)
+        elapsed = time.perf_counter() - started
+        return [(elapsed, _outcome(result, wait)) for result in results]
+
+    if args.mode == "batch":
+        work, call = _chunks(invoices, args.batch_size), send_batch
+    else:
+        work, call = invoices, send_one
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        measured = [item for items in pool.map(call, work) for item in items]
+    wall = time.perf_counter() - started
+    return wall, [seconds for seconds, _ in measured], Counter(outcome for _, outcome in measured)
+
+
+def _outcome(result, waited: bool) -> str:
+    if not result.invoice_reference_number:
+        return "error"
+    if not waited:
+        return "uploaded"
+    if result.success:
+        return "accepted"
+    return "rejected" if result.invoice_status_code is not None else "pending"
+
+
+def _fetch_stats(url: str) -> Counter:
+    import requests
+
+    return Counter(requests.get(f"{url}/_fake/stats", timeout=10).json()["requests"])
+
+
+def _start_subprocess(args: argparse.Namespace) -> tuple:
+    command = [sys.executable, os.path.join(ROOT, "ksef_fake_server.py"), "--port", "0"]
+    options = service_options(args)
+    for name in ("nip", "token", "latency", "jitter", "processing_time", "failure_rate",
+                 "rejection_rate", "seed"):
+        if options[name] is not None:
+            command += [f"--{name.replace('_', '-')}", str(options[name])]
+    for endpoint in sorted(options["fail_endpoints"]):
+        command += ["--fail-endpoint", endpoint]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # "Fake KSeF listening on <url> (...)"
+    url = process.stdout.readline().split(" on ", 1)[1].split()[0]
+    return process, url
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=100)
+    parser.add_argument("--mode", choices=("single", "batch"), default="single",
+                        help="one session per invoice or send_invoices batches")
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--concurrency", type=int, default=1, help="sending threads")
+    parser.add_argument("--no-wait", action="store_true", help="don't poll for final status")
+    parser.add_argument("--url", help="base URL of an already running fake server")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="run the fake server in a separate process")
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    invoices = build_invoices(args.invoices)
+    server = process = None
+    if args.url:
+        url = args.url.rstrip("/")
+    elif args.subprocess:
+        process, url = _start_subprocess(args)
+    else:
+        server = FakeKSeFServer(**service_options(args)).start()
+        url = server.url
+
+    clear_public_key_cache()
+    client = KSeFClient("demo", args.nip, args.token, base_url=url)
+    try:
+        before = _fetch_stats(url)
+        wall, latencies, outcomes = run(client, invoices, args)
+        requests_made = _fetch_stats(url) - before
+    finally:
+        client.close()
+        if server is not None:
+            server.stop()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    requests_made.pop("stats", None)
+    quantiles = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else latencies * 19
+    print(
+        f"{args.invoices} invoices, mode {args.mode}"
+        + (f" (batch {args.batch_size})" if args.mode == "batch" else "")
+        + f", concurrency {args.concurrency}, latency {args.latency * 1000:g}ms"
+        + f", processing {args.processing_time:g}s, failure rate {args.failure_rate:g}"
+    )
+    print(f"wall time:  {wall:.2f}s")
+    print(f"throughput: {args.invoices / wall:.1f} invoices/s")
+    print(
+        f"latency:    p50 {quantiles[9] * 1000:.0f}ms, p95 {quantiles[18] * 1000:.0f}ms,"
+        f" max {max(latencies) * 1000:.0f}ms"
+    )
+    print("outcomes:   " + ", ".join(f"{name} {count}" for name, count in sorted(outcomes.items())))
+    total = sum(requests_made.values())
+    print(f"requests:   {total} ({total / args.invoices:.1f} per invoice)")
+    for endpoint, count in requests_made.most_common():
+        print(f"  {endpoint:<18} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmark for signature background removal.
+
+Compares the former per-pixel loop with :func:`utils.process_signature` on a
+synthetic phone-camera scan. Each variant runs in a fresh process so the peak
+resident memory it reports is its own.
+
+    python benchmarks/bench_signature.py --size 4000x3000 --repeat 3
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+
+def make_scan(width: int, height: int) -> bytes:
+    """Return a JPEG with an off-white, noisy background and dark strokes."""
+    rng = random.Random(0)
+    img = Image.effect_noise((width, height), 6).point(lambda v: min(255, v + 130))
+    img = Image.merge("RGB", (img, img, img))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(4)]
+        draw.line(points, fill=(20, 20, 60), width=max(2, width // 300))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def legacy(data: bytes) -> bytes:
+    img = Image.open(io.BytesIO(data))
+    img = img.convert("RGBA")
+    new_data = []
+    for item in img.getdata():
+        if item[0] > 250 and item[1] > 250 and item[2] > 250:
+            new_data.append((255, 255, 255, 0))
+        else:
+            new_data.append(item)
+    img.putdata(new_data)
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def current(data: bytes) -> bytes:
+    import utils
+
+    utils.REMOVE_SIGNATURE_BG = True
+    utils._load_rembg = lambda: None  # measure only our own image processing
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.mkdir("static")
+            filename = utils.process_signature(io.BytesIO(data))
+            with open(os.path.join("static", filename), "rb") as fh:
+                return fh.read()
+        finally:
+            os.chdir(cwd)
+
+
+VARIANTS = {"before (per-pixel)": legacy, "after (bands)": current}
+
+
+def _measure(name: str, data: bytes, repeat: int, queue) -> None:
+    func = VARIANTS[name]
+    if func is current:
+        import utils  # noqa: F401  keep import cost out of the measurement
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - started)
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((min(timings), py_peak, (rss_peak - rss_before) * 1024))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="4000x3000", help="scan size, WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    data = make_scan(width, height)
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{width}x{height} JPEG, {len(data) / 1024:.0f} KiB, best of {args.repeat}")
+    print(f"{'variant':<20} {'time':>9} {'py peak':>10} {'rss growth':>11}")
+    for name in VARIANTS:
+        queue = context.Queue()
+        proc = context.Process(target=_measure, args=(name, data, args.repeat, queue))
+        proc.start()
+        seconds, py_peak, rss = queue.get()
+        proc.join()
+        print(
+            f"{name:<20} {seconds * 1000:>7.0f}ms "
+            f"{py_peak / 2**20:>8.1f}MB {rss / 2**20:>9.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Startup import benchmark based on ``python -X importtime``.
+
+Imports the application module in a fresh interpreter and reports the total
+import time, the slowest top-level imports and whether any of the heavy
+optional dependencies were loaded eagerly.
+
+    python benchmarks/bench_startup.py [--module app] [--top 15] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed for signature cleanup, invoice PDFs and KSeF submission.
+HEAVY_MODULES = ("rembg", "onnxruntime", "reportlab", "cryptography", "requests")
+
+
+def measure(module: str = "app") -> dict:
+    """Import ``module`` with ``-X importtime`` and summarise the result."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    children = []
+    pending = []
+    for line in proc.stderr.splitlines():
+        parsed = _parse_line(line)
+        if parsed is None:
+            continue
+        name, self_us, cumulative_us = parsed
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        imports.append((name, cumulative_us))
+        # -X importtime prints children before their parent.
+        if depth == 1:
+            pending.append((name, cumulative_us))
+        elif depth == 0:
+            if name == module:
+                children = pending
+            pending = []
+    total = next((cum for name, cum in imports if name == module), 0)
+    return {
+        "module": module,
+        "total_ms": total / 1000,
+        "heavy_loaded": sorted(
+            {name for name, _ in imports if name.split(".")[0] in HEAVY_MODULES}
+        ),
+        "top": [
+            {"module": name, "cumulative_ms": cum / 1000}
+            for name, cum in sorted(children, key=lambda item: -item[1])
+        ],
+    }
+
+
+def _parse_line(line: str):
+    """Parse ``import time: self | cumulative | name``; None for other lines."""
+    if not line.startswith("import time:"):
+        return None
+    try:
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|", 2)
+        return name.rstrip(), int(self_us), int(cumulative_us)
+    except ValueError:  # the header line
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print the raw summary")
+    args = parser.parse_args()
+
+    result = measure(args.module)
+    result["top"] = result["top"][: args.top]
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"import {result['module']}: {result['total_ms']:.0f} ms")
+    for item in result["top"]:
+        print(f"  {item['cumulative_ms']:>8.1f} ms  {item['module']}")
+    heavy = ", ".join(result["heavy_loaded"]) or "none"
+    print(f"heavy optional modules loaded at startup: {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 from docx import Document
+from docx.oxml.shape import CT_Inline
 from docx.shared import Pt, Cm
+from collections import defaultdict
+from dataclasses import dataclass, field
+from io import BytesIO
+import copy
+import hashlib
 import logging
 import os
+import threading
 
 def ensure_template_exists(path: str) -> None:
     """Raise ``RuntimeError`` if template ``path`` does not exist."""
@@ -10,111 +17,244 @@ def ensure_template_exists(path: str) -> None:
         raise RuntimeError(f"Template file not found: {path}")
 
 logger = logging.getLogger(__name__)
-
+
+
+@dataclass
+class CompiledTemplate:
+    """A DOCX template parsed once and cloned for every generated document.
+
+    ``slots`` holds the placeholder locations found by the scanner the
+    template was compiled with. Only the main document part is copied by
+    :meth:`render`; styles, numbering, headers and other parts are shared
+    with the pristine template because the generators never modify them.
+    """
+
+    mtime_ns: int
+    size: int
+    digest: str
+    document: object
+    slots: dict = field(default_factory=dict)
+
+    def render(self):
+        """Return a fresh, independently modifiable copy of the template."""
+        main_part = self.document.part
+        memo = {
+            id(part): part
+            for part in main_part.package.iter_parts()
+            if part is not main_part
+        }
+        with _template_lock:
+            return copy.deepcopy(main_part, memo).document
+
+
+_template_cache: dict[tuple[str, str], CompiledTemplate] = {}
+_template_lock = threading.Lock()
+
+
+def get_compiled_template(path: str, scan) -> CompiledTemplate:
+    """Return the compiled form of template ``path`` using ``scan`` for slots.
+
+    The template is re-read only when its mtime or size changes, and
+    re-parsed only when its content hash changes as well.
+    """
+    ensure_template_exists(path)
+    stat = os.stat(path)
+    key = (os.path.abspath(path), scan.__name__)
+    with _template_lock:
+        cached = _template_cache.get(key)
+    if cached and (cached.mtime_ns, cached.size) == (stat.st_mtime_ns, stat.st_size):
+        return cached
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if cached and cached.digest == digest:
+        cached.mtime_ns, cached.size = stat.st_mtime_ns, stat.st_size
+        return cached
+
+    logger.debug("Kompilacja szablonu %s", path)
+    document = Document(BytesIO(data))
+    compiled = CompiledTemplate(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        digest=digest,
+        document=document,
+        slots=scan(document),
+    )
+    with _template_lock:
+        _template_cache[key] = compiled
+    return compiled
+
+
+def _scan_lista(doc) -> dict:
+    """Locate the title, date line and tables of the attendance template."""
+    title, date_line = [], []
+    for idx, para in enumerate(doc.paragraphs):
+        if "Lista obecności" in para.text:
+            title.append(idx)
+        if "Data zajęć:" in para.text and "Czas trwania zajęć:" in para.text:
+            date_line.append(idx)
+    return {
+        "title": title,
+        "date_line": date_line,
+        "has_tables": len(doc.tables) >= 2,
+    }
+
+
 def generuj_liste_obecnosci(data, czas, obecni, trener, podpis_path, nazwa_zajec=None):
-    template = "szablon.docx"
-    ensure_template_exists(template)
-    doc = Document(template)
-
-    for para in doc.paragraphs:
-        if "Lista obecności" in para.text and nazwa_zajec:
-            para.text = f"Lista obecności – {nazwa_zajec}"
+    compiled = get_compiled_template("szablon.docx", _scan_lista)
+    slots = compiled.slots
+    doc = compiled.render()
+
+    paragraphs = doc.paragraphs
+    if nazwa_zajec:
+        for idx in slots["title"]:
+            paragraphs[idx].text = f"Lista obecności – {nazwa_zajec}"
+    for idx in slots["date_line"]:
+        if nazwa_zajec and idx in slots["title"]:
             continue
-        if "Data zajęć:" in para.text and "Czas trwania zajęć:" in para.text:
-            para.text = f"Data zajęć: {data}    Czas trwania zajęć: {czas}"
-
-    if len(doc.tables) >= 2:
-        tabela_uczestnicy = doc.tables[0]
-        for i in range(1, len(tabela_uczestnicy.rows)):
-            if i - 1 < len(obecni):
-                cell = tabela_uczestnicy.cell(i, 0)
-                cell.text = obecni[i - 1]
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.size = Pt(10)
-            else:
-                for cell in tabela_uczestnicy.row_cells(i):
-                    cell.text = ""
-
-        tabela_trener = doc.tables[1]
-        tabela_trener.cell(1, 0).text = trener
-        if podpis_path and os.path.exists(podpis_path):
-            try:
+        paragraphs[idx].text = f"Data zajęć: {data}    Czas trwania zajęć: {czas}"
+
+    if slots["has_tables"]:
+        tabela_uczestnicy = doc.tables[0]
+        for i in range(1, len(tabela_uczestnicy.rows)):
+            if i - 1 < len(obecni):
+                cell = tabela_uczestnicy.cell(i, 0)
+                cell.text = obecni[i - 1]
+                for paragraph in cell.paragraphs:
+                    for run in paragraph.runs:
+                        run.font.size = Pt(10)
+            else:
+                for cell in tabela_uczestnicy.row_cells(i):
+                    cell.text = ""
+
+        tabela_trener = doc.tables[1]
+        tabela_trener.cell(1, 0).text = trener
+        if podpis_path and os.path.exists(podpis_path):
+            try:
                 run = tabela_trener.cell(1, 1).paragraphs[0].clear().add_run()
                 run.add_picture(podpis_path, width=Cm(3.5))
             except Exception:
                 logger.exception("Błąd przy podpisie")
-
-    return doc
-
+
+    return doc
+
+class _SignatureStamp:
+    """Signature image embedded once and referenced from many paragraphs."""
+
+    def __init__(self, part, podpis_path):
+        self.part = part
+        self.rId, self.image = part.get_or_add_image(podpis_path)
+
+    def add_to(self, paragraph, width):
+        cx, cy = self.image.scaled_dimensions(width, None)
+        inline = CT_Inline.new_pic_inline(
+            self.part.next_id, self.rId, self.image.filename, cx, cy
+        )
+        paragraph.clear().add_run()._r.add_drawing(inline)
+
+
+def _scan_raport(doc) -> dict:
+    """Locate header lines, day rows, totals and signature lines of the report."""
+    headers, signatures = [], []
+    for idx, para in enumerate(doc.paragraphs):
+        text = para.text.lower()
+        if "zleceniobiorca:" in text:
+            headers.append((idx, "zleceniobiorca"))
+        elif "zlecenia nr" in text:
+            headers.append((idx, "umowa"))
+        elif text.strip().startswith("w "):
+            headers.append((idx, "miesiac"))
+        elif "(czytelny podpis zleceniobiorcy)" in text:
+            signatures.append(idx)
+
+    day_rows = []
+    for t_idx, tabela in enumerate(doc.tables):
+        for r_idx, row in enumerate(tabela.rows):
+            dzien = None
+            for cell in row.cells:
+                for par in cell.paragraphs:
+                    txt_clean = par.text.strip().rstrip(".").strip().lstrip("0")
+                    if txt_clean.isdigit():
+                        dzien = int(txt_clean)
+            if dzien:
+                day_rows.append((t_idx, r_idx, dzien))
+
+    total_cells = []
+    if doc.tables:
+        for r_idx, row in enumerate(doc.tables[-1].rows):
+            for c_idx, cell in enumerate(row.cells):
+                if "łącznie" in cell.text.lower():
+                    total_cells.append((r_idx, c_idx))
+
+    return {
+        "headers": headers,
+        "day_rows": day_rows,
+        "total_cells": total_cells,
+        "signatures": signatures,
+    }
+
+
 def generuj_raport_miesieczny(prowadzacy, zajecia, szablon_path, podpis_dir, miesiac, rok):
-    ensure_template_exists(szablon_path)
-    doc = Document(szablon_path)
+    compiled = get_compiled_template(szablon_path, _scan_raport)
+    slots = compiled.slots
+    doc = compiled.render()
     logger.debug("Generowanie raportu dla miesiąca: %s rok: %s", miesiac, rok)
-
-    for para in doc.paragraphs:
-        if "zleceniobiorca:" in para.text.lower():
-            para.text = f"Zleceniobiorca: {prowadzacy.imie} {prowadzacy.nazwisko}"
-        elif "zlecenia nr" in para.text.lower():
-            para.text = f"Rozliczenie liczby godzin wykonywania usług do umowy zlecenia nr {prowadzacy.numer_umowy}"
-        elif para.text.strip().lower().startswith("w "):
-            para.text = f"w {miesiac:02d}.{rok}"
-
-    dni_miesiaca = [d for d in zajecia if d.data.month == miesiac and d.data.year == rok]
-    logger.debug("Liczba zajęć w miesiącu: %s", len(dni_miesiaca))
-
-    suma = 0
-    for tabela in doc.tables:
-        for row in tabela.rows:
-            dzien = None
-            for col_idx, cell in enumerate(row.cells):
-                for par in cell.paragraphs:
-                    txt = par.text.strip()
-                    logger.debug("Zawartość komórki: '%s'", txt)
-                    txt_clean = txt.rstrip(".").strip().lstrip("0")
-                    if txt_clean.isdigit():
-                        dzien = int(txt_clean)
-                        logger.debug("Sprawdzam dzień: %s", dzien)
-            if dzien:
-                laczny_czas = sum(
-                    float(str(zaj.czas_trwania).replace(",", ".")) for zaj in dni_miesiaca if zaj.data.day == dzien
-                )
-                if laczny_czas > 0:
-                    logger.debug("Łączny czas zajęć dla dnia %s: %s", dzien, laczny_czas)
-                    godziny_txt = str(laczny_czas).replace(".0", "") + "h"
-                    if len(row.cells) >= 3:
-                        row.cells[1].text = godziny_txt
-                        podpis_path = os.path.join(podpis_dir, prowadzacy.podpis_filename)
-                        if os.path.exists(podpis_path):
-                            try:
-                                row.cells[2].paragraphs[0].clear().add_run().add_picture(podpis_path, width=Cm(2.5))
-                            except Exception:
-                                logger.exception("Błąd podpisu przy dniu %s", dzien)
-                    suma += laczny_czas
-
-    for row in doc.tables[-1].rows:
-        zawiera_lacznie = any("łącznie" in cell.text.lower() for cell in row.cells)
-        if zawiera_lacznie:
-            for idx, cell in enumerate(row.cells):
-                if "łącznie" in cell.text.lower():
-                    if idx + 1 < len(row.cells):
-                        row.cells[idx + 1].text = str(suma).replace(".0", "") + "h"
-                    if idx + 2 < len(row.cells):
-                        podpis_path = os.path.join(podpis_dir, prowadzacy.podpis_filename)
-                        if os.path.exists(podpis_path):
-                            try:
-                                row.cells[idx + 2].paragraphs[0].clear().add_run().add_picture(podpis_path, width=Cm(2.5))
-                            except Exception:
-                                logger.exception("Błąd podpisu w wierszu 'Łącznie'")
-
-    for par in doc.paragraphs:
-        if "(czytelny podpis zleceniobiorcy)" in par.text.lower():
-            podpis_path = os.path.join(podpis_dir, prowadzacy.podpis_filename)
-            if os.path.exists(podpis_path):
-                try:
-                    par.clear().add_run().add_picture(podpis_path, width=Cm(3.5))
-                except Exception:
-                    logger.exception("Błąd podpisu na dole")
-
-    return doc
-
+
+    paragraphs = doc.paragraphs
+    for idx, kind in slots["headers"]:
+        if kind == "zleceniobiorca":
+            paragraphs[idx].text = f"Zleceniobiorca: {prowadzacy.imie} {prowadzacy.nazwisko}"
+        elif kind == "umowa":
+            paragraphs[idx].text = f"Rozliczenie liczby godzin wykonywania usług do umowy zlecenia nr {prowadzacy.numer_umowy}"
+        else:
+            paragraphs[idx].text = f"w {miesiac:02d}.{rok}"
+
+    godziny = defaultdict(float)
+    liczba_zajec = 0
+    for zaj in zajecia:
+        if zaj.data.month == miesiac and zaj.data.year == rok:
+            godziny[zaj.data.day] += float(str(zaj.czas_trwania).replace(",", "."))
+            liczba_zajec += 1
+    logger.debug("Liczba zajęć w miesiącu: %s", liczba_zajec)
+
+    stamp = None
+    podpis_path = (
+        os.path.join(podpis_dir, prowadzacy.podpis_filename)
+        if prowadzacy.podpis_filename
+        else None
+    )
+    if podpis_path and os.path.exists(podpis_path):
+        try:
+            stamp = _SignatureStamp(doc.part, podpis_path)
+        except Exception:
+            logger.exception("Błąd odczytu podpisu %s", podpis_path)
+
+    tabele = doc.tables
+    suma = 0
+    for t_idx, r_idx, dzien in slots["day_rows"]:
+        laczny_czas = godziny.get(dzien, 0)
+        if laczny_czas > 0:
+            logger.debug("Łączny czas zajęć dla dnia %s: %s", dzien, laczny_czas)
+            row = tabele[t_idx].rows[r_idx]
+            cells = row.cells
+            if len(cells) >= 3:
+                cells[1].text = str(laczny_czas).replace(".0", "") + "h"
+                if stamp:
+                    stamp.add_to(cells[2].paragraphs[0], Cm(2.5))
+            suma += laczny_czas
+
+    if tabele:
+        rows = tabele[-1].rows
+        for r_idx, idx in slots["total_cells"]:
+            cells = rows[r_idx].cells
+            if idx + 1 < len(cells):
+                cells[idx + 1].text = str(suma).replace(".0", "") + "h"
+            if idx + 2 < len(cells) and stamp:
+                stamp.add_to(cells[idx + 2].paragraphs[0], Cm(2.5))
+
+    if stamp:
+        for idx in slots["signatures"]:
+            stamp.add_to(paragraphs[idx], Cm(3.5))
+
+    return doc
@@ -0,0 +1,351 @@
+"""Streaming CSV and XLSX exports of sessions, attendance and hours.
+
+Rows are read with ``yield_per`` so the database driver hands them over in
+batches, and are written straight into a generator that Flask streams to the
+client. Memory use therefore does not grow with the length of the history.
+
+XLSX files are produced without extra dependencies: the workbook is a zip
+archive written to a non-seekable sink, with the sheet XML compressed row by
+row and cell text stored inline.
+"""
+import csv
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import chain, groupby
+from typing import Iterable, Iterator, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+from sqlalchemy import extract, func, select
+
+from model import (
+    db,
+    obecnosci,
+    ArchivedParticipant,
+    ArchivedProject,
+    Prowadzacy,
+    Uczestnik,
+    Zajecia,
+)
+
+YIELD_PER = 1000
+# Rows buffered before a chunk is handed to the response.
+CHUNK_ROWS = 500
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+DATE_FORMAT = "%Y-%m-%d"
+
+
+@dataclass
+class ExportFilters:
+    prowadzacy_id: Optional[int] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None  # inclusive day
+    project_id: Optional[int] = None
+
+    @classmethod
+    def from_args(cls, args) -> "ExportFilters":
+        """Build filters from ``prowadzacy_id``, ``od``, ``do`` and ``projekt`` args.
+
+        Raises ``ValueError`` for malformed values.
+        """
+
+        def optional(name, parse):
+            value = (args.get(name) or "").strip()
+            return parse(value) if value else None
+
+        def parse_date(value):
+            return datetime.strptime(value, DATE_FORMAT)
+
+        filters = cls(
+            prowadzacy_id=optional("prowadzacy_id", int),
+            date_from=optional("od", parse_date),
+            date_to=optional("do", parse_date),
+            project_id=optional("projekt", int),
+        )
+        if filters.date_from and filters.date_to and filters.date_from > filters.date_to:
+            raise ValueError("date range is empty")
+        return filters
+
+    def apply(self, query):
+        """Restrict a ``SELECT`` over ``zajecia`` to the trainer and date range."""
+        if self.prowadzacy_id is not None:
+            query = query.where(Zajecia.prowadzacy_id == self.prowadzacy_id)
+        if self.date_from is not None:
+            query = query.where(Zajecia.data >= self.date_from)
+        if self.date_to is not None:
+            query = query.where(Zajecia.data < self.date_to + timedelta(days=1))
+        return query
+
+
+@dataclass
+class Export:
+    name: str
+    header: List[str]
+    rows: Iterable[Sequence]
+
+
+def _stream(query) -> Iterator:
+    """Iterate ``query`` in ``YIELD_PER`` batches without loading all rows."""
+    return iter(db.session.execute(query.execution_options(yield_per=YIELD_PER)))
+
+
+def _trainer_name():
+    return func.trim(
+        func.coalesce(Prowadzacy.imie, "") + " " + func.coalesce(Prowadzacy.nazwisko, "")
+    )
+
+
+def session_export(filters: ExportFilters) -> Export:
+    """One row per session with its attendees; the columns match the import."""
+    query = filters.apply(
+        select(
+            Zajecia.id,
+            Zajecia.prowadzacy_id,
+            _trainer_name(),
+            Zajecia.data,
+            Zajecia.czas_trwania,
+            Zajecia.wyslano,
+            Uczestnik.imie_nazwisko,
+        )
+        .outerjoin(Prowadzacy, Prowadzacy.id == Zajecia.prowadzacy_id)
+        .outerjoin(obecnosci, obecnosci.c.zajecia_id == Zajecia.id)
+        .outerjoin(Uczestnik, Uczestnik.id == obecnosci.c.uczestnik_id)
+    ).order_by(Zajecia.data, Zajecia.id, Uczestnik.imie_nazwisko)
+
+    def rows():
+        for _id, group in groupby(_stream(query), key=lambda r: r[0]):
+            group = list(group)
+            _id, trainer_id, trainer, data, czas, wyslano, _name = group[0]
+            names = [r[-1] for r in group if r[-1] is not None]
+            yield (trainer_id, trainer, data, czas, len(names), ";".join(names), bool(wyslano))
+
+    return Export(
+        "zajecia",
+        [
+            "prowadzacy_id",
+            "prowadzacy",
+            "data",
+            "czas_trwania",
+            "liczba_obecnych",
+            "obecni",
+            "wyslano",
+        ],
+        rows(),
+    )
+
+
+def attendance_matrix_export(filters: ExportFilters) -> Export:
+    """Sessions of one trainer as rows, their participants as 1/0 columns."""
+    if filters.prowadzacy_id is None:
+        raise ValueError("attendance matrix needs prowadzacy_id")
+    participants = db.session.execute(
+        select(Uczestnik.id, Uczestnik.imie_nazwisko)
+        .where(Uczestnik.prowadzacy_id == filters.prowadzacy_id)
+        .order_by(func.lower(Uczestnik.imie_nazwisko), Uczestnik.id)
+    ).all()
+    columns = {pid: i for i, (pid, _name) in enumerate(participants)}
+    query = filters.apply(
+        select(Zajecia.id, Zajecia.data, Zajecia.czas_trwania, obecnosci.c.uczestnik_id).outerjoin(
+            obecnosci, obecnosci.c.zajecia_id == Zajecia.id
+        )
+    ).order_by(Zajecia.data, Zajecia.id)
+
+    def rows():
+        for _id, group in groupby(_stream(query), key=lambda r: r[0]):
+            marks = [0] * len(columns)
+            for _id, data, czas, uczestnik_id in group:
+                if uczestnik_id in columns:
+                    marks[columns[uczestnik_id]] = 1
+            yield [data, czas, *marks]
+
+    return Export(
+        "obecnosci", ["data", "czas_trwania", *(name for _pid, name in participants)], rows()
+    )
+
+
+def monthly_hours_export(filters: ExportFilters) -> Export:
+    """Sessions and hours per trainer and month within the filters."""
+    year = extract("year", Zajecia.data)
+    month = extract("month", Zajecia.data)
+    query = (
+        filters.apply(
+            select(
+                Zajecia.prowadzacy_id,
+                _trainer_name(),
+                year,
+                month,
+                func.count(Zajecia.id),
+                func.coalesce(func.sum(Zajecia.czas_trwania), 0.0),
+            ).join(Prowadzacy, Prowadzacy.id == Zajecia.prowadzacy_id)
+        )
+        .group_by(Zajecia.prowadzacy_id, Prowadzacy.imie, Prowadzacy.nazwisko, year, month)
+        .order_by(Prowadzacy.nazwisko, Prowadzacy.imie, Zajecia.prowadzacy_id, year, month)
+    )
+    rows = (
+        (trainer_id, trainer, int(y), int(m), count, hours)
+        for trainer_id, trainer, y, m, count, hours in _stream(query)
+    )
+    return Export(
+        "godziny", ["prowadzacy_id", "prowadzacy", "rok", "miesiac", "zajecia", "godziny"], rows
+    )
+
+
+def archive_export(filters: ExportFilters) -> Export:
+    """Participants of an archived project with their final attendance."""
+    if filters.project_id is None:
+        raise ValueError("archive export needs projekt")
+    if db.session.get(ArchivedProject, filters.project_id) is None:
+        raise LookupError(filters.project_id)
+    query = (
+        select(
+            ArchivedParticipant.participant_name,
+            ArchivedParticipant.trainer_name,
+            ArchivedParticipant.sessions_present,
+            ArchivedParticipant.total_sessions,
+            ArchivedParticipant.percent,
+        )
+        .where(ArchivedParticipant.project_id == filters.project_id)
+        .order_by(ArchivedParticipant.trainer_name, ArchivedParticipant.participant_name)
+    )
+    return Export(
+        f"archiwum_{filters.project_id}",
+        ["uczestnik", "prowadzacy", "obecnosci", "zajecia", "frekwencja"],
+        _stream(query),
+    )
+
+
+EXPORTS = {
+    "zajecia": session_export,
+    "obecnosci": attendance_matrix_export,
+    "godziny": monthly_hours_export,
+    "archiwum": archive_export,
+}
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        if value.hour or value.minute or value.second:
+            return value.strftime("%Y-%m-%d %H:%M")
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def csv_chunks(export: Export) -> Iterator[str]:
+    """Yield the export as CSV text, ``CHUNK_ROWS`` rows at a time."""
+    buf = io.StringIO()
+    buf.write("\ufeff")  # lets Excel detect UTF-8
+    writer = csv.writer(buf)
+    writer.writerow(export.header)
+    for count, row in enumerate(export.rows, start=1):
+        writer.writerow([_text(v) for v in row])
+        if count % CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable file collecting what ``zipfile`` writes."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    "</Types>"
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    "</workbook>"
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    "</Relationships>"
+)
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = "</sheetData></worksheet>"
+# Characters not allowed in XML 1.0 documents.
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_cell(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_INVALID_XML.sub("", _text(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_chunks(export: Export) -> Iterator[bytes]:
+    """Yield the export as an XLSX workbook, compressed as rows arrive."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _ROOT_RELS)
+        archive.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(export.name[:31])))
+        archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(_SHEET_HEAD.encode())
+            for count, row in enumerate(chain([export.header], export.rows)):
+                sheet.write(f"<row>{''.join(_xlsx_cell(v) for v in row)}</row>".encode())
+                if count % CHUNK_ROWS == 0:
+                    yield sink.drain()
+            sheet.write(_SHEET_TAIL.encode())
+    yield sink.drain()
+
+
+def export_chunks(export: Export, fmt: str) -> Iterator:
+    if fmt == "csv":
+        return csv_chunks(export)
+    if fmt == "xlsx":
+        return xlsx_chunks(export)
+    raise ValueError(f"Unsupported format: {fmt}")
@@ -1,20 +1,22 @@
 """Helper functions for invoice generation and sending."""
 import logging
-from typing import Optional, Tuple
+import os
+from typing import List, Optional, Sequence, Tuple
 from io import BytesIO
-from model import Zajecia
 from ksef_invoice import (
+    InvoiceData,
     create_invoice_from_monthly_report,
     generate_fa2_xml,
     increment_invoice_counter,
     is_ksef_enabled,
-    save_invoice_xml
+    save_invoice_xml,
+    take_invoice_counter,
 )
-from ksef_client import send_invoice_to_ksef
-from invoice_pdf import generate_invoice_pdf, save_invoice_pdf
 
 logger = logging.getLogger(__name__)
 
+NO_HOURS_ERROR = "No hours recorded for this month"
+
 
 def _format_ksef_result(result) -> str:
     if not result:
@@ -26,9 +28,10 @@ def _format_ksef_result(result) -> str:
             f"Sesja: {result.session_reference_number}."
         )
     return (
-        "Faktura przekazana do KSeF. "
+        "Faktura przekazana do KSeF, status: oczekuje na przetworzenie. "
         f"Sesja: {result.session_reference_number}, "
-        f"faktura: {result.invoice_reference_number}."
+        f"faktura: {result.invoice_reference_number}. "
+        "Odrzucenie zostanie zgłoszone e-mailem i w panelu administratora."
     )
 
 
@@ -44,16 +47,223 @@ def calculate_monthly_hours(prowadzacy_id: int, month: int, year: int) -> float:
     Returns:
         float: Suma godzin
     """
-    from model import db
-    
-    zajecia = Zajecia.query.filter(
-        Zajecia.prowadzacy_id == prowadzacy_id,
-        db.extract('month', Zajecia.data) == month,
-        db.extract('year', Zajecia.data) == year
-    ).all()
-    
-    total_hours = sum(z.czas_trwania or 0 for z in zajecia)
-    return total_hours
+    from utils import get_month_hours
+
+    return float(get_month_hours(prowadzacy_id, month, year))
+
+
+def build_invoice_files(
+    hours: float,
+    month: int,
+    year: int,
+    trainer_name: Optional[str] = None,
+    counter: Optional[int] = None,
+    save_to_disk: bool = True,
+) -> Tuple[InvoiceData, str, BytesIO, Optional[str]]:
+    """
+    Tworzy fakturę, jej XML FA(3) i PDF bez dostępu do bazy danych.
+
+    Dzięki temu może działać w procesie roboczym ``generate-reports --jobs``.
+
+    Args:
+        hours: Suma godzin w miesiącu
+        month: Miesiąc (1-12)
+        year: Rok
+        trainer_name: Imię i nazwisko prowadzącego (opcjonalne)
+        counter: Numer faktury do użycia zamiast ``INVOICE_NUMBER_COUNTER``
+        save_to_disk: Czy zapisać XML i PDF faktury na dysk
+
+    Returns:
+        Tuple[InvoiceData, str, BytesIO, Optional[str]]:
+            (faktura, XML, PDF buffer, ścieżka zapisanego XML)
+    """
+    # reportlab is only loaded once an invoice is actually rendered
+    from invoice_pdf import generate_invoice_pdf, save_invoice_pdf
+
+    invoice = create_invoice_from_monthly_report(
+        hours=hours,
+        month=month,
+        year=year,
+        trainer_name=trainer_name,
+        counter=counter,
+    )
+    invoice_xml = generate_fa2_xml(invoice)
+    pdf_buffer = generate_invoice_pdf(invoice)
+
+    saved_path = None
+    if save_to_disk:
+        output_dir = os.path.join("invoices", str(year), f"{month:02d}")
+        os.makedirs(output_dir, exist_ok=True)
+        saved_path = save_invoice_xml(invoice, output_dir)
+        save_invoice_pdf(invoice, output_dir, pdf_buffer)
+    return invoice, invoice_xml, pdf_buffer, saved_path
+
+
+def _record_ksef_invoice(
+    invoice: InvoiceData,
+    ksef_result,
+    prowadzacy_id: Optional[int],
+    reserved_counter: Optional[int] = None,
+):
+    """Zapisuje wysłaną fakturę w ``ksef_invoice``; błąd zapisu nie cofa wysyłki."""
+    from utils.ksef_poller import record_submission
+
+    try:
+        return record_submission(
+            ksef_result, invoice.invoice_number, prowadzacy_id, reserved_counter=reserved_counter
+        )
+    except Exception:
+        logger.exception("Could not record KSeF invoice %s", invoice.invoice_number)
+        return None
+
+
+def _take_counter(invoice: InvoiceData) -> None:
+    """Zajmuje numer faktury w liczniku (lub na liście zwolnionych numerów)."""
+    if invoice.counter is None:
+        increment_invoice_counter()
+    else:
+        take_invoice_counter(invoice.counter)
+
+
+def submit_invoice(
+    invoice: InvoiceData,
+    invoice_xml: str,
+    pdf_buffer: BytesIO,
+    saved_path: Optional[str],
+    prowadzacy_id: Optional[int] = None,
+    wait_for_ksef: Optional[bool] = None,
+) -> Tuple[bool, Optional[str], Optional[str], Optional[BytesIO]]:
+    """
+    Wysyła gotową fakturę do KSeF (jeśli włączony) i zwiększa licznik faktur.
+
+    Każda wysłana faktura jest zapisywana w ``ksef_invoice``. Bez czekania na
+    KSeF (domyślnie w żądaniu HTTP) sukces oznacza przyjęcie pliku do sesji,
+    a status końcowy i numer KSeF zapisuje poller z :mod:`utils.ksef_poller`.
+    Numer faktury jest wtedy zarezerwowany; poller zwalnia go, jeśli KSeF
+    faktury nie przyjmie.
+
+    Args:
+        prowadzacy_id: ID prowadzącego, którego dotyczy faktura (opcjonalne)
+        wait_for_ksef: Czy czekać na przetworzenie faktury; ``None`` czeka
+            tylko poza żądaniem HTTP
+
+    Returns:
+        Tuple[bool, Optional[str], Optional[str], Optional[BytesIO]]:
+            (sukces, opis wyniku/ścieżka, komunikat błędu, PDF buffer)
+    """
+    if is_ksef_enabled():
+        from flask import has_request_context
+        from ksef_client import send_invoice_to_ksef
+
+        if wait_for_ksef is None:
+            wait_for_ksef = not has_request_context()
+        success, ksef_result, error = send_invoice_to_ksef(
+            invoice_xml, wait_for_completion=wait_for_ksef
+        )
+        if success:
+            # Zajęty przed zapisem, by poller nie zwolnił go wcześniej.
+            _take_counter(invoice)
+        if ksef_result is not None:
+            record = _record_ksef_invoice(
+                invoice,
+                ksef_result,
+                prowadzacy_id,
+                reserved_counter=invoice.counter if success else None,
+            )
+            if record is not None and record.status == "pending" and has_request_context():
+                from utils.ksef_poller import start_ksef_poller
+
+                start_ksef_poller()
+
+        if success:
+            logger.info(
+                "Invoice generated and sent to KSeF: %s, session=%s, invoice=%s, ksef=%s",
+                invoice.invoice_number,
+                ksef_result.session_reference_number,
+                ksef_result.invoice_reference_number,
+                ksef_result.ksef_number,
+            )
+            return True, _format_ksef_result(ksef_result), None, pdf_buffer
+        else:
+            logger.error(f"Failed to send invoice to KSeF: {error}")
+            return False, saved_path, error, pdf_buffer
+    else:
+        # KSeF wyłączony - tylko generuj i zapisz
+        _take_counter(invoice)
+        logger.info(
+            f"Invoice generated (KSeF disabled): {invoice.invoice_number}, "
+            f"Saved to: {saved_path}"
+        )
+        return True, saved_path, "KSeF disabled - invoice saved locally", pdf_buffer
+
+
+def submit_invoices(
+    batch: Sequence[Tuple[InvoiceData, str, BytesIO, Optional[str]]],
+    prowadzacy_ids: Optional[Sequence[Optional[int]]] = None,
+) -> List[Tuple[bool, Optional[str], Optional[str], Optional[BytesIO]]]:
+    """
+    Wysyła kilka gotowych faktur do KSeF w jednej sesji online.
+
+    Faktury muszą być ponumerowane kolejno od bieżącej wartości licznika.
+    Odrzucona faktura, po której KSeF przyjął już dalsze numery, jest
+    wysyłana ponownie bez zmian, bo tylko ona może zająć swój numer; licznik
+    przesuwa się za ostatnią przyjętą fakturę. Odrzucone faktury po niej nie
+    przesuwają licznika - wskazuje on pierwszą z nich, więc można je
+    przenumerować i wysłać przez :func:`submit_invoice`.
+    Bez KSeF każda faktura jest obsługiwana jak w :func:`submit_invoice`.
+
+    Args:
+        batch: Krotki (faktura, XML, PDF buffer, ścieżka zapisanego XML)
+        prowadzacy_ids: ID prowadzących w kolejności ``batch`` (opcjonalne)
+
+    Returns:
+        List: wyniki w kolejności ``batch``, każdy jak z ``submit_invoice``
+    """
+    if prowadzacy_ids is None:
+        prowadzacy_ids = [None] * len(batch)
+    if not is_ksef_enabled():
+        return [
+            submit_invoice(*item, prowadzacy_id=trainer_id)
+            for item, trainer_id in zip(batch, prowadzacy_ids)
+        ]
+
+    from ksef_client import send_invoice_to_ksef, send_invoices_to_ksef
+
+    outcomes = send_invoices_to_ksef([invoice_xml for _inv, invoice_xml, _pdf, _path in batch])
+    accepted = [index for index, (success, _result, _error) in enumerate(outcomes) if success]
+    last_accepted = accepted[-1] if accepted else -1
+    if accepted:
+        increment_invoice_counter(last_accepted + 1)
+
+    results = []
+    for index, ((invoice, invoice_xml, pdf_buffer, saved_path), outcome, trainer_id) in enumerate(
+        zip(batch, outcomes, prowadzacy_ids)
+    ):
+        success, ksef_result, error = outcome
+        if ksef_result is not None and ksef_result.invoice_reference_number:
+            _record_ksef_invoice(invoice, ksef_result, trainer_id)
+        if not success and index < last_accepted:
+            logger.warning(
+                "Resending invoice %s rejected in batch: %s", invoice.invoice_number, error
+            )
+            success, ksef_result, error = send_invoice_to_ksef(invoice_xml)
+            if ksef_result is not None and ksef_result.invoice_reference_number:
+                _record_ksef_invoice(invoice, ksef_result, trainer_id)
+            if not success:
+                error = f"{error} (numer {invoice.invoice_number} pozostaje niewykorzystany)"
+        if success:
+            logger.info(
+                "Invoice sent to KSeF in batch: %s, session=%s, invoice=%s, ksef=%s",
+                invoice.invoice_number,
+                ksef_result.session_reference_number,
+                ksef_result.invoice_reference_number,
+                ksef_result.ksef_number,
+            )
+            results.append((True, _format_ksef_result(ksef_result), None, pdf_buffer))
+            continue
+        logger.error("Failed to send invoice %s to KSeF: %s", invoice.invoice_number, error)
+        results.append((False, saved_path, error, pdf_buffer))
+    return results
 
 
 def generate_and_send_invoice(
@@ -82,57 +292,18 @@ def generate_and_send_invoice(
         hours = calculate_monthly_hours(prowadzacy_id, month, year)
         
         if hours <= 0:
-            return False, None, "No hours recorded for this month", None
+            return False, None, NO_HOURS_ERROR, None
         
-        # Utwórz dane faktury
-        invoice = create_invoice_from_monthly_report(
+        invoice, invoice_xml, pdf_buffer, saved_path = build_invoice_files(
             hours=hours,
             month=month,
             year=year,
-            trainer_name=trainer_name
+            trainer_name=trainer_name,
+            save_to_disk=save_to_disk,
+        )
+        return submit_invoice(
+            invoice, invoice_xml, pdf_buffer, saved_path, prowadzacy_id=prowadzacy_id
         )
-        
-        # Generuj XML
-        invoice_xml = generate_fa2_xml(invoice)
-        
-        # Generuj PDF
-        pdf_buffer = generate_invoice_pdf(invoice)
-        
-        # Zapisz na dysk jeśli wymagane
-        saved_path = None
-        if save_to_disk:
-            import os
-            output_dir = os.path.join("invoices", str(year), f"{month:02d}")
-            os.makedirs(output_dir, exist_ok=True)
-            saved_path = save_invoice_xml(invoice, output_dir)
-            # Zapisz też PDF
-            save_invoice_pdf(invoice, output_dir)
-        
-        # Jeśli KSeF jest włączony, wyślij fakturę
-        if is_ksef_enabled():
-            success, ksef_result, error = send_invoice_to_ksef(invoice_xml)
-            
-            if success:
-                increment_invoice_counter()
-                logger.info(
-                    "Invoice generated and sent to KSeF: %s, session=%s, invoice=%s, ksef=%s",
-                    invoice.invoice_number,
-                    ksef_result.session_reference_number,
-                    ksef_result.invoice_reference_number,
-                    ksef_result.ksef_number,
-                )
-                return True, _format_ksef_result(ksef_result), None, pdf_buffer
-            else:
-                logger.error(f"Failed to send invoice to KSeF: {error}")
-                return False, saved_path, error, pdf_buffer
-        else:
-            # KSeF wyłączony - tylko generuj i zapisz
-            increment_invoice_counter()
-            logger.info(
-                f"Invoice generated (KSeF disabled): {invoice.invoice_number}, "
-                f"Saved to: {saved_path}"
-            )
-            return True, saved_path, "KSeF disabled - invoice saved locally", pdf_buffer
             
     except Exception as e:
         logger.exception("Error generating/sending invoice")
@@ -165,7 +336,16 @@ def generate_invoice_for_report(
         trainer_name=trainer_name,
         save_to_disk=True
     )
-    
+    return report_invoice_outcome(success, result, error, pdf_buffer)
+
+
+def report_invoice_outcome(
+    success: bool,
+    result: Optional[str],
+    error: Optional[str],
+    pdf_buffer: Optional[BytesIO],
+) -> Tuple[bool, str, Optional[BytesIO]]:
+    """Zamienia wynik ``submit_invoice`` na komunikat dla użytkownika."""
     if success:
         if is_ksef_enabled() and result:
             return True, result, pdf_buffer
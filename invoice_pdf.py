@@ -426,8 +426,11 @@ def generate_invoice_pdf(invoice: InvoiceData, output: Optional[BytesIO] = None)
     return output
 
 
-def save_invoice_pdf(invoice: InvoiceData, output_path: str) -> str:
-    pdf_buffer = generate_invoice_pdf(invoice)
+def save_invoice_pdf(
+    invoice: InvoiceData, output_path: str, pdf_buffer: Optional[BytesIO] = None
+) -> str:
+    if pdf_buffer is None:
+        pdf_buffer = generate_invoice_pdf(invoice)
     filename = f"faktura_{invoice.invoice_number.replace('/', '_')}.pdf"
     filepath = os.path.join(output_path, filename)
     with open(filepath, 'wb') as f:
@@ -2,19 +2,24 @@
 from __future__ import annotations
 
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import UTC, datetime
 import hashlib
+import json
 import logging
 import os
+import tempfile
+import threading
 import time
-from typing import Any, Dict, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
-from cryptography import x509
-from cryptography.hazmat.primitives import hashes, padding as sym_padding
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-import requests
+# cryptography and requests are imported where they are used so that merely
+# importing this module (e.g. via invoice_helper) stays cheap.
+if TYPE_CHECKING:
+    import requests
+
+from utils.settings import get_setting
 
 logger = logging.getLogger(__name__)
 
@@ -36,10 +41,27 @@ FORM_CODE = {
     "value": "FA",
 }
 
+# Status codes after which an invoice or a session no longer changes.
+INVOICE_FINAL_STATUS_CODES = {200, 405, 410, 415, 430, 435, 440, 450, 500, 550}
+SESSION_FINAL_STATUS_CODES = {200, 415, 440, 445, 500}
+
+# Status polling starts fast, as most invoices are processed within seconds,
+# and backs off for the ones that take longer.
+POLL_INITIAL_SECONDS = 0.5
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_SECONDS = 5.0
+# Invoices per page of GET /sessions/{ref}/invoices (KSeF allows 10-1000).
+SESSION_INVOICES_PAGE_SIZE = 100
+
 
 class KSeFException(Exception):
     """Raised on KSeF API or protocol errors."""
 
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        # HTTP status of the failed request, if the error came from one.
+        self.status_code = status_code
+
 
 @dataclass
 class TokenInfo:
@@ -61,18 +83,60 @@ class KSeFSendResult:
 
     @property
     def success(self) -> bool:
-        return self.invoice_status_code == 200 or self.session_status_code == 200
+        # Only the invoice's own status counts: a session processed with
+        # status 200 may still contain rejected invoices.
+        return self.invoice_status_code == 200
+
+
+def poll_delays(
+    fixed: Optional[float] = None,
+    initial: float = POLL_INITIAL_SECONDS,
+    maximum: float = POLL_MAX_SECONDS,
+) -> Iterator[float]:
+    """Yield the pauses between status polls: ``fixed`` or a growing backoff."""
+    delay = initial
+    while True:
+        yield fixed if fixed is not None else delay
+        delay = min(delay * POLL_BACKOFF_FACTOR, maximum)
+
+
+def status_code(payload: Optional[Dict[str, Any]]) -> Optional[int]:
+    return ((payload or {}).get("status") or {}).get("code")
+
+
+def is_processing_finished(
+    session_payload: Optional[Dict[str, Any]], invoice_payload: Optional[Dict[str, Any]]
+) -> bool:
+    return (
+        status_code(invoice_payload) in INVOICE_FINAL_STATUS_CODES
+        or status_code(session_payload) in SESSION_FINAL_STATUS_CODES
+    )
 
 
 def _parse_datetime(value: str) -> datetime:
     return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(UTC)
 
 
+def _token_to_dict(token_info: Optional[TokenInfo]) -> Optional[Dict[str, str]]:
+    if token_info is None:
+        return None
+    return {"token": token_info.token, "validUntil": token_info.valid_until.isoformat()}
+
+
+def _token_from_dict(data: Optional[Dict[str, str]]) -> Optional[TokenInfo]:
+    if not data:
+        return None
+    return TokenInfo(token=data["token"], valid_until=_parse_datetime(data["validUntil"]))
+
+
 def _sha256_base64(data: bytes) -> str:
     return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
 
 
 def _encrypt_aes_cbc_pkcs7(data: bytes, key: bytes, iv: bytes) -> bytes:
+    from cryptography.hazmat.primitives import padding as sym_padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
     padder = sym_padding.PKCS7(algorithms.AES.block_size).padder()
     padded = padder.update(data) + padder.finalize()
     cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
@@ -83,16 +147,192 @@ def _encrypt_aes_cbc_pkcs7(data: bytes, key: bytes, iv: bytes) -> bytes:
 def resolve_ksef_token(environment: str) -> str:
     specific_key = KSEF_ENVIRONMENT_TOKEN_KEYS.get(environment)
     if specific_key:
-        token = os.getenv(specific_key, "")
+        token = get_setting(specific_key, "")
         if token:
             return token
 
     if environment == "test":
-        demo_token = os.getenv("KSEF_TOKEN_DEMO", "")
+        demo_token = get_setting("ksef_token_demo", "")
         if demo_token:
             return demo_token
 
-    return os.getenv("KSEF_TOKEN", "")
+    return get_setting("ksef_token", "")
+
+
+def resolve_ksef_base_url(environment: str, base_url: Optional[str] = None) -> str:
+    """Return the API base URL: ``base_url``, else ``KSEF_BASE_URL``, else the environment's.
+
+    ``KSEF_BASE_URL`` points clients elsewhere, e.g. at ksef_fake_server.
+    """
+    base_url = base_url or get_setting("ksef_base_url", "")
+    return base_url.rstrip("/") if base_url else KSEF_ENVIRONMENTS.get(environment, "")
+
+
+# Keys are refetched this long before their certificate's validTo.
+CERTIFICATE_EXPIRY_MARGIN_SECONDS = 300
+
+
+@dataclass
+class _CachedPublicKey:
+    public_key: Any
+    valid_to: datetime
+
+
+_public_keys: Dict[Tuple[str, str], _CachedPublicKey] = {}
+_public_keys_lock = threading.Lock()
+
+
+def _certificate_usable(valid_to: datetime) -> bool:
+    return valid_to.timestamp() > time.time() + CERTIFICATE_EXPIRY_MARGIN_SECONDS
+
+
+def _select_certificate(certificates: List[Dict[str, Any]], usage: str) -> Tuple[bytes, datetime]:
+    """Return (DER, validTo) of the longest-valid certificate for ``usage``."""
+    candidates = [item for item in certificates if usage in (item.get("usage") or [])]
+    if not candidates:
+        raise KSeFException(f"No public key certificate found for usage {usage}")
+    best = max(candidates, key=lambda item: _parse_datetime(item["validTo"]))
+    return base64.b64decode(best["certificate"]), _parse_datetime(best["validTo"])
+
+
+def _has_usable_certificate(certificates: Optional[List[Dict[str, Any]]], usage: str) -> bool:
+    if not certificates:
+        return False
+    try:
+        return _certificate_usable(_select_certificate(certificates, usage)[1])
+    except (KSeFException, KeyError, ValueError):
+        return False
+
+
+def clear_public_key_cache() -> None:
+    """Forget the parsed public keys, e.g. after KSeF rotated its certificates."""
+    with _public_keys_lock:
+        _public_keys.clear()
+
+
+def _write_json_atomically(path: str, data: Any) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # mkstemp creates the file readable by the owner only.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".ksef-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class KSeFCertificateCache:
+    """JSON file with the certificate list of each KSeF environment.
+
+    Certificates are public, so unlike tokens they are stored unencrypted.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                entries = json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable KSeF certificate cache %s", self.path)
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def load(self, base_url: str) -> Optional[List[Dict[str, Any]]]:
+        certificates = self._read().get(base_url)
+        return certificates if isinstance(certificates, list) else None
+
+    def save(self, base_url: str, certificates: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            entries = self._read()
+            entries[base_url] = certificates
+            _write_json_atomically(self.path, entries)
+
+
+def default_certificate_cache() -> Optional[KSeFCertificateCache]:
+    """Return the cache file configured by ``KSEF_CERT_CACHE``, if any."""
+    path = get_setting("ksef_cert_cache", "")
+    return KSeFCertificateCache(path) if path else None
+
+
+class KSeFTokenStore:
+    """Encrypted file keeping access and refresh tokens between processes.
+
+    Entries are keyed by ``environment:nip`` and encrypted with a key derived
+    from the KSeF token, so only a process configured with the same token can
+    read them, and replacing the token makes old entries unreadable.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fernet(ksef_token: str):
+        from cryptography.fernet import Fernet
+
+        key = hashlib.sha256(b"ksef-token-store:" + ksef_token.encode("utf-8")).digest()
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                entries = json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable KSeF token store %s", self.path)
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    @staticmethod
+    def _key(environment: str, base_url: str, nip: str) -> str:
+        return f"{environment}:{base_url}:{nip}"
+
+    def load(
+        self, environment: str, base_url: str, nip: str, ksef_token: str
+    ) -> Tuple[Optional[TokenInfo], Optional[TokenInfo]]:
+        """Return the stored (access, refresh) tokens, ``None`` where unavailable."""
+        from cryptography.fernet import InvalidToken
+
+        entry = self._read().get(self._key(environment, base_url, nip))
+        if not entry:
+            return None, None
+        try:
+            data = json.loads(self._fernet(ksef_token).decrypt(entry.encode("ascii")))
+            return _token_from_dict(data.get("access")), _token_from_dict(data.get("refresh"))
+        except (InvalidToken, ValueError, KeyError, TypeError):
+            return None, None
+
+    def save(
+        self,
+        environment: str,
+        base_url: str,
+        nip: str,
+        ksef_token: str,
+        access: Optional[TokenInfo],
+        refresh: Optional[TokenInfo],
+    ) -> None:
+        payload = json.dumps({"access": _token_to_dict(access), "refresh": _token_to_dict(refresh)})
+        encrypted = self._fernet(ksef_token).encrypt(payload.encode("utf-8")).decode("ascii")
+        with self._lock:
+            entries = self._read()
+            entries[self._key(environment, base_url, nip)] = encrypted
+            _write_json_atomically(self.path, entries)
+
+
+def default_token_store() -> Optional[KSeFTokenStore]:
+    """Return the store configured by ``KSEF_TOKEN_STORE``, if any."""
+    path = get_setting("ksef_token_store", "")
+    return KSeFTokenStore(path) if path else None
 
 
 class KSeFClient:
@@ -104,15 +344,28 @@ class KSeFClient:
         nip: Optional[str] = None,
         token: Optional[str] = None,
         timeout: int = 30,
+        token_store: Optional[KSeFTokenStore] = None,
+        certificate_cache: Optional[KSeFCertificateCache] = None,
+        base_url: Optional[str] = None,
     ) -> None:
         if environment not in KSEF_ENVIRONMENTS:
             raise KSeFException(f"Invalid environment: {environment}")
 
-        self.base_url = KSEF_ENVIRONMENTS[environment]
+        self.base_url = resolve_ksef_base_url(environment, base_url)
         self.environment = environment
-        self.nip = nip or os.getenv("KSEF_NIP", "")
+        self.nip = nip or get_setting("ksef_nip", "")
         self.ksef_token = token or resolve_ksef_token(environment)
         self.timeout = timeout
+        self.token_store = token_store
+        self.certificate_cache = (
+            certificate_cache if certificate_cache is not None else default_certificate_cache()
+        )
+        # Serialises authentication when one client is shared between threads.
+        self._auth_lock = threading.RLock()
+        self._status_pool: Optional[ThreadPoolExecutor] = None
+
+        import requests
+
         self.http = requests.Session()
 
         self.authentication_reference_number: Optional[str] = None
@@ -134,9 +387,11 @@ class KSeFClient:
         json_data: Optional[Dict[str, Any]] = None,
         accept: str = "application/json",
         content_type: Optional[str] = "application/json",
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
     ) -> requests.Response:
         url = f"{self.base_url}{path}"
-        headers = {"Accept": accept}
+        headers = {**(headers or {}), "Accept": accept}
         if content_type:
             headers["Content-Type"] = content_type
         if bearer_token:
@@ -146,13 +401,14 @@ class KSeFClient:
             method,
             url,
             headers=headers,
+            params=params,
             json=json_data,
             timeout=self.timeout,
         )
         if response.ok:
             return response
 
-        raise KSeFException(self._format_error(response))
+        raise KSeFException(self._format_error(response), status_code=response.status_code)
 
     def _format_error(self, response: requests.Response) -> str:
         try:
@@ -184,19 +440,52 @@ class KSeFClient:
     def _build_context_identifier(self) -> Dict[str, str]:
         return {"type": "Nip", "value": self.nip}
 
-    def fetch_public_key_certificate(self, usage: str) -> bytes:
+    def fetch_public_key_certificates(self) -> List[Dict[str, Any]]:
         response = self._request("GET", "/security/public-key-certificates", content_type=None)
-        certificates = response.json()
-        candidates = [item for item in certificates if usage in (item.get("usage") or [])]
-        if not candidates:
-            raise KSeFException(f"No public key certificate found for usage {usage}")
-        candidates.sort(key=lambda item: item["validTo"], reverse=True)
-        return base64.b64decode(candidates[0]["certificate"])
+        return response.json()
+
+    def fetch_public_key_certificate(self, usage: str) -> bytes:
+        return _select_certificate(self.fetch_public_key_certificates(), usage)[0]
+
+    def get_public_key(self, usage: str):
+        """Return the parsed public key for ``usage``, fetching it only when needed.
+
+        Keys are cached per process until shortly before their ``validTo``;
+        with ``KSEF_CERT_CACHE`` set the certificate list is also kept on disk
+        for later processes.
+        """
+        from cryptography import x509
+
+        cache_key = (self.base_url, usage)
+        with _public_keys_lock:
+            cached = _public_keys.get(cache_key)
+        if cached is not None and _certificate_usable(cached.valid_to):
+            return cached.public_key
+
+        certificates = None
+        if self.certificate_cache is not None:
+            certificates = self.certificate_cache.load(self.base_url)
+        if not _has_usable_certificate(certificates, usage):
+            certificates = self.fetch_public_key_certificates()
+            if self.certificate_cache is not None:
+                try:
+                    self.certificate_cache.save(self.base_url, certificates)
+                except OSError:
+                    logger.warning(
+                        "Could not write KSeF certificate cache %s", self.certificate_cache.path
+                    )
+
+        cert_der, valid_to = _select_certificate(certificates, usage)
+        public_key = x509.load_der_x509_certificate(cert_der).public_key()
+        with _public_keys_lock:
+            _public_keys[cache_key] = _CachedPublicKey(public_key, valid_to)
+        return public_key
 
     def _encrypt_with_public_key(self, payload: bytes, usage: str) -> str:
-        cert_der = self.fetch_public_key_certificate(usage)
-        certificate = x509.load_der_x509_certificate(cert_der)
-        public_key = certificate.public_key()
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        public_key = self.get_public_key(usage)
         encrypted = public_key.encrypt(
             payload,
             padding.OAEP(
@@ -279,12 +568,59 @@ class KSeFClient:
             valid_until=_parse_datetime(payload["accessToken"]["validUntil"]),
         )
 
-    def ensure_authenticated(self) -> None:
-        if self._is_token_valid(self.access_token):
+    def _load_stored_tokens(self) -> None:
+        if self.token_store is None:
             return
-        if self._is_token_valid(self.refresh_token):
-            self.refresh_access_token()
+        access, refresh = self.token_store.load(
+            self.environment, self.base_url, self.nip, self.ksef_token
+        )
+        if self._is_token_valid(access):
+            self.access_token = access
+        if self._is_token_valid(refresh) and (
+            self.refresh_token is None or refresh.valid_until > self.refresh_token.valid_until
+        ):
+            self.refresh_token = refresh
+
+    def _store_tokens(self) -> None:
+        if self.token_store is None:
             return
+        try:
+            self.token_store.save(
+                self.environment,
+                self.base_url,
+                self.nip,
+                self.ksef_token,
+                self.access_token,
+                self.refresh_token,
+            )
+        except OSError:
+            logger.warning("Could not write KSeF token store %s", self.token_store.path)
+
+    def ensure_authenticated(self) -> None:
+        """Make sure a valid access token is held, in the cheapest way possible.
+
+        In order: keep the current token, take one another process stored,
+        refresh it, and only then run the full challenge handshake.
+        """
+        with self._auth_lock:
+            if self._is_token_valid(self.access_token):
+                return
+            self._load_stored_tokens()
+            if self._is_token_valid(self.access_token):
+                return
+            if self._is_token_valid(self.refresh_token):
+                try:
+                    self.refresh_access_token()
+                except KSeFException as error:
+                    logger.warning("KSeF token refresh failed, authenticating again: %s", error)
+                    self.refresh_token = None
+                else:
+                    self._store_tokens()
+                    return
+            self._authenticate()
+            self._store_tokens()
+
+    def _authenticate(self) -> None:
         self.authenticate_by_token()
         deadline = time.monotonic() + 60
         while time.monotonic() < deadline:
@@ -309,16 +645,49 @@ class KSeFClient:
         json_data: Optional[Dict[str, Any]] = None,
         accept: str = "application/json",
         content_type: Optional[str] = "application/json",
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
     ) -> requests.Response:
+        """Call the API with the access token, authenticating again once on HTTP 401.
+
+        KSeF can revoke a token before its ``validUntil``, e.g. when the KSeF
+        token it was issued for is withdrawn.
+        """
         self.ensure_authenticated()
-        assert self.access_token is not None
+        access_token = self.access_token
+        assert access_token is not None
+        try:
+            return self._request(
+                method,
+                path,
+                bearer_token=access_token.token,
+                json_data=json_data,
+                accept=accept,
+                content_type=content_type,
+                params=params,
+                headers=headers,
+            )
+        except KSeFException as error:
+            if error.status_code != 401:
+                raise
+            logger.warning("KSeF rejected the access token, authenticating again: %s", error)
+        with self._auth_lock:
+            # Another thread may have replaced the token in the meantime.
+            if self.access_token is access_token:
+                self.access_token = None
+                self.refresh_token = None
+                self._authenticate()
+                self._store_tokens()
+            access_token = self.access_token
         return self._request(
             method,
             path,
-            bearer_token=self.access_token.token,
+            bearer_token=access_token.token,
             json_data=json_data,
             accept=accept,
             content_type=content_type,
+            params=params,
+            headers=headers,
         )
 
     def create_encryption_info(self) -> Tuple[Dict[str, str], bytes, bytes]:
@@ -396,10 +765,37 @@ class KSeFClient:
         )
         return response.json()
 
-    def get_session_invoices(self, session_reference_number: str) -> Dict[str, Any]:
-        response = self._authorized_request("GET", f"/sessions/{session_reference_number}/invoices")
+    def get_session_invoices(
+        self,
+        session_reference_number: str,
+        page_size: Optional[int] = None,
+        continuation_token: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Return one page of the session's invoice list.
+
+        The payload's ``continuationToken`` is set while more pages follow.
+        """
+        response = self._authorized_request(
+            "GET",
+            f"/sessions/{session_reference_number}/invoices",
+            params={"pageSize": page_size or SESSION_INVOICES_PAGE_SIZE},
+            headers={"x-continuation-token": continuation_token} if continuation_token else None,
+        )
         return response.json()
 
+    def list_session_invoices(self, session_reference_number: str) -> List[Dict[str, Any]]:
+        """Return every invoice of the session, following the continuation tokens."""
+        invoices: List[Dict[str, Any]] = []
+        continuation_token = None
+        while True:
+            page = self.get_session_invoices(
+                session_reference_number, continuation_token=continuation_token
+            )
+            invoices.extend(page.get("invoices") or [])
+            continuation_token = page.get("continuationToken")
+            if not continuation_token:
+                return invoices
+
     def download_invoice_xml(self, ksef_number: str) -> str:
         response = self._authorized_request(
             "GET",
@@ -418,40 +814,61 @@ class KSeFClient:
         )
         return response.text
 
+    def _fetch_concurrently(self, *calls: Callable[[], Any]) -> List[Any]:
+        """Run independent status requests in parallel and return their results."""
+        # Authenticate first so the parallel requests don't race to do it.
+        self.ensure_authenticated()
+        if self._status_pool is None:
+            self._status_pool = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="ksef-status"
+            )
+        futures = [self._status_pool.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    def fetch_invoice_status(
+        self, session_reference_number: str, invoice_reference_number: str
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Return the (session, invoice) status payloads, fetched concurrently."""
+        session_payload, invoice_payload = self._fetch_concurrently(
+            lambda: self.get_session_status(session_reference_number),
+            lambda: self.get_session_invoice_status(
+                session_reference_number, invoice_reference_number
+            ),
+        )
+        return session_payload, invoice_payload
+
+    def close(self) -> None:
+        if self._status_pool is not None:
+            self._status_pool.shutdown(wait=False)
+            self._status_pool = None
+        self.http.close()
+
     def wait_for_invoice_processing(
         self,
         session_reference_number: str,
         invoice_reference_number: str,
         timeout_seconds: int = 120,
-        poll_interval_seconds: float = 2.0,
+        poll_interval_seconds: Optional[float] = None,
     ) -> KSeFSendResult:
+        """Poll until the invoice or its session reaches a final status.
+
+        Pauses follow :func:`poll_delays`; pass ``poll_interval_seconds`` for a
+        fixed interval instead.
+        """
         deadline = time.monotonic() + timeout_seconds
         last_session_status: Optional[Dict[str, Any]] = None
         last_invoice_status: Optional[Dict[str, Any]] = None
 
-        while time.monotonic() < deadline:
-            last_session_status = self.get_session_status(session_reference_number)
-            last_invoice_status = self.get_session_invoice_status(
-                session_reference_number,
-                invoice_reference_number,
+        for delay in poll_delays(poll_interval_seconds):
+            last_session_status, last_invoice_status = self.fetch_invoice_status(
+                session_reference_number, invoice_reference_number
             )
-            invoice_status = (last_invoice_status.get("status") or {}).get("code")
-            session_status = (last_session_status.get("status") or {}).get("code")
-            if invoice_status in {200, 405, 410, 415, 430, 435, 440, 450, 500, 550}:
-                return self._build_send_result(
-                    session_reference_number,
-                    invoice_reference_number,
-                    last_session_status,
-                    last_invoice_status,
-                )
-            if session_status in {200, 415, 440, 445, 500}:
-                return self._build_send_result(
-                    session_reference_number,
-                    invoice_reference_number,
-                    last_session_status,
-                    last_invoice_status,
-                )
-            time.sleep(poll_interval_seconds)
+            if is_processing_finished(last_session_status, last_invoice_status):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
 
         return self._build_send_result(
             session_reference_number,
@@ -487,7 +904,7 @@ class KSeFClient:
         invoice_xml: str,
         wait_for_completion: bool = True,
         timeout_seconds: int = 120,
-        poll_interval_seconds: float = 2.0,
+        poll_interval_seconds: Optional[float] = None,
     ) -> KSeFSendResult:
         session_reference_number, symmetric_key, initialization_vector = self.open_online_session()
         invoice_reference_number = self.send_encrypted_invoice(
@@ -511,10 +928,175 @@ class KSeFClient:
             invoice_reference_number=invoice_reference_number,
         )
 
+    def wait_for_invoices_processing(
+        self,
+        session_reference_number: str,
+        invoice_reference_numbers: Sequence[str],
+        timeout_seconds: int = 120,
+        poll_interval_seconds: Optional[float] = None,
+    ) -> Dict[str, KSeFSendResult]:
+        """Poll the statuses of all invoices of one session together.
+
+        Each round fetches the session status and the session's invoice list,
+        all of its pages, instead of one status request per invoice. Polling
+        goes on until every invoice has a final status of its own, as the
+        session status says nothing about single invoices. Returns results
+        keyed by invoice reference number.
+        """
+        pending = set(invoice_reference_numbers)
+        invoice_payloads: Dict[str, Dict[str, Any]] = {}
+        session_payload: Optional[Dict[str, Any]] = None
+        deadline = time.monotonic() + timeout_seconds
+
+        for delay in poll_delays(poll_interval_seconds):
+            session_payload, listing = self._fetch_concurrently(
+                lambda: self.get_session_status(session_reference_number),
+                lambda: self.list_session_invoices(session_reference_number),
+            )
+            for item in listing:
+                reference = item.get("referenceNumber")
+                if reference in pending:
+                    invoice_payloads[reference] = item
+                    if status_code(item) in INVOICE_FINAL_STATUS_CODES:
+                        pending.discard(reference)
+            if not pending:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+
+        return {
+            reference: self._build_send_result(
+                session_reference_number,
+                reference,
+                session_payload,
+                invoice_payloads.get(reference),
+            )
+            for reference in invoice_reference_numbers
+        }
 
-def send_invoice_to_ksef(invoice_xml: str) -> Tuple[bool, Optional[KSeFSendResult], Optional[str]]:
-    environment = os.getenv("KSEF_ENVIRONMENT", "demo")
-    nip = os.getenv("KSEF_NIP", "")
+    def send_invoices(
+        self,
+        invoice_xmls: Sequence[str],
+        wait_for_completion: bool = True,
+        timeout_seconds: int = 120,
+        poll_interval_seconds: Optional[float] = None,
+    ) -> List[KSeFSendResult]:
+        """Send several invoices through one online session.
+
+        The session is opened, and its symmetric key wrapped, once for the
+        whole batch. Results are returned in the order of ``invoice_xmls``;
+        an invoice the session refused gets a result without a reference
+        number and the error as its status description.
+        """
+        session_reference_number, symmetric_key, initialization_vector = self.open_online_session()
+        references: List[Optional[str]] = []
+        errors: Dict[int, str] = {}
+        try:
+            for index, invoice_xml in enumerate(invoice_xmls):
+                try:
+                    references.append(
+                        self.send_encrypted_invoice(
+                            session_reference_number,
+                            invoice_xml,
+                            symmetric_key,
+                            initialization_vector,
+                        )
+                    )
+                except KSeFException as error:
+                    logger.error("KSeF refused invoice %s of batch: %s", index + 1, error)
+                    references.append(None)
+                    errors[index] = str(error)
+        finally:
+            self.close_online_session(session_reference_number)
+
+        sent = [reference for reference in references if reference]
+        if wait_for_completion and sent:
+            statuses = self.wait_for_invoices_processing(
+                session_reference_number,
+                sent,
+                timeout_seconds=timeout_seconds,
+                poll_interval_seconds=poll_interval_seconds,
+            )
+        else:
+            statuses = {
+                reference: KSeFSendResult(
+                    session_reference_number=session_reference_number,
+                    invoice_reference_number=reference,
+                )
+                for reference in sent
+            }
+
+        results = []
+        for index, reference in enumerate(references):
+            if reference:
+                results.append(statuses[reference])
+            else:
+                results.append(
+                    KSeFSendResult(
+                        session_reference_number=session_reference_number,
+                        invoice_reference_number="",
+                        invoice_status_description=errors[index],
+                    )
+                )
+        return results
+
+
+_clients: Dict[Tuple[str, str, str], KSeFClient] = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+def get_ksef_client(environment: str, nip: str, token: str) -> KSeFClient:
+    """Return the process-wide client for ``(environment, base URL, nip)``.
+
+    Reusing the client keeps its access and refresh tokens and its HTTP
+    connections across invoices. A client created for another KSeF token is
+    replaced. The base URL is the one ``KSEF_BASE_URL`` gives at call time.
+    """
+    global _clients_pid
+    base_url = resolve_ksef_base_url(environment)
+    key = (environment, base_url, nip)
+    with _clients_lock:
+        if _clients_pid != os.getpid():  # forked: don't share sockets
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is None or client.ksef_token != token:
+            client = KSeFClient(
+                environment=environment,
+                nip=nip,
+                token=token,
+                token_store=default_token_store(),
+                base_url=base_url,
+            )
+            _clients[key] = client
+        return client
+
+
+def reset_ksef_clients() -> None:
+    """Forget all cached clients, e.g. after the KSeF settings changed."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def _describe_failure(result: KSeFSendResult) -> str:
+    return (
+        result.invoice_status_description
+        or result.session_status_description
+        or "Unknown KSeF status"
+    )
+
+
+def send_invoice_to_ksef(
+    invoice_xml: str, wait_for_completion: bool = True
+) -> Tuple[bool, Optional[KSeFSendResult], Optional[str]]:
+    """Send one invoice; without ``wait_for_completion`` success means it was uploaded."""
+    environment = get_setting("ksef_environment", "demo")
+    nip = get_setting("ksef_nip", "")
     token = resolve_ksef_token(environment)
 
     if not nip:
@@ -524,12 +1106,39 @@ def send_invoice_to_ksef(invoice_xml: str) -> Tuple[bool, Optional[KSeFSendResul
         return False, None, f"{token_key} not configured"
 
     try:
-        client = KSeFClient(environment=environment, nip=nip, token=token)
-        result = client.send_invoice(invoice_xml)
-        if result.success:
+        client = get_ksef_client(environment, nip, token)
+        result = client.send_invoice(invoice_xml, wait_for_completion=wait_for_completion)
+        if not wait_for_completion or result.success:
             return True, result, None
-        description = result.invoice_status_description or result.session_status_description or "Unknown KSeF status"
-        return False, result, description
+        return False, result, _describe_failure(result)
     except Exception as error:
         logger.exception("Unexpected error sending invoice to KSeF")
         return False, None, str(error)
+
+
+def send_invoices_to_ksef(
+    invoice_xmls: Sequence[str],
+) -> List[Tuple[bool, Optional[KSeFSendResult], Optional[str]]]:
+    """Batch counterpart of :func:`send_invoice_to_ksef`, one outcome per invoice."""
+    environment = get_setting("ksef_environment", "demo")
+    nip = get_setting("ksef_nip", "")
+    token = resolve_ksef_token(environment)
+
+    if not nip:
+        return [(False, None, "KSEF_NIP not configured")] * len(invoice_xmls)
+    if not token:
+        token_key = KSEF_ENVIRONMENT_TOKEN_KEYS.get(environment, "KSEF_TOKEN")
+        return [(False, None, f"{token_key} not configured")] * len(invoice_xmls)
+    if not invoice_xmls:
+        return []
+
+    try:
+        client = get_ksef_client(environment, nip, token)
+        results = client.send_invoices(invoice_xmls)
+    except Exception as error:
+        logger.exception("Unexpected error sending invoice batch to KSeF")
+        return [(False, None, str(error))] * len(invoice_xmls)
+    return [
+        (True, result, None) if result.success else (False, result, _describe_failure(result))
+        for result in results
+    ]
@@ -0,0 +1,652 @@
+"""Local stand-in for the KSeF 2.0 API, for offline tests and benchmarks.
+
+Implements the endpoints :class:`ksef_client.KSeFClient` uses: public-key
+certificates, the token challenge handshake, redeem/refresh, online
+sessions with encrypted uploads, session and invoice status, invoice XML and
+UPO downloads. The session's invoice list is paged by ``pageSize`` and the
+``x-continuation-token`` header like the real one. Tokens are checked, uploads are decrypted and their hashes
+verified like the real service does; invoices become final
+``processing_time`` seconds after upload.
+
+Latency and failures can be injected: every request is delayed by
+``latency`` (plus up to ``jitter``) seconds, fails with HTTP 503 with
+probability ``failure_rate`` and uploaded invoices are rejected (status 450)
+with probability ``rejection_rate``. ``fail_endpoints`` limits injected
+failures to some endpoints, e.g. ``{"send_invoice"}``.
+
+In-process::
+
+    with FakeKSeFServer(latency=0.02) as server:
+        client = KSeFClient("demo", server.nip, server.token, base_url=server.url)
+
+As a subprocess, for ``KSEF_BASE_URL=http://127.0.0.1:8765``::
+
+    python ksef_fake_server.py --port 8765 --latency 0.05 --failure-rate 0.01
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives import padding as sym_padding
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.x509.oid import NameOID
+
+DEFAULT_NIP = "1234567890"
+DEFAULT_TOKEN = "fake-ksef-token"
+# GET /sessions/{ref}/invoices page sizes, as in KSeF.
+SESSION_INVOICES_DEFAULT_PAGE_SIZE = 10
+SESSION_INVOICES_MIN_PAGE_SIZE = 10
+SESSION_INVOICES_MAX_PAGE_SIZE = 1000
+
+# Routes as (method, pattern, endpoint name); names are used by fail_endpoints
+# and the per-endpoint request counts.
+ROUTES = [
+    ("GET", r"/security/public-key-certificates", "certificates"),
+    ("POST", r"/auth/challenge", "challenge"),
+    ("POST", r"/auth/ksef-token", "ksef_token"),
+    ("POST", r"/auth/token/redeem", "redeem"),
+    ("POST", r"/auth/token/refresh", "refresh"),
+    ("GET", r"/auth/(?P<ref>[^/]+)", "auth_status"),
+    ("POST", r"/sessions/online", "open_session"),
+    ("POST", r"/sessions/online/(?P<session>[^/]+)/invoices", "send_invoice"),
+    ("POST", r"/sessions/online/(?P<session>[^/]+)/close", "close_session"),
+    ("GET", r"/sessions/(?P<session>[^/]+)", "session_status"),
+    ("GET", r"/sessions/(?P<session>[^/]+)/invoices", "session_invoices"),
+    ("GET", r"/sessions/(?P<session>[^/]+)/invoices/(?P<invoice>[^/]+)", "invoice_status"),
+    ("GET", r"/sessions/(?P<session>[^/]+)/invoices/ksef/(?P<ksef>[^/]+)/upo", "invoice_upo"),
+    ("GET", r"/invoices/ksef/(?P<ksef>[^/]+)", "invoice_xml"),
+    ("GET", r"/_fake/stats", "stats"),
+]
+_COMPILED_ROUTES = [(method, re.compile(f"{pattern}$"), name) for method, pattern, name in ROUTES]
+
+
+class FakeKSeFError(Exception):
+    """An error answered in KSeF's ``exception`` format."""
+
+    def __init__(self, status: int, code: int, description: str, details: Optional[List[str]] = None):
+        super().__init__(description)
+        self.status = status
+        self.code = code
+        self.description = description
+        self.details = details or []
+
+    def payload(self) -> dict:
+        return {
+            "exception": {
+                "exceptionDetailList": [
+                    {
+                        "exceptionCode": self.code,
+                        "exceptionDescription": self.description,
+                        "details": self.details,
+                    }
+                ]
+            }
+        }
+
+
+def _iso(moment: datetime) -> str:
+    return moment.astimezone(UTC).isoformat().replace("+00:00", "Z")
+
+
+def _reference(prefix: str) -> str:
+    return f"{datetime.now(UTC):%Y%m%d}-{prefix}-{uuid.uuid4().hex[:10].upper()}"
+
+
+def _sha256_base64(data: bytes) -> str:
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+@dataclass
+class _Invoice:
+    ordinal: int
+    reference: str
+    invoice_hash: str
+    xml: bytes
+    ready_at: float
+    rejected: bool
+    ksef_number: str
+
+    def status(self, now: float) -> dict:
+        if now < self.ready_at:
+            return {"code": 150, "description": "Trwa przetwarzanie"}
+        if self.rejected:
+            return {"code": 450, "description": "Błąd weryfikacji semantyki dokumentu faktury"}
+        return {"code": 200, "description": "Sukces"}
+
+    def payload(self, session: str, now: float) -> dict:
+        status = self.status(now)
+        payload = {
+            "ordinalNumber": self.ordinal,
+            "referenceNumber": self.reference,
+            "invoiceHash": self.invoice_hash,
+            "status": status,
+        }
+        if status["code"] == 200:
+            payload["ksefNumber"] = self.ksef_number
+            payload["upoDownloadUrl"] = f"/sessions/{session}/invoices/ksef/{self.ksef_number}/upo"
+        return payload
+
+
+@dataclass
+class _Session:
+    reference: str
+    key: bytes
+    iv: bytes
+    closed: bool = False
+    invoices: Dict[str, _Invoice] = field(default_factory=dict)
+
+    def status(self, now: float) -> dict:
+        if not self.closed:
+            return {"code": 100, "description": "Sesja interaktywna otwarta"}
+        statuses = [invoice.status(now)["code"] for invoice in self.invoices.values()]
+        if any(code == 150 for code in statuses):
+            return {"code": 170, "description": "Sesja interaktywna zamknięta"}
+        if statuses and all(code != 200 for code in statuses):
+            return {"code": 445, "description": "Błąd weryfikacji, brak poprawnych faktur"}
+        return {"code": 200, "description": "Sesja interaktywna przetworzona pomyślnie"}
+
+
+class FakeKSeFService:
+    """State and behaviour of the fake API, independent of the HTTP layer."""
+
+    def __init__(
+        self,
+        nip: str = DEFAULT_NIP,
+        token: str = DEFAULT_TOKEN,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        processing_time: float = 0.0,
+        failure_rate: float = 0.0,
+        rejection_rate: float = 0.0,
+        fail_endpoints: Optional[Set[str]] = None,
+        access_token_lifetime: float = 900.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.nip = nip
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.processing_time = processing_time
+        self.failure_rate = failure_rate
+        self.rejection_rate = rejection_rate
+        self.fail_endpoints = set(fail_endpoints or ())
+        self.access_token_lifetime = access_token_lifetime
+        self.requests: Counter = Counter()
+        self.failures: Counter = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._challenges: Dict[str, int] = {}
+        self._auth_operations: Dict[str, str] = {}
+        # token -> (kind, valid until as epoch seconds)
+        self._tokens: Dict[str, tuple] = {}
+        self._sessions: Dict[str, _Session] = {}
+        self._invoices_by_ksef: Dict[str, _Invoice] = {}
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._certificates = self._build_certificates()
+
+    def _build_certificates(self) -> List[dict]:
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-ksef")])
+        now = datetime.now(UTC)
+        valid_to = now + timedelta(days=365)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(self._private_key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(valid_to)
+            .sign(self._private_key, hashes.SHA256())
+        )
+        der = base64.b64encode(certificate.public_bytes(serialization.Encoding.DER)).decode()
+        return [
+            {
+                "certificate": der,
+                "validFrom": _iso(now - timedelta(days=1)),
+                "validTo": _iso(valid_to),
+                "usage": ["KsefTokenEncryption", "SymmetricKeyEncryption"],
+            }
+        ]
+
+    # --- infrastructure -------------------------------------------------
+
+    def inject(self, endpoint: str) -> None:
+        """Sleep for the configured latency and maybe fail the request."""
+        with self._lock:
+            self.requests[endpoint] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = (
+                endpoint != "stats"
+                and (not self.fail_endpoints or endpoint in self.fail_endpoints)
+                and self._random.random() < self.failure_rate
+            )
+            if fail:
+                self.failures[endpoint] += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeKSeFError(503, 21999, "Injected failure", [endpoint])
+
+    def _decrypt_rsa(self, value: str) -> bytes:
+        try:
+            return self._private_key.decrypt(
+                base64.b64decode(value),
+                padding.OAEP(
+                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                    algorithm=hashes.SHA256(),
+                    label=None,
+                ),
+            )
+        except ValueError:
+            raise FakeKSeFError(400, 21405, "Błąd odszyfrowania danych")
+
+    def _issue_token(self, kind: str, lifetime: float) -> dict:
+        token = f"{kind}-{uuid.uuid4().hex}"
+        valid_until = time.time() + lifetime
+        with self._lock:
+            self._tokens[token] = (kind, valid_until)
+        return {"token": token, "validUntil": _iso(datetime.fromtimestamp(valid_until, UTC))}
+
+    def _check_token(self, bearer: Optional[str], kind: str) -> str:
+        with self._lock:
+            entry = self._tokens.get(bearer or "")
+        if entry is None or entry[0] != kind or entry[1] < time.time():
+            raise FakeKSeFError(401, 21301, "Brak autoryzacji", [f"Invalid {kind} token"])
+        return bearer
+
+    def _session(self, reference: str) -> _Session:
+        with self._lock:
+            session = self._sessions.get(reference)
+        if session is None:
+            raise FakeKSeFError(404, 21170, "Sesja o podanym numerze nie istnieje", [reference])
+        return session
+
+    # --- endpoints --------------------------------------------------------
+
+    def certificates(self, body, bearer, **_params):
+        return 200, self._certificates
+
+    def challenge(self, body, bearer, **_params):
+        challenge = _reference("CR")
+        timestamp_ms = int(time.time() * 1000)
+        with self._lock:
+            self._challenges[challenge] = timestamp_ms
+        return 200, {
+            "challenge": challenge,
+            "timestamp": _iso(datetime.fromtimestamp(timestamp_ms / 1000, UTC)),
+            "timestampMs": timestamp_ms,
+        }
+
+    def ksef_token(self, body, bearer, **_params):
+        with self._lock:
+            timestamp_ms = self._challenges.pop(body.get("challenge"), None)
+        if timestamp_ms is None:
+            raise FakeKSeFError(400, 21115, "Nieprawidłowe wyzwanie autoryzacyjne")
+        context = body.get("contextIdentifier") or {}
+        if context.get("value") != self.nip:
+            raise FakeKSeFError(400, 21117, "Nieprawidłowy identyfikator kontekstu")
+        expected = f"{self.token}|{timestamp_ms}".encode("utf-8")
+        if self._decrypt_rsa(body.get("encryptedToken", "")) != expected:
+            raise FakeKSeFError(401, 21301, "Brak autoryzacji", ["Invalid KSeF token"])
+        reference = _reference("AU")
+        authentication_token = self._issue_token("authentication", 300)
+        with self._lock:
+            self._auth_operations[reference] = authentication_token["token"]
+        return 202, {"referenceNumber": reference, "authenticationToken": authentication_token}
+
+    def auth_status(self, body, bearer, ref=None, **_params):
+        self._check_token(bearer, "authentication")
+        with self._lock:
+            known = self._auth_operations.get(ref) == bearer
+        if not known:
+            raise FakeKSeFError(404, 21304, "Brak uwierzytelnienia", [ref])
+        return 200, {
+            "startDate": _iso(datetime.now(UTC)),
+            "authenticationMethod": "Token",
+            "status": {"code": 200, "description": "Uwierzytelnianie zakończone sukcesem"},
+        }
+
+    def redeem(self, body, bearer, **_params):
+        self._check_token(bearer, "authentication")
+        with self._lock:
+            self._tokens.pop(bearer, None)  # one redemption per operation
+        return 200, {
+            "accessToken": self._issue_token("access", self.access_token_lifetime),
+            "refreshToken": self._issue_token("refresh", 7 * 24 * 3600),
+        }
+
+    def refresh(self, body, bearer, **_params):
+        self._check_token(bearer, "refresh")
+        return 200, {"accessToken": self._issue_token("access", self.access_token_lifetime)}
+
+    def open_session(self, body, bearer, **_params):
+        self._check_token(bearer, "access")
+        encryption = body.get("encryption") or {}
+        key = self._decrypt_rsa(encryption.get("encryptedSymmetricKey", ""))
+        iv = base64.b64decode(encryption.get("initializationVector", ""))
+        if len(key) != 32 or len(iv) != 16:
+            raise FakeKSeFError(400, 21405, "Nieprawidłowe dane szyfrowania")
+        reference = _reference("SO")
+        with self._lock:
+            self._sessions[reference] = _Session(reference, key, iv)
+        valid_until = datetime.now(UTC) + timedelta(hours=12)
+        return 201, {"referenceNumber": reference, "validUntil": _iso(valid_until)}
+
+    def send_invoice(self, body, bearer, session=None, **_params):
+        self._check_token(bearer, "access")
+        online = self._session(session)
+        if online.closed:
+            raise FakeKSeFError(400, 21180, "Sesja jest zamknięta", [session])
+        encrypted = base64.b64decode(body.get("encryptedInvoiceContent", ""))
+        if (
+            _sha256_base64(encrypted) != body.get("encryptedInvoiceHash")
+            or len(encrypted) != body.get("encryptedInvoiceSize")
+        ):
+            raise FakeKSeFError(400, 21405, "Niezgodny skrót zaszyfrowanej faktury")
+        try:
+            decryptor = Cipher(algorithms.AES(online.key), modes.CBC(online.iv)).decryptor()
+            unpadder = sym_padding.PKCS7(algorithms.AES.block_size).unpadder()
+            xml = unpadder.update(decryptor.update(encrypted) + decryptor.finalize())
+            xml += unpadder.finalize()
+        except ValueError:
+            raise FakeKSeFError(400, 21405, "Błąd odszyfrowania faktury")
+        if _sha256_base64(xml) != body.get("invoiceHash") or len(xml) != body.get("invoiceSize"):
+            raise FakeKSeFError(400, 21405, "Niezgodny skrót faktury")
+        try:
+            ET.fromstring(xml)
+            malformed = False
+        except ET.ParseError:
+            malformed = True
+
+        with self._lock:
+            rejected = malformed or self._random.random() < self.rejection_rate
+            reference = _reference("EE")
+            invoice = _Invoice(
+                ordinal=len(online.invoices) + 1,
+                reference=reference,
+                invoice_hash=body["invoiceHash"],
+                xml=xml,
+                ready_at=time.monotonic() + self.processing_time,
+                rejected=rejected,
+                ksef_number=f"{self.nip}-{datetime.now(UTC):%Y%m%d}-{uuid.uuid4().hex[:12].upper()}-00",
+            )
+            online.invoices[reference] = invoice
+            if not rejected:
+                self._invoices_by_ksef[invoice.ksef_number] = invoice
+        return 202, {"referenceNumber": reference}
+
+    def close_session(self, body, bearer, session=None, **_params):
+        self._check_token(bearer, "access")
+        self._session(session).closed = True
+        return 204, None
+
+    def session_status(self, body, bearer, session=None, **_params):
+        self._check_token(bearer, "access")
+        online = self._session(session)
+        now = time.monotonic()
+        with self._lock:
+            invoices = list(online.invoices.values())
+        status = online.status(now)
+        codes = [invoice.status(now)["code"] for invoice in invoices]
+        payload = {
+            "status": status,
+            "invoiceCount": len(invoices),
+            "successfulInvoiceCount": codes.count(200),
+            "failedInvoiceCount": sum(1 for code in codes if code not in (100, 150, 200)),
+        }
+        if status["code"] == 200:
+            payload["upo"] = {"pages": [{"referenceNumber": f"UPO-{session}"}]}
+        return 200, payload
+
+    def session_invoices(self, body, bearer, session=None, query=None, headers=None, **_params):
+        self._check_token(bearer, "access")
+        online = self._session(session)
+        try:
+            page_size = int((query or {}).get("pageSize", SESSION_INVOICES_DEFAULT_PAGE_SIZE))
+        except ValueError:
+            page_size = 0
+        if not SESSION_INVOICES_MIN_PAGE_SIZE <= page_size <= SESSION_INVOICES_MAX_PAGE_SIZE:
+            raise FakeKSeFError(400, 21405, "Nieprawidłowy rozmiar strony", [str(page_size)])
+        start = 0
+        token = (headers or {}).get("x-continuation-token")
+        if token:
+            try:
+                token_session, offset = base64.urlsafe_b64decode(token).decode().split(":")
+                start = int(offset)
+            except ValueError:
+                token_session = None
+            if token_session != session:
+                raise FakeKSeFError(400, 21405, "Nieprawidłowy token kontynuacji", [token])
+        now = time.monotonic()
+        with self._lock:
+            invoices = list(online.invoices.values())
+        payload = {
+            "invoices": [
+                invoice.payload(session, now) for invoice in invoices[start : start + page_size]
+            ]
+        }
+        if start + page_size < len(invoices):
+            payload["continuationToken"] = base64.urlsafe_b64encode(
+                f"{session}:{start + page_size}".encode()
+            ).decode()
+        return 200, payload
+
+    def invoice_status(self, body, bearer, session=None, invoice=None, **_params):
+        self._check_token(bearer, "access")
+        online = self._session(session)
+        found = online.invoices.get(invoice)
+        if found is None:
+            raise FakeKSeFError(404, 21164, "Faktura o podanym numerze nie istnieje", [invoice])
+        return 200, found.payload(session, time.monotonic())
+
+    def _invoice_by_ksef(self, ksef_number: str) -> _Invoice:
+        with self._lock:
+            invoice = self._invoices_by_ksef.get(ksef_number)
+        if invoice is None or invoice.status(time.monotonic())["code"] != 200:
+            raise FakeKSeFError(404, 21164, "Faktura o podanym numerze nie istnieje", [ksef_number])
+        return invoice
+
+    def invoice_upo(self, body, bearer, session=None, ksef=None, **_params):
+        self._check_token(bearer, "access")
+        invoice = self._invoice_by_ksef(ksef)
+        upo = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f"<Potwierdzenie><NumerKSeFDokumentu>{invoice.ksef_number}</NumerKSeFDokumentu>"
+            f"<SkrotDokumentu>{invoice.invoice_hash}</SkrotDokumentu></Potwierdzenie>"
+        )
+        return 200, upo.encode("utf-8")
+
+    def invoice_xml(self, body, bearer, ksef=None, **_params):
+        self._check_token(bearer, "access")
+        return 200, self._invoice_by_ksef(ksef).xml
+
+    def stats(self, body, bearer, **_params):
+        with self._lock:
+            return 200, {"requests": dict(self.requests), "failures": dict(self.failures)}
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        body: dict,
+        bearer: Optional[str],
+        query: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        """Dispatch a request; return ``(HTTP status, JSON-able or bytes payload)``.
+
+        ``headers`` are keyed by lower-case name.
+        """
+        for route_method, pattern, name in _COMPILED_ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                try:
+                    self.inject(name)
+                    return getattr(self, name)(
+                        body, bearer, query=query or {}, headers=headers or {}, **match.groupdict()
+                    )
+                except FakeKSeFError as error:
+                    return error.status, error.payload()
+        return 404, {"detail": f"No route for {method} {path}"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service: FakeKSeFService
+    prefix = ""
+
+    def _dispatch(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+        path, _, query_string = self.path.partition("?")
+        query = {name: values[-1] for name, values in parse_qs(query_string).items()}
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        if self.prefix and path.startswith(self.prefix):
+            path = path[len(self.prefix) :]
+        authorization = self.headers.get("Authorization") or ""
+        bearer = authorization[7:] if authorization.startswith("Bearer ") else None
+
+        status, payload = self.service.handle(method, path, body, bearer, query, headers)
+        if payload is None:
+            data, content_type = b"", None
+        elif isinstance(payload, bytes):
+            data, content_type = payload, "application/xml"
+        else:
+            data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:  # noqa: N802 - http.server API
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:  # noqa: N802 - http.server API
+        self._dispatch("POST")
+
+    def log_message(self, format, *args) -> None:  # noqa: A002 - http.server API
+        pass
+
+
+class FakeKSeFServer:
+    """Serve a :class:`FakeKSeFService` over HTTP from a background thread.
+
+    ``url`` is the base URL to pass to ``KSeFClient(base_url=...)`` or to set
+    as ``KSEF_BASE_URL``. Keyword arguments configure the service.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, prefix: str = "/v2", **options):
+        self.service = FakeKSeFService(**options)
+        handler = type("Handler", (_Handler,), {"service": self.service, "prefix": prefix})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}{prefix}"
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def nip(self) -> str:
+        return self.service.nip
+
+    @property
+    def token(self) -> str:
+        return self.service.token
+
+    def start(self) -> "FakeKSeFServer":
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="fake-ksef", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "FakeKSeFServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def add_service_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options configuring :class:`FakeKSeFService` to ``parser``."""
+    parser.add_argument("--nip", default=DEFAULT_NIP)
+    parser.add_argument("--token", default=DEFAULT_TOKEN)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, seconds")
+    parser.add_argument(
+        "--processing-time", type=float, default=0.0, help="seconds until an invoice is final"
+    )
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of HTTP 503 answers")
+    parser.add_argument(
+        "--rejection-rate", type=float, default=0.0, help="share of invoices rejected with 450"
+    )
+    parser.add_argument(
+        "--fail-endpoint",
+        action="append",
+        dest="fail_endpoints",
+        choices=[name for _method, _pattern, name in ROUTES],
+        help="inject failures only into this endpoint (repeatable)",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def service_options(args: argparse.Namespace) -> dict:
+    return {
+        "nip": args.nip,
+        "token": args.token,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "processing_time": args.processing_time,
+        "failure_rate": args.failure_rate,
+        "rejection_rate": args.rejection_rate,
+        "fail_endpoints": set(args.fail_endpoints or ()),
+        "seed": args.seed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeKSeFServer(args.host, args.port, **service_options(args))
+    print(f"Fake KSeF listening on {server.url} (NIP {server.nip}, token {server.token})", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,13 @@ from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 import logging
 import os
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import uuid
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
+from utils.settings import get_setting, get_setting_bool, reload_settings, save_settings
+
 logger = logging.getLogger(__name__)
 
 KSEF_FA3_NS = "http://crd.gov.pl/wzor/2025/06/25/13775/"
@@ -91,6 +93,8 @@ class InvoiceData:
     recipient_phone: str = ""
 
     invoice_number: str = ""
+    # Counter value the number was generated from, if known.
+    counter: Optional[int] = None
     issue_date: datetime = field(default_factory=datetime.now)
     sale_date: datetime = field(default_factory=datetime.now)
     payment_deadline: datetime = field(default_factory=lambda: datetime.now() + timedelta(days=14))
@@ -130,58 +134,60 @@ class InvoiceData:
 
 
 def load_invoice_settings_from_env() -> Dict[str, str]:
+    """Return invoice and KSeF settings from the settings cache."""
     return {
-        "ksef_enabled": os.getenv("KSEF_ENABLED", "0"),
-        "ksef_environment": os.getenv("KSEF_ENVIRONMENT", "demo"),
-        "ksef_nip": os.getenv("KSEF_NIP", ""),
-        "ksef_token": os.getenv("KSEF_TOKEN", ""),
-        "ksef_token_demo": os.getenv("KSEF_TOKEN_DEMO", ""),
-        "ksef_token_test": os.getenv("KSEF_TOKEN_TEST", ""),
-        "ksef_token_production": os.getenv("KSEF_TOKEN_PRODUCTION", ""),
-        "invoice_issuer_name": os.getenv("INVOICE_ISSUER_NAME", ""),
-        "invoice_issuer_nip": os.getenv("INVOICE_ISSUER_NIP", ""),
-        "invoice_issuer_address": os.getenv("INVOICE_ISSUER_ADDRESS", ""),
-        "invoice_issuer_postal": os.getenv("INVOICE_ISSUER_POSTAL", ""),
-        "invoice_issuer_city": os.getenv("INVOICE_ISSUER_CITY", ""),
-        "invoice_issuer_country": os.getenv("INVOICE_ISSUER_COUNTRY", "PL"),
-        "invoice_issuer_email": os.getenv("INVOICE_ISSUER_EMAIL", ""),
-        "invoice_issuer_phone": os.getenv("INVOICE_ISSUER_PHONE", ""),
-        "invoice_issuer_bank_account": os.getenv("INVOICE_ISSUER_BANK_ACCOUNT", ""),
-        "invoice_issuer_bank_name": os.getenv("INVOICE_ISSUER_BANK_NAME", ""),
-        "invoice_recipient_name": os.getenv("INVOICE_RECIPIENT_NAME", ""),
-        "invoice_recipient_nip": os.getenv("INVOICE_RECIPIENT_NIP", ""),
-        "invoice_recipient_address": os.getenv("INVOICE_RECIPIENT_ADDRESS", ""),
-        "invoice_recipient_postal": os.getenv("INVOICE_RECIPIENT_POSTAL", ""),
-        "invoice_recipient_city": os.getenv("INVOICE_RECIPIENT_CITY", ""),
-        "invoice_recipient_country": os.getenv("INVOICE_RECIPIENT_COUNTRY", "PL"),
-        "invoice_service_name": os.getenv("INVOICE_SERVICE_NAME", "Prowadzenie zajęć podcastowych"),
-        "invoice_hourly_rate": os.getenv("INVOICE_HOURLY_RATE", "0.00"),
-        "invoice_currency": os.getenv("INVOICE_CURRENCY", "PLN"),
-        "invoice_vat_rate": os.getenv("INVOICE_VAT_RATE", "zw"),
-        "invoice_vat_exemption_reason": os.getenv(
-            "INVOICE_VAT_EXEMPTION_REASON",
+        "ksef_enabled": get_setting("ksef_enabled", "0"),
+        "ksef_environment": get_setting("ksef_environment", "demo"),
+        "ksef_nip": get_setting("ksef_nip", ""),
+        "ksef_token": get_setting("ksef_token", ""),
+        "ksef_token_demo": get_setting("ksef_token_demo", ""),
+        "ksef_token_test": get_setting("ksef_token_test", ""),
+        "ksef_token_production": get_setting("ksef_token_production", ""),
+        "invoice_issuer_name": get_setting("invoice_issuer_name", ""),
+        "invoice_issuer_nip": get_setting("invoice_issuer_nip", ""),
+        "invoice_issuer_address": get_setting("invoice_issuer_address", ""),
+        "invoice_issuer_postal": get_setting("invoice_issuer_postal", ""),
+        "invoice_issuer_city": get_setting("invoice_issuer_city", ""),
+        "invoice_issuer_country": get_setting("invoice_issuer_country", "PL"),
+        "invoice_issuer_email": get_setting("invoice_issuer_email", ""),
+        "invoice_issuer_phone": get_setting("invoice_issuer_phone", ""),
+        "invoice_issuer_bank_account": get_setting("invoice_issuer_bank_account", ""),
+        "invoice_issuer_bank_name": get_setting("invoice_issuer_bank_name", ""),
+        "invoice_recipient_name": get_setting("invoice_recipient_name", ""),
+        "invoice_recipient_nip": get_setting("invoice_recipient_nip", ""),
+        "invoice_recipient_address": get_setting("invoice_recipient_address", ""),
+        "invoice_recipient_postal": get_setting("invoice_recipient_postal", ""),
+        "invoice_recipient_city": get_setting("invoice_recipient_city", ""),
+        "invoice_recipient_country": get_setting("invoice_recipient_country", "PL"),
+        "invoice_service_name": get_setting("invoice_service_name", "Prowadzenie zajęć podcastowych"),
+        "invoice_hourly_rate": get_setting("invoice_hourly_rate", "0.00"),
+        "invoice_currency": get_setting("invoice_currency", "PLN"),
+        "invoice_vat_rate": get_setting("invoice_vat_rate", "zw"),
+        "invoice_vat_exemption_reason": get_setting(
+            "invoice_vat_exemption_reason",
             "Zwolnienie na podstawie art. 113 ust. 1 lub 9 Ustawy o VAT",
         ),
-        "invoice_pkwiu": os.getenv("INVOICE_PKWIU", "85.59.19.0"),
-        "invoice_payment_deadline_days": os.getenv("INVOICE_PAYMENT_DEADLINE_DAYS", "14"),
-        "invoice_payment_method": os.getenv("INVOICE_PAYMENT_METHOD", "1"),
-        "invoice_payment_description": os.getenv("INVOICE_PAYMENT_DESCRIPTION", ""),
-        "invoice_issue_place": os.getenv("INVOICE_ISSUE_PLACE", ""),
-        "invoice_number_prefix": os.getenv("INVOICE_NUMBER_PREFIX", "FV"),
-        "invoice_number_counter": os.getenv("INVOICE_NUMBER_COUNTER", "1"),
-        "invoice_number_template": os.getenv(
-            "INVOICE_NUMBER_TEMPLATE", "{prefix}/{counter}/{year}"
+        "invoice_pkwiu": get_setting("invoice_pkwiu", "85.59.19.0"),
+        "invoice_payment_deadline_days": get_setting("invoice_payment_deadline_days", "14"),
+        "invoice_payment_method": get_setting("invoice_payment_method", "1"),
+        "invoice_payment_description": get_setting("invoice_payment_description", ""),
+        "invoice_issue_place": get_setting("invoice_issue_place", ""),
+        "invoice_number_prefix": get_setting("invoice_number_prefix", "FV"),
+        "invoice_number_counter": get_setting("invoice_number_counter", "1"),
+        "invoice_number_template": get_setting(
+            "invoice_number_template", "{prefix}/{counter}/{year}"
         ),
-        "invoice_issue_date_mode": os.getenv("INVOICE_ISSUE_DATE_MODE", "report_month_day"),
-        "invoice_issue_day_of_month": os.getenv("INVOICE_ISSUE_DAY_OF_MONTH", "26"),
-        "invoice_sale_date_mode": os.getenv("INVOICE_SALE_DATE_MODE", "issue_date"),
+        "invoice_issue_date_mode": get_setting("invoice_issue_date_mode", "report_month_day"),
+        "invoice_issue_day_of_month": get_setting("invoice_issue_day_of_month", "26"),
+        "invoice_sale_date_mode": get_setting("invoice_sale_date_mode", "issue_date"),
     }
 
 
-def generate_invoice_number(month: int, year: int) -> str:
+def generate_invoice_number(month: int, year: int, counter: Optional[int] = None) -> str:
     settings = load_invoice_settings_from_env()
     prefix = settings.get("invoice_number_prefix", "FV") or "FV"
-    counter = int(settings.get("invoice_number_counter", "1") or "1")
+    if counter is None:
+        counter = int(settings.get("invoice_number_counter", "1") or "1")
     template = settings.get("invoice_number_template", "{prefix}/{counter}/{year}")
     values = {
         "prefix": prefix,
@@ -222,14 +228,85 @@ def _resolve_sale_date(issue_date: datetime, month: int, year: int, settings: Di
     return issue_date
 
 
-def increment_invoice_counter() -> None:
+def increment_invoice_counter(step: int = 1) -> None:
     from model import Setting, db
 
     setting = Setting.query.filter_by(key="invoice_number_counter").first()
     if setting:
         current = int(setting.value)
-        setting.value = str(current + 1)
+        save_settings({"invoice_number_counter": str(current + step)})
         db.session.commit()
+        reload_settings()
+
+
+# Numbers given back by invoices KSeF did not accept, while later ones were
+# already taken; they are handed out again before the counter moves on.
+RELEASED_COUNTERS_KEY = "invoice_number_released"
+
+
+def _released_counters() -> List[int]:
+    raw = get_setting(RELEASED_COUNTERS_KEY, "") or ""
+    return sorted(int(value) for value in raw.split(",") if value.strip().isdigit())
+
+
+def _save_counters(current: int, released: List[int]) -> None:
+    from model import db
+
+    save_settings(
+        {
+            "invoice_number_counter": str(current),
+            RELEASED_COUNTERS_KEY: ",".join(str(value) for value in sorted(released)),
+        }
+    )
+    db.session.commit()
+    reload_settings()
+
+
+def next_invoice_counter() -> int:
+    """Counter value for the next invoice: the lowest released number, else the counter."""
+    released = _released_counters()
+    if released:
+        return released[0]
+    return int(get_setting("invoice_number_counter", "1") or "1")
+
+
+def take_invoice_counter(counter: int) -> None:
+    """Mark ``counter`` as used, moving the counter past it if needed."""
+    from model import Setting
+
+    setting = Setting.query.filter_by(key="invoice_number_counter").first()
+    if not setting:
+        return
+    current = int(setting.value)
+    released = _released_counters()
+    if counter in released:
+        released.remove(counter)
+    elif counter < current:
+        return
+    _save_counters(max(current, counter + 1), released)
+
+
+def release_invoice_counter(counter: int) -> None:
+    """Give back the number of an invoice KSeF did not accept.
+
+    The counter steps back if no later number was taken; otherwise the
+    number is kept for :func:`next_invoice_counter`, so the sequence has no
+    gaps.
+    """
+    from model import Setting
+
+    setting = Setting.query.filter_by(key="invoice_number_counter").first()
+    if not setting:
+        return
+    current = int(setting.value)
+    released = set(_released_counters())
+    if counter >= current or counter in released:
+        return
+    released.add(counter)
+    while current - 1 in released:
+        current -= 1
+        released.discard(current)
+    _save_counters(current, list(released))
 
 
 def create_invoice_from_monthly_report(
@@ -237,6 +314,7 @@ def create_invoice_from_monthly_report(
     month: int,
     year: int,
     trainer_name: Optional[str] = None,
+    counter: Optional[int] = None,
 ) -> InvoiceData:
     settings = load_invoice_settings_from_env()
     invoice = InvoiceData()
@@ -259,7 +337,10 @@ def create_invoice_from_monthly_report(
     invoice.recipient_city = settings["invoice_recipient_city"]
     invoice.recipient_country = settings["invoice_recipient_country"]
 
-    invoice.invoice_number = generate_invoice_number(month, year)
+    if counter is None:
+        counter = next_invoice_counter()
+    invoice.counter = counter
+    invoice.invoice_number = generate_invoice_number(month, year, counter)
     invoice.issue_date = _resolve_issue_date(month, year, settings)
     invoice.sale_date = _resolve_sale_date(invoice.issue_date, month, year, settings)
     invoice.payment_deadline = invoice.issue_date + timedelta(
@@ -393,5 +474,4 @@ def save_invoice_xml(invoice: InvoiceData, output_path: str) -> str:
 
 
 def is_ksef_enabled() -> bool:
-    enabled = os.getenv("KSEF_ENABLED", "0")
-    return enabled.lower() in {"1", "true", "yes"}
+    return get_setting_bool("ksef_enabled")
@@ -0,0 +1,36 @@
+"""add email outbox
+
+Revision ID: 56f7107b9e8d
+Revises: a1b2c3d4e5f6
+Create Date: 2026-10-18 10:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '56f7107b9e8d'
+down_revision = 'a1b2c3d4e5f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('message', sa.LargeBinary, nullable=False),
+        sa.Column('recipient', sa.String),
+        sa.Column('status', sa.String, nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime, nullable=False),
+        sa.Column('lease_owner', sa.String),
+        sa.Column('leased_until', sa.DateTime),
+        sa.Column('last_error', sa.Text),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('sent_at', sa.DateTime),
+    )
+    op.create_index('ix_email_outbox_status', 'email_outbox', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_status', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,90 @@
+"""add trainer and participant stats tables
+
+Revision ID: 7e3f0a9c2b14
+Revises: d51acc5577e9
+Create Date: 2026-10-18 13:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '7e3f0a9c2b14'
+down_revision = 'd51acc5577e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    trainer_stats = op.create_table(
+        'trainer_stats',
+        sa.Column('prowadzacy_id', sa.Integer(), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('sessions', sa.Integer(), nullable=False),
+        sa.Column('hours', sa.Float(), nullable=False),
+        sa.Column('last_session', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('prowadzacy_id', 'year', 'month'),
+    )
+    participant_stats = op.create_table(
+        'participant_stats',
+        sa.Column('uczestnik_id', sa.Integer(), nullable=False),
+        sa.Column('prowadzacy_id', sa.Integer(), nullable=True),
+        sa.Column('present', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('uczestnik_id'),
+    )
+    op.create_index(
+        'ix_participant_stats_prowadzacy_id', 'participant_stats', ['prowadzacy_id']
+    )
+
+    # Backfill; `flask rebuild-stats` runs the same computation later on.
+    zajecia = sa.table(
+        'zajecia',
+        sa.column('id', sa.Integer),
+        sa.column('prowadzacy_id', sa.Integer),
+        sa.column('data', sa.DateTime),
+        sa.column('czas_trwania', sa.Float),
+    )
+    uczestnik = sa.table(
+        'uczestnik', sa.column('id', sa.Integer), sa.column('prowadzacy_id', sa.Integer)
+    )
+    obecnosci = sa.table(
+        'obecnosci', sa.column('zajecia_id', sa.Integer), sa.column('uczestnik_id', sa.Integer)
+    )
+    year = sa.extract('year', zajecia.c.data)
+    month = sa.extract('month', zajecia.c.data)
+    op.execute(
+        trainer_stats.insert().from_select(
+            ['prowadzacy_id', 'year', 'month', 'sessions', 'hours', 'last_session'],
+            sa.select(
+                zajecia.c.prowadzacy_id,
+                year,
+                month,
+                sa.func.count(zajecia.c.id),
+                sa.func.coalesce(sa.func.sum(zajecia.c.czas_trwania), 0.0),
+                sa.func.max(zajecia.c.data),
+            )
+            .where(zajecia.c.prowadzacy_id.is_not(None), zajecia.c.data.is_not(None))
+            .group_by(zajecia.c.prowadzacy_id, year, month),
+        )
+    )
+    op.execute(
+        participant_stats.insert().from_select(
+            ['uczestnik_id', 'prowadzacy_id', 'present'],
+            sa.select(uczestnik.c.id, uczestnik.c.prowadzacy_id, sa.func.count(zajecia.c.id))
+            .select_from(uczestnik)
+            .outerjoin(obecnosci, obecnosci.c.uczestnik_id == uczestnik.c.id)
+            .outerjoin(
+                zajecia,
+                sa.and_(
+                    zajecia.c.id == obecnosci.c.zajecia_id,
+                    zajecia.c.prowadzacy_id == uczestnik.c.prowadzacy_id,
+                ),
+            )
+            .group_by(uczestnik.c.id, uczestnik.c.prowadzacy_id),
+        )
+    )
+
+
+def downgrade():
+    op.drop_index('ix_participant_stats_prowadzacy_id', table_name='participant_stats')
+    op.drop_table('participant_stats')
+    op.drop_table('trainer_stats')
@@ -0,0 +1,28 @@
+"""add cached project hours counter
+
+Revision ID: b8c41d27e5a3
+Revises: 7e3f0a9c2b14
+Create Date: 2026-10-18 14:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'b8c41d27e5a3'
+down_revision = '7e3f0a9c2b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in on first read of the admin dashboard.
+    op.create_table(
+        'project_hours',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('start_date', sa.String(), nullable=False),
+        sa.Column('used_hours', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('project_hours')
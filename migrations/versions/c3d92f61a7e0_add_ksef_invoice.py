@@ -0,0 +1,43 @@
+"""add ksef invoice status records
+
+Revision ID: c3d92f61a7e0
+Revises: b8c41d27e5a3
+Create Date: 2026-10-18 16:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'c3d92f61a7e0'
+down_revision = 'b8c41d27e5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ksef_invoice',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('invoice_number', sa.String, nullable=False),
+        sa.Column('prowadzacy_id', sa.Integer),
+        sa.Column('environment', sa.String, nullable=False),
+        sa.Column('session_reference_number', sa.String, nullable=False),
+        sa.Column('invoice_reference_number', sa.String, nullable=False),
+        sa.Column('status', sa.String, nullable=False, server_default='pending'),
+        sa.Column('status_code', sa.Integer),
+        sa.Column('status_description', sa.Text),
+        sa.Column('ksef_number', sa.String),
+        sa.Column('polls', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('next_poll_at', sa.DateTime, nullable=False),
+        sa.Column('lease_owner', sa.String),
+        sa.Column('leased_until', sa.DateTime),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('completed_at', sa.DateTime),
+    )
+    op.create_index('ix_ksef_invoice_status', 'ksef_invoice', ['status'])
+    op.create_index('ix_ksef_invoice_prowadzacy_id', 'ksef_invoice', ['prowadzacy_id'])
+
+
+def downgrade():
+    op.drop_index('ix_ksef_invoice_prowadzacy_id', table_name='ksef_invoice')
+    op.drop_index('ix_ksef_invoice_status', table_name='ksef_invoice')
+    op.drop_table('ksef_invoice')
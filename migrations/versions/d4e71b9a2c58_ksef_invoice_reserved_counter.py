@@ -0,0 +1,23 @@
+"""keep the invoice number held by a ksef invoice upload
+
+Revision ID: d4e71b9a2c58
+Revises: c3d92f61a7e0
+Create Date: 2026-10-18 18:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'd4e71b9a2c58'
+down_revision = 'c3d92f61a7e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ksef_invoice') as batch_op:
+        batch_op.add_column(sa.Column('reserved_counter', sa.Integer))
+
+
+def downgrade():
+    with op.batch_alter_table('ksef_invoice') as batch_op:
+        batch_op.drop_column('reserved_counter')
@@ -0,0 +1,80 @@
+"""add indexes for trainer, date and attendance lookups
+
+Revision ID: d51acc5577e9
+Revises: 56f7107b9e8d
+Create Date: 2026-10-18 11:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'd51acc5577e9'
+down_revision = '56f7107b9e8d'
+branch_labels = None
+depends_on = None
+
+
+def _remove_duplicate_attendance(conn):
+    duplicates = conn.execute(
+        sa.text(
+            "SELECT COUNT(*) FROM (SELECT zajecia_id, uczestnik_id FROM obecnosci "
+            "GROUP BY zajecia_id, uczestnik_id HAVING COUNT(*) > 1) d"
+        )
+    ).scalar()
+    if not duplicates:
+        return
+    conn.execute(
+        sa.text(
+            "CREATE TEMPORARY TABLE obecnosci_dedup AS "
+            "SELECT DISTINCT zajecia_id, uczestnik_id FROM obecnosci"
+        )
+    )
+    conn.execute(sa.text("DELETE FROM obecnosci"))
+    conn.execute(
+        sa.text(
+            "INSERT INTO obecnosci (zajecia_id, uczestnik_id) "
+            "SELECT zajecia_id, uczestnik_id FROM obecnosci_dedup"
+        )
+    )
+    conn.execute(sa.text("DROP TABLE obecnosci_dedup"))
+
+
+INDEXES = [
+    ('ix_zajecia_prowadzacy_id_data', 'zajecia', ['prowadzacy_id', 'data'], False),
+    ('ix_zajecia_data', 'zajecia', ['data'], False),
+    ('ix_uczestnik_prowadzacy_id', 'uczestnik', ['prowadzacy_id'], False),
+    ('uq_obecnosci_zajecia_id_uczestnik_id', 'obecnosci', ['zajecia_id', 'uczestnik_id'], True),
+    ('ix_obecnosci_uczestnik_id', 'obecnosci', ['uczestnik_id'], False),
+    ('ix_password_reset_token_expires_at', 'password_reset_token', ['expires_at'], False),
+]
+
+
+def _existing_indexes(inspector, table):
+    """Index names on ``table``, or None when the table does not exist.
+
+    Some tables (e.g. password_reset_token) may have been created by
+    ``db.create_all()`` rather than by a migration, possibly with the indexes.
+    """
+    if not inspector.has_table(table):
+        return None
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    conn = op.get_bind()
+    # The unique index below would fail on repeated attendance rows.
+    _remove_duplicate_attendance(conn)
+
+    inspector = sa.inspect(conn)
+    for name, table, columns, unique in INDEXES:
+        existing = _existing_indexes(inspector, table)
+        if existing is None or name in existing:
+            continue
+        op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, _columns, _unique in reversed(INDEXES):
+        existing = _existing_indexes(inspector, table)
+        if existing and name in existing:
+            op.drop_index(name, table_name=table)
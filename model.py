@@ -13,7 +13,9 @@ db = SQLAlchemy()
 # Tabela pośrednia
 obecnosci = db.Table('obecnosci',
     db.Column('zajecia_id', db.Integer, db.ForeignKey('zajecia.id')),
-    db.Column('uczestnik_id', db.Integer, db.ForeignKey('uczestnik.id'))
+    db.Column('uczestnik_id', db.Integer, db.ForeignKey('uczestnik.id')),
+    db.Index('uq_obecnosci_zajecia_id_uczestnik_id', 'zajecia_id', 'uczestnik_id', unique=True),
+    db.Index('ix_obecnosci_uczestnik_id', 'uczestnik_id'),
 )
 
 class Prowadzacy(db.Model):
@@ -37,7 +39,7 @@ class Uczestnik(db.Model):
     __tablename__ = "uczestnik"
     id = db.Column(db.Integer, primary_key=True)
     imie_nazwisko = db.Column(db.String)
-    prowadzacy_id = db.Column(db.Integer, db.ForeignKey("prowadzacy.id"))
+    prowadzacy_id = db.Column(db.Integer, db.ForeignKey("prowadzacy.id"), index=True)
 
     prowadzacy = db.relationship("Prowadzacy", back_populates="uczestnicy")
     zajecia = db.relationship("Zajecia", secondary=obecnosci, back_populates="obecni")
@@ -47,9 +49,12 @@ class Uczestnik(db.Model):
 
 class Zajecia(db.Model):
     __tablename__ = "zajecia"
+    __table_args__ = (
+        db.Index("ix_zajecia_prowadzacy_id_data", "prowadzacy_id", "data"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     prowadzacy_id = db.Column(db.Integer, db.ForeignKey("prowadzacy.id"))
-    data = db.Column(db.DateTime)
+    data = db.Column(db.DateTime, index=True)
     czas_trwania = db.Column(db.Float)
     wyslano = db.Column(db.Boolean, default=False)
 
@@ -100,11 +105,118 @@ class PasswordResetToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("uzytkownik.id"), nullable=False)
     token = db.Column(db.String, unique=True, nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
 
     user = db.relationship("Uzytkownik")
 
 
+class EmailOutbox(db.Model):
+    """Outgoing e-mail waiting to be delivered by :mod:`utils.outbox`.
+
+    ``status`` is ``pending``, ``sent`` or ``dead``. A worker claims a row by
+    setting ``lease_owner``/``leased_until``; expired leases may be taken over.
+    """
+
+    __tablename__ = "email_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.LargeBinary, nullable=False)
+    recipient = db.Column(db.String)
+    status = db.Column(db.String, nullable=False, default="pending", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String)
+    leased_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self) -> str:  # pragma: no cover - trivial
+        return f"<EmailOutbox id={self.id} status='{self.status}' to='{self.recipient}'>"
+
+
+class KSeFInvoice(db.Model):
+    """Invoice uploaded to KSeF and its processing status.
+
+    ``status`` is ``pending`` until :mod:`utils.ksef_poller` sees a final KSeF
+    status, then ``accepted`` or ``rejected``; ``expired`` if KSeF did not
+    finish in time. Pollers lease rows like the e-mail outbox does.
+    ``reserved_counter`` is the invoice counter value this upload holds; it
+    is given back if the invoice is not accepted.
+    """
+
+    __tablename__ = "ksef_invoice"
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_number = db.Column(db.String, nullable=False)
+    prowadzacy_id = db.Column(db.Integer, index=True)
+    environment = db.Column(db.String, nullable=False)
+    session_reference_number = db.Column(db.String, nullable=False)
+    invoice_reference_number = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default="pending", index=True)
+    status_code = db.Column(db.Integer)
+    status_description = db.Column(db.Text)
+    ksef_number = db.Column(db.String)
+    reserved_counter = db.Column(db.Integer)
+    polls = db.Column(db.Integer, nullable=False, default=0)
+    next_poll_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String)
+    leased_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+    def __repr__(self) -> str:  # pragma: no cover - trivial
+        return f"<KSeFInvoice id={self.id} number='{self.invoice_number}' status='{self.status}'>"
+
+
+class TrainerStats(db.Model):
+    """Sessions and hours of a trainer in one month.
+
+    Derived from ``zajecia`` and kept up to date by :mod:`utils.stats`; there
+    are no foreign keys so rows can be refreshed after the sessions change.
+    """
+
+    __tablename__ = "trainer_stats"
+    prowadzacy_id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    hours = db.Column(db.Float, nullable=False, default=0)
+    last_session = db.Column(db.DateTime)
+
+    def __repr__(self) -> str:  # pragma: no cover - trivial
+        return (
+            f"<TrainerStats prowadzacy_id={self.prowadzacy_id} "
+            f"{self.year}-{self.month:02d} sessions={self.sessions}>"
+        )
+
+
+class ParticipantStats(db.Model):
+    """Number of the trainer's sessions a participant attended (see :class:`TrainerStats`)."""
+
+    __tablename__ = "participant_stats"
+    uczestnik_id = db.Column(db.Integer, primary_key=True)
+    prowadzacy_id = db.Column(db.Integer, index=True)
+    present = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:  # pragma: no cover - trivial
+        return f"<ParticipantStats uczestnik_id={self.uczestnik_id} present={self.present}>"
+
+
+class ProjectHours(db.Model):
+    """Cached total of session hours since ``project_start_date`` (one row).
+
+    ``start_date`` records the start date the total was counted from, so a
+    changed setting is detected and the total recounted.
+    """
+
+    __tablename__ = "project_hours"
+    id = db.Column(db.Integer, primary_key=True)
+    start_date = db.Column(db.String, nullable=False, default="")
+    used_hours = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self) -> str:  # pragma: no cover - trivial
+        return f"<ProjectHours start_date='{self.start_date}' used_hours={self.used_hours}>"
+
+
 class ArchivedProject(db.Model):
     __tablename__ = "archived_project"
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,217 @@
+"""Per-trainer report and invoice rendering for ``flask generate-reports``.
+
+Jobs are plain, picklable snapshots of the database rows a trainer's report
+needs, so they can be rendered in worker processes.  Everything that touches
+the database (loading rows, advancing the invoice counter, KSeF submission and
+e-mail) stays in the parent process.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReportJob:
+    trainer_id: int
+    imie: Optional[str]
+    nazwisko: Optional[str]
+    numer_umowy: Optional[str]
+    podpis_filename: Optional[str]
+    sessions: List[Tuple[datetime, float]]
+    month: int
+    year: int
+    output_path: str
+    template: str = "rejestr.docx"
+    podpis_dir: str = "static"
+    invoice_counter: Optional[int] = None
+    reuse_report: bool = False
+
+    @property
+    def trainer_name(self) -> str:
+        return f"{self.imie} {self.nazwisko}"
+
+    @property
+    def hours(self) -> float:
+        return sum(czas or 0 for _data, czas in self.sessions)
+
+
+@dataclass
+class ReportResult:
+    trainer_id: int
+    path: str
+    report: Optional[bytes] = None
+    invoice: Optional[object] = None
+    invoice_xml: Optional[str] = None
+    invoice_pdf: Optional[bytes] = None
+    invoice_path: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def _render_report(job: ReportJob, result: ReportResult, render: Callable) -> None:
+    trainer = SimpleNamespace(
+        id=job.trainer_id,
+        imie=job.imie,
+        nazwisko=job.nazwisko,
+        numer_umowy=job.numer_umowy,
+        podpis_filename=job.podpis_filename,
+    )
+    sessions = [
+        SimpleNamespace(data=data, czas_trwania=czas) for data, czas in job.sessions
+    ]
+    doc = render(trainer, sessions, job.template, job.podpis_dir, job.month, job.year)
+    buf = BytesIO()
+    doc.save(buf)
+    result.report = buf.getvalue()
+    with open(job.output_path, "wb") as fh:
+        fh.write(result.report)
+
+
+def run_report_job(job: ReportJob, render: Optional[Callable] = None) -> ReportResult:
+    """Render one trainer's report (and invoice files) without touching the DB.
+
+    With ``job.reuse_report`` set the report already on disk is read back
+    instead of being rendered again.
+    """
+    if render is None:
+        from doc_generator import generuj_raport_miesieczny as render
+
+    result = ReportResult(trainer_id=job.trainer_id, path=job.output_path)
+    try:
+        started = time.perf_counter()
+        if job.reuse_report:
+            with open(job.output_path, "rb") as fh:
+                result.report = fh.read()
+            result.timings["cached"] = time.perf_counter() - started
+        else:
+            _render_report(job, result, render)
+            result.timings["report"] = time.perf_counter() - started
+
+        if job.invoice_counter is not None and job.hours > 0:
+            started = time.perf_counter()
+            from invoice_helper import build_invoice_files
+
+            invoice, invoice_xml, pdf_buffer, saved_path = build_invoice_files(
+                hours=job.hours,
+                month=job.month,
+                year=job.year,
+                trainer_name=job.trainer_name,
+                counter=job.invoice_counter,
+            )
+            result.invoice = invoice
+            result.invoice_xml = invoice_xml
+            result.invoice_pdf = pdf_buffer.getvalue()
+            result.invoice_path = saved_path
+            result.timings["invoice"] = time.perf_counter() - started
+    except Exception as exc:  # reported per trainer by the caller
+        logger.exception("Report job for trainer %s failed", job.trainer_id)
+        result.error = str(exc) or exc.__class__.__name__
+    return result
+
+
+def run_report_jobs(
+    jobs: Iterable[ReportJob], workers: int = 1, render: Optional[Callable] = None
+) -> List[ReportResult]:
+    """Run ``jobs`` inline or on a pool of ``workers`` processes, keeping order.
+
+    ``render`` is only honoured inline; worker processes always import
+    :func:`doc_generator.generuj_raport_miesieczny` themselves.
+    """
+    jobs = list(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        return [run_report_job(job, render) for job in jobs]
+
+    # ``spawn`` avoids forking a process that holds open DB connections.
+    context = multiprocessing.get_context("spawn")
+    workers = min(workers, len(jobs))
+    # Workers have no database session, so they get the parent's settings.
+    from utils.settings import prime_settings, settings
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=prime_settings,
+        initargs=(settings.snapshot(),),
+    ) as pool:
+        return list(pool.map(partial(run_report_job, render=None), jobs))
+
+
+def _file_digest(path: Optional[str]) -> Optional[str]:
+    if not path or not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def report_fingerprint(job: ReportJob) -> str:
+    """Hash every input that affects the rendered report of ``job``.
+
+    Covers the session rows, the trainer fields printed in the report and the
+    contents of the template and signature files.
+    """
+    podpis_path = (
+        os.path.join(job.podpis_dir, job.podpis_filename) if job.podpis_filename else None
+    )
+    payload = {
+        "trainer": [job.trainer_id, job.imie, job.nazwisko, job.numer_umowy, job.podpis_filename],
+        "sessions": [[data.isoformat(), czas] for data, czas in job.sessions],
+        "period": [job.month, job.year],
+        "template": _file_digest(job.template),
+        "signature": _file_digest(podpis_path),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ReportManifest:
+    """JSON file mapping each trainer/month report to its input fingerprint."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                self.entries = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable report manifest %s", path)
+
+    @staticmethod
+    def key(job: ReportJob) -> str:
+        return f"{job.trainer_id}/{job.month}/{job.year}"
+
+    def is_current(self, job: ReportJob, fingerprint: str) -> bool:
+        """Return True if the report on disk was rendered from ``fingerprint``."""
+        entry = self.entries.get(self.key(job))
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return False
+        return _file_digest(job.output_path) == entry.get("sha256")
+
+    def record(self, job: ReportJob, fingerprint: str, report: bytes) -> None:
+        self.entries[self.key(job)] = {
+            "fingerprint": fingerprint,
+            "path": job.output_path,
+            "sha256": hashlib.sha256(report).hexdigest(),
+        }
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(self.entries, fh, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -1,4 +1,5 @@
 from flask import (
+    Response,
     render_template,
     request,
     redirect,
@@ -7,10 +8,21 @@ from flask import (
     send_file,
     abort,
     current_app,
+    stream_with_context,
 )
 from flask_login import current_user
+from sqlalchemy.orm import joinedload, selectinload
 from utils.auth import role_required
-from model import db, Prowadzacy, Zajecia, Uczestnik, Uzytkownik, Setting, ArchivedProject
+from utils.pagination import paginate_sessions
+from model import (
+    db,
+    Prowadzacy,
+    Zajecia,
+    Uczestnik,
+    Uzytkownik,
+    ArchivedProject,
+    KSeFInvoice,
+)
 from utils import (
     email_do_koordynatora,
     send_plain_email,
@@ -19,13 +31,19 @@ from utils import (
     SignatureValidationError,
     load_db_settings,
     process_signature,
+    get_attendance_stats,
+    get_last_session_dates,
+    get_session_count,
+    get_month_sessions,
 )
+from utils.settings import get_setting, get_setting_float, save_settings
+from utils.stats import get_project_used_hours
 from doc_generator import generuj_raport_miesieczny, generuj_liste_obecnosci
 from io import BytesIO
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import smtplib
 import logging
 import json
@@ -33,48 +51,56 @@ from . import routes_bp
 
 logger = logging.getLogger(__name__)
 
+# Rejected and expired KSeF invoices stay on the dashboard this long.
+KSEF_FAILURES_SHOWN_DAYS = 30
+
 
 @routes_bp.route("/admin")
 @role_required("admin")
 def admin_dashboard():
 
-    prowadzacy = Prowadzacy.query.all()
-    new_users = Uzytkownik.query.filter_by(role="prowadzacy", approved=False).all()
+    # Project hours tracking; read first because a (re)count commits.
+    used_hours = get_project_used_hours()
+
+    prowadzacy = Prowadzacy.query.options(selectinload(Prowadzacy.uczestnicy)).all()
+    new_users = (
+        Uzytkownik.query.options(joinedload(Uzytkownik.prowadzacy))
+        .filter_by(role="prowadzacy", approved=False)
+        .all()
+    )
 
     for p in prowadzacy:
         p.uczestnicy = sorted(p.uczestnicy, key=lambda x: x.imie_nazwisko.lower())
 
     p_id = request.args.get("p_id", type=int)
-    page = request.args.get("page", 1, type=int)
     edit_mode = request.args.get("edit") == "1"
-    query = Zajecia.query.order_by(Zajecia.data.desc())
+    query = Zajecia.query.options(
+        joinedload(Zajecia.prowadzacy), selectinload(Zajecia.obecni)
+    )
     if p_id:
         query = query.filter_by(prowadzacy_id=p_id)
-    pagination = query.paginate(page=page, per_page=10, error_out=False)
+    pagination = paginate_sessions(
+        query,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        total=get_session_count(p_id or None),
+    )
     zajecia = pagination.items
-    ostatnie = {}
-    for p in prowadzacy:
-        ostatnie_zajecia = (
-            Zajecia.query.filter_by(prowadzacy_id=p.id)
-            .order_by(Zajecia.data.desc())
-            .first()
-        )
-        if ostatnie_zajecia:
-            ostatnie[p.id] = ostatnie_zajecia.data
-
-    # Project hours tracking
-    project_total = float(os.getenv("PROJECT_TOTAL_HOURS", "0") or "0")
-    project_start = os.getenv("PROJECT_START_DATE", "")
-    used_hours_query = db.session.query(db.func.coalesce(db.func.sum(Zajecia.czas_trwania), 0))
-    if project_start:
-        try:
-            start_dt = datetime.strptime(project_start, "%Y-%m-%d")
-            used_hours_query = used_hours_query.filter(Zajecia.data >= start_dt)
-        except ValueError:
-            pass
-    used_hours = float(used_hours_query.scalar())
+    ostatnie = get_last_session_dates()
+
+    project_total = get_setting_float("project_total_hours", 0.0)
     remaining_hours = max(project_total - used_hours, 0)
 
+    ksef_failures = (
+        KSeFInvoice.query.filter(
+            KSeFInvoice.status.in_(("rejected", "expired")),
+            KSeFInvoice.completed_at
+            >= datetime.utcnow() - timedelta(days=KSEF_FAILURES_SHOWN_DAYS),
+        )
+        .order_by(KSeFInvoice.completed_at.desc())
+        .all()
+    )
+
     return render_template(
         "admin.html",
         prowadzacy=prowadzacy,
@@ -87,6 +113,8 @@ def admin_dashboard():
         project_total_hours=project_total,
         project_used_hours=used_hours,
         project_remaining_hours=remaining_hours,
+        ksef_failures=ksef_failures,
+        trainer_names={p.id: f"{p.imie} {p.nazwisko}" for p in prowadzacy},
     )
 
 
@@ -189,6 +217,7 @@ def admin_settings():
     ]
 
     if request.method == "POST":
+        updates: dict[str, str] = {}
         for key in keys:
             if key in ("remove_signature_bg", "email_use_trainer_name", "ksef_enabled"):
                 val = "1" if request.form.get(key) else "0"
@@ -196,12 +225,7 @@ def admin_settings():
                 val = request.form.get(key)
             if val is None:
                 continue
-            setting = db.session.get(Setting, key)
-            if setting:
-                setting.value = val
-            else:
-                db.session.add(Setting(key=key, value=val))
-            os.environ[key.upper()] = val
+            updates[key] = val
 
         widths: dict[str, dict[str, float]] = {}
         for form_key, form_val in request.form.items():
@@ -230,8 +254,7 @@ def admin_settings():
 
             values = {}
             for key in keys:
-                setting = db.session.get(Setting, key)
-                values[key] = os.getenv(key.upper(), setting.value if setting else "")
+                values[key] = get_setting(key, "")
                 if key in ("remove_signature_bg", "email_use_trainer_name", "ksef_enabled"):
                     if request.form.get(key) is not None:
                         values[key] = "1"
@@ -247,30 +270,10 @@ def admin_settings():
                 **_template_info()
             )
 
-        for key in keys:
-            if key in ("remove_signature_bg", "email_use_trainer_name", "ksef_enabled"):
-                val = "1" if request.form.get(key) else "0"
-            else:
-                val = request.form.get(key)
-            if val is None:
-                continue
-            setting = db.session.get(Setting, key)
-            if setting:
-                setting.value = val
-            else:
-                db.session.add(Setting(key=key, value=val))
-            os.environ[key.upper()] = val
-
         for table, cols in widths.items():
             parts = [f"{col}={num}" for col, num in cols.items()]
-            val = ",".join(parts)
-            key = f"table_{table}_widths"
-            setting = db.session.get(Setting, key)
-            if setting:
-                setting.value = val
-            else:
-                db.session.add(Setting(key=key, value=val))
-            os.environ[key.upper()] = val
+            updates[f"table_{table}_widths"] = ",".join(parts)
+        save_settings(updates)
 
         # Handle document template uploads
         for field, filename in [("szablon_docx", "szablon.docx"), ("rejestr_docx", "rejestr.docx")]:
@@ -295,10 +298,7 @@ def admin_settings():
         flash("Ustawienia zostały zapisane", "success")
         return redirect(url_for("routes.admin_settings"))
 
-    values = {}
-    for key in keys:
-        setting = db.session.get(Setting, key)
-        values[key] = os.getenv(key.upper(), setting.value if setting else "")
+    values = {key: get_setting(key, "") for key in keys}
 
     widths: dict[str, dict[str, float]] = {}
     for key, val in values.items():
@@ -365,9 +365,9 @@ def raport(prowadzacy_id):
         abort(400)
     wyslij = request.args.get("wyslij") == "1"
 
-    wszystkie = Zajecia.query.filter_by(prowadzacy_id=prowadzacy_id).all()
+    sesje = get_month_sessions(prowadzacy_id, miesiac, rok)
     doc = generuj_raport_miesieczny(
-        prow, wszystkie, "rejestr.docx", "static", miesiac, rok
+        prow, sesje, "rejestr.docx", "static", miesiac, rok
     )
 
     buf = BytesIO()
@@ -490,7 +490,8 @@ def usun_prowadzacego(id):
     if not prow:
         abort(404)
 
-    Uczestnik.query.filter_by(prowadzacy_id=prow.id).delete()
+    # The ORM cascade also removes the participants' and sessions' attendance
+    # rows and unlinks the trainer's account, which foreign keys require.
     db.session.delete(prow)
     db.session.commit()
 
@@ -506,13 +507,7 @@ def admin_trainer(id):
         abort(404)
 
     uczestnicy = sorted(prow.uczestnicy, key=lambda x: x.imie_nazwisko.lower())
-    zajecia = Zajecia.query.filter_by(prowadzacy_id=prow.id).all()
-    total_sessions = len(zajecia)
-    stats = {}
-    for u in uczestnicy:
-        present = sum(1 for z in u.zajecia if z.prowadzacy_id == prow.id)
-        percent = (present / total_sessions * 100) if total_sessions else 0
-        stats[u.id] = {"present": present, "percent": percent}
+    stats, total_sessions = get_attendance_stats(prow.id, uczestnicy)
     edit_mode = request.args.get("edit") == "1"
 
     return render_template(
@@ -592,7 +587,7 @@ def approve_user(id):
             user.login,
             "REG_EMAIL_SUBJECT",
             "REG_EMAIL_BODY",
-            f"Aktywacja konta w {os.getenv('COURSE_NAME', 'ShareOKO')}",
+            f"Aktywacja konta w {get_setting('course_name', 'ShareOKO')}",
             "Twoje konto zostało zatwierdzone i jest już aktywne.",
         )
     except smtplib.SMTPException:
@@ -701,15 +696,11 @@ def admin_statystyki(trainer_id):
     if not prow:
         abort(404)
 
-    total = Zajecia.query.filter_by(prowadzacy_id=trainer_id).count()
     uczestnicy = sorted(prow.uczestnicy, key=lambda x: x.imie_nazwisko.lower())
     edit_mode = request.args.get("edit") == "1"
 
-    stats = []
-    for u in uczestnicy:
-        present = sum(1 for z in u.zajecia if z.prowadzacy_id == trainer_id)
-        percent = (present / total * 100) if total else 0
-        stats.append({"uczestnik": u, "present": present, "percent": percent})
+    stats_map, total = get_attendance_stats(trainer_id, uczestnicy)
+    stats = [stats_map[u.id] for u in uczestnicy]
 
     return render_template(
         "admin_statystyki.html",
@@ -720,6 +711,59 @@ def admin_statystyki(trainer_id):
     )
 
 
+@routes_bp.route("/admin/import", methods=["GET", "POST"])
+@role_required("admin")
+def admin_import():
+    """Bulk import sessions with attendance from a CSV or JSON file."""
+    from attendance_import import AttendanceImportError, import_file
+
+    errors = []
+    if request.method == "POST":
+        plik = request.files.get("plik")
+        if not plik or not plik.filename:
+            flash("Wybierz plik do importu", "danger")
+            return redirect(url_for("routes.admin_import"))
+        try:
+            result = import_file(
+                plik.stream,
+                plik.filename,
+                create_participants=request.form.get("utworz_uczestnikow") == "1",
+            )
+        except AttendanceImportError as exc:
+            errors = exc.errors
+        else:
+            flash(
+                f"Zaimportowano {result.sessions} zajęć i {result.attendance} obecności"
+                f" (nowi uczestnicy: {result.participants_created})",
+                "success",
+            )
+            return redirect(url_for("routes.admin_import"))
+    return render_template("admin_import.html", errors=errors)
+
+
+@routes_bp.route("/admin/eksport")
+@role_required("admin")
+def admin_eksport():
+    """Stream sessions, an attendance matrix or monthly hours as CSV or XLSX."""
+    from exports import EXPORTS, FORMATS, ExportFilters, export_chunks
+
+    rodzaj = request.args.get("rodzaj", "zajecia")
+    fmt = request.args.get("format", "csv")
+    if rodzaj not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+    try:
+        export = EXPORTS[rodzaj](ExportFilters.from_args(request.args))
+    except ValueError:
+        abort(400)
+    except LookupError:
+        abort(404)
+    return Response(
+        stream_with_context(export_chunks(export, fmt)),
+        content_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{export.name}.{fmt}"'},
+    )
+
+
 @routes_bp.route("/admin/archiwum")
 @role_required("admin")
 def admin_archiwum():
@@ -9,7 +9,7 @@ from utils import (
     create_trainer,
     purge_expired_tokens,
 )
-import os
+from utils.settings import get_setting
 import uuid
 import smtplib
 from datetime import datetime, timedelta
@@ -74,7 +74,7 @@ def register():
                 "routes.approve_user", id=user.id, _external=True
             )
             send_plain_email(
-                os.getenv('EMAIL_RECIPIENT', 'kontakt@vestmedia.pl'),
+                get_setting('email_recipient', 'kontakt@vestmedia.pl'),
                 'REGISTRATION_EMAIL_SUBJECT',
                 'REGISTRATION_EMAIL_BODY',
                 'Nowa rejestracja prowadzącego',
@@ -112,7 +112,7 @@ def reset_request():
                         user.login,
                         'RESET_EMAIL_SUBJECT',
                         'RESET_EMAIL_BODY',
-                        f'Reset hasła w {os.getenv("COURSE_NAME", "ShareOKO")}',
+                        f'Reset hasła w {get_setting("course_name", "ShareOKO")}',
                         'Aby ustawić nowe hasło, otwórz link: {link}',
                         link=link
                     )
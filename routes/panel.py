@@ -1,6 +1,7 @@
 from flask import render_template, redirect, url_for, flash, send_file, request, abort
 from flask_login import current_user
 from utils.auth import role_required
+from utils.pagination import paginate_sessions
 from io import BytesIO
 from model import db, Uczestnik, Zajecia
 from doc_generator import generuj_liste_obecnosci, generuj_raport_miesieczny
@@ -15,8 +16,10 @@ from utils import (
     process_signature,
     email_do_koordynatora,
     send_attendance_list,
-    get_participant_stats,
+    get_attendance_stats,
+    get_last_session,
     get_monthly_summary,
+    get_month_sessions,
 )
 
 logger = logging.getLogger(__name__)
@@ -30,23 +33,25 @@ def panel():
     if not prow:
         abort(404)
 
-    uczestnicy, all_zajecia, stats, total_sessions = get_participant_stats(prow)
+    uczestnicy = sorted(prow.uczestnicy, key=lambda x: x.imie_nazwisko.lower())
     edit_mode = request.args.get("edit") == "1"
     edit_profile = request.args.get("edit_profile") == "1"
-    page = request.args.get("page", 1, type=int)
-    pagination = (
-        Zajecia.query.filter_by(prowadzacy_id=prow.id)
-        .order_by(Zajecia.data.desc())
-        .paginate(page=page, per_page=10, error_out=False)
+    stats, total_sessions = get_attendance_stats(prow.id, uczestnicy)
+    pagination = paginate_sessions(
+        Zajecia.query.filter_by(prowadzacy_id=prow.id),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        total=total_sessions,
     )
     zajecia = pagination.items
-    ostatnie = all_zajecia[0] if all_zajecia else None
+    first_page = not pagination.has_prev
+    ostatnie = zajecia[0] if first_page and zajecia else get_last_session(prow.id)
     domyslny_czas = (
         str(prow.domyslny_czas).replace(".", ",").rstrip("0").rstrip(",")
         if prow.domyslny_czas is not None
         else ""
     )
-    podsumowanie = get_monthly_summary(all_zajecia)
+    podsumowanie = get_monthly_summary(prow.id)
     return render_template(
         "panel.html",
         prowadzacy=prow,
@@ -283,11 +288,7 @@ def panel_raport():
     if not prow:
         abort(404)
 
-    ostatnie = (
-        Zajecia.query.filter_by(prowadzacy_id=prow.id)
-        .order_by(Zajecia.data.desc())
-        .first()
-    )
+    ostatnie = get_last_session(prow.id)
     if not ostatnie:
         abort(404)
 
@@ -302,9 +303,9 @@ def panel_raport():
         return redirect(url_for("routes.panel"))
     wyslij = request.args.get("wyslij") == "1"
 
-    wszystkie = Zajecia.query.filter_by(prowadzacy_id=prow.id).all()
+    sesje = get_month_sessions(prow.id, miesiac, rok)
     doc = generuj_raport_miesieczny(
-        prow, wszystkie, "rejestr.docx", "static", miesiac, rok
+        prow, sesje, "rejestr.docx", "static", miesiac, rok
     )
 
     buf = BytesIO()
@@ -7,7 +7,7 @@ import json
 import subprocess
 from app import create_app
 from datetime import datetime, timedelta
-from model import db, Uzytkownik, Prowadzacy, Zajecia, Uczestnik, PasswordResetToken, Setting
+from model import db, Uzytkownik, Prowadzacy, Zajecia, Uczestnik, PasswordResetToken, Setting, obecnosci
 from docx import Document
 import utils
 from werkzeug.security import generate_password_hash
@@ -27,6 +27,7 @@ def app(tmp_path):
     Path("rejestr.docx").touch()
     application = create_app()
     application.config["WTF_CSRF_ENABLED"] = False
+    application.config["TESTING"] = True
     try:
         with application.app_context():
             db.create_all()
@@ -593,6 +594,86 @@ def test_admin_dashboard_filter(client, app):
     assert "2023-01-02" not in data
 
 
+def test_admin_dashboard_lists_invoices_not_accepted_by_ksef(client, app):
+    from model import KSeFInvoice
+
+    with app.app_context():
+        p = Prowadzacy(imie="Jan", nazwisko="Kowal")
+        db.session.add(p)
+        db.session.flush()
+        now = datetime.utcnow()
+        db.session.add_all(
+            [
+                KSeFInvoice(
+                    invoice_number=number,
+                    prowadzacy_id=p.id,
+                    environment="demo",
+                    session_reference_number="S1",
+                    invoice_reference_number=number,
+                    status=status,
+                    status_code=code,
+                    status_description=description,
+                    completed_at=completed_at,
+                )
+                for number, status, code, description, completed_at in (
+                    ("FV/1/2025", "accepted", 200, "Sukces", now),
+                    ("FV/2/2025", "rejected", 450, "Błąd weryfikacji", now),
+                    ("FV/3/2025", "expired", None, None, now),
+                    ("FV/4/2025", "pending", None, None, None),
+                    ("FV/5/2025", "rejected", 450, "Stara", now - timedelta(days=60)),
+                )
+            ]
+        )
+        db.session.commit()
+    _login_admin(client, app)
+
+    data = client.get("/admin").data.decode()
+    assert "Faktury nieprzyjęte przez KSeF" in data
+    assert "FV/2/2025" in data and "Błąd weryfikacji" in data and "Jan Kowal" in data
+    assert "FV/3/2025" in data and "brak odpowiedzi" in data
+    for number in ("FV/1/2025", "FV/4/2025", "FV/5/2025"):
+        assert number not in data
+
+
+def test_admin_delete_trainer_with_attendance(client, app):
+    with app.app_context():
+        p = Prowadzacy(imie="A", nazwisko="B")
+        db.session.add(p)
+        db.session.flush()
+        u = Uczestnik(imie_nazwisko="X", prowadzacy_id=p.id)
+        z = Zajecia(prowadzacy_id=p.id, data=datetime(2023, 1, 1), czas_trwania=1.0)
+        z.obecni.append(u)
+        trainer_user = Uzytkownik(
+            login="td@example.com",
+            haslo_hash=generate_password_hash("x"),
+            role="prowadzacy",
+            approved=True,
+            prowadzacy_id=p.id,
+        )
+        admin = Uzytkownik(
+            login="admind@example.com",
+            haslo_hash=generate_password_hash("adm"),
+            role="admin",
+            approved=True,
+        )
+        db.session.add_all([z, trainer_user, admin])
+        db.session.commit()
+        pid = p.id
+
+    client.post(
+        "/login",
+        data={"login": "admind@example.com", "hasło": "adm"},
+        follow_redirects=False,
+    )
+    resp = client.post(f"/usun/{pid}")
+    assert resp.status_code == 302
+    with app.app_context():
+        assert db.session.get(Prowadzacy, pid) is None
+        assert Uczestnik.query.count() == 0
+        assert db.session.execute(db.select(db.func.count()).select_from(obecnosci)).scalar() == 0
+        assert Uzytkownik.query.filter_by(login="td@example.com").one().prowadzacy_id is None
+
+
 def test_admin_inline_update_trainer(client, app):
     with app.app_context():
         p = Prowadzacy(imie="A", nazwisko="B", numer_umowy="1", nazwa_zajec="X")
@@ -1004,6 +1085,13 @@ def _create_many_sessions(app, user_login: str, count: int) -> None:
         db.session.commit()
 
 
+def _pager_link(html: str, direction: str) -> str:
+    """Return the href of the pager link carrying the ``direction`` cursor."""
+    match = re.search(rf'href="([^"]*[?&]{direction}=[^"]*)"', html)
+    assert match, f"no {direction} link"
+    return match.group(1).replace("&amp;", "&")
+
+
 def test_panel_pagination(client, app):
     login_val = _create_trainer(app)
     _create_many_sessions(app, login_val, 12)
@@ -1017,13 +1105,52 @@ def test_panel_pagination(client, app):
     html = resp.data.decode()
     assert "2023-01-12" in html
     assert "2023-01-02" not in html
+    assert "13 zajęć" in html
 
-    resp2 = client.get("/panel?page=2")
+    resp2 = client.get(_pager_link(html, "after"))
     assert resp2.status_code == 200
     html2 = resp2.data.decode()
     assert "2023-01-02" in html2
     assert "2023-01-12" not in html2
 
+    resp3 = client.get(_pager_link(html2, "before"))
+    html3 = resp3.data.decode()
+    assert "2023-01-12" in html3
+    assert "2023-01-02" not in html3
+    assert "before=" not in html3
+
+
+def test_panel_summary_aggregated_without_loading_sessions(client, app):
+    from sqlalchemy import event
+
+    login_val = _create_trainer(app)
+    _create_many_sessions(app, login_val, 12)
+    client.post(
+        "/login", data={"login": login_val, "hasło": "pass"}, follow_redirects=False
+    )
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        resp = client.get("/panel")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    assert resp.status_code == 200
+    html = resp.data.decode()
+    assert "<td>12.0</td>" in html  # January 2023
+    assert "<td>13.0</td>" in html  # total with the May session
+    session_selects = [
+        s for s in statements if s.lstrip().startswith("SELECT") and "FROM zajecia" in s
+    ]
+    assert session_selects
+    for statement in session_selects:
+        assert "LIMIT" in statement or "GROUP BY" in statement or "count(" in statement
+
 
 def test_admin_pagination(client, app):
     login_val = _create_trainer(app)
@@ -1050,13 +1177,56 @@ def test_admin_pagination(client, app):
     assert "2023-01-12" in html
     assert "2023-01-02" not in html
 
-    resp2 = client.get("/admin?page=2")
+    resp2 = client.get(_pager_link(html, "after"))
     assert resp2.status_code == 200
     html2 = resp2.data.decode()
     assert "2023-01-02" in html2
     assert "2023-01-12" not in html2
 
 
+def _add_trainers_with_history(app, count: int) -> None:
+    """Add ``count`` trainers, each with participants and attended sessions."""
+    with app.app_context():
+        for i in range(count):
+            prow = Prowadzacy(imie=f"P{i}", nazwisko="X")
+            prow.uczestnicy = [Uczestnik(imie_nazwisko=f"U{i}a"), Uczestnik(imie_nazwisko=f"U{i}b")]
+            db.session.add(prow)
+            db.session.flush()
+            for day in (1, 2):
+                zaj = Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 3, day), czas_trwania=1.0)
+                zaj.obecni.extend(prow.uczestnicy)
+                db.session.add(zaj)
+        db.session.commit()
+
+
+def test_admin_dashboard_constant_query_count(client, app):
+    app.config["QUERY_COUNT_HEADER"] = True
+    with app.app_context():
+        db.session.add(
+            Uzytkownik(
+                login="qadm@example.com",
+                haslo_hash=generate_password_hash("a"),
+                role="admin",
+                approved=True,
+            )
+        )
+        db.session.commit()
+    client.post("/login", data={"login": "qadm@example.com", "hasło": "a"})
+
+    _add_trainers_with_history(app, 2)
+    client.get("/admin")  # counts the project hours once
+    resp = client.get("/admin")
+    assert resp.status_code == 200
+    small = int(resp.headers["X-Query-Count"])
+
+    _add_trainers_with_history(app, 15)
+    resp = client.get("/admin")
+    assert resp.status_code == 200
+    assert int(resp.headers["X-Query-Count"]) == small
+    assert 'id="miesiac' in resp.data.decode()
+    assert 'value="3"' in resp.data.decode()
+
+
 def test_panel_progress_and_edit_forms(client, trainer):
     resp = client.get("/panel")
     assert resp.status_code == 200
@@ -1504,3 +1674,159 @@ def test_admin_stats_table_bordered(client, app):
     html = resp.data.decode()
     m = re.search(r'<table[^>]*id="admin-stats"[^>]*>', html)
     assert m and "table-bordered" in m.group(0)
+
+
+def test_admin_import_upload(client, app):
+    with app.app_context():
+        p = Prowadzacy(imie="A", nazwisko="B")
+        db.session.add(p)
+        db.session.flush()
+        db.session.add(Uczestnik(imie_nazwisko="Ala", prowadzacy_id=p.id))
+        admin = Uzytkownik(
+            login="imp@example.com",
+            haslo_hash=generate_password_hash("adm"),
+            role="admin",
+            approved=True,
+        )
+        db.session.add(admin)
+        db.session.commit()
+        pid = p.id
+
+    client.post(
+        "/login",
+        data={"login": "imp@example.com", "hasło": "adm"},
+        follow_redirects=False,
+    )
+    assert client.get("/admin/import").status_code == 200
+
+    bad = json.dumps(
+        [{"prowadzacy_id": pid, "data": "2024-01-01", "czas_trwania": 1, "obecni": ["Ola"]}]
+    )
+    resp = client.post(
+        "/admin/import",
+        data={"plik": (io.BytesIO(bad.encode()), "import.json")},
+        content_type="multipart/form-data",
+    )
+    assert "Row 1: participant" in resp.data.decode()
+    assert Zajecia.query.count() == 0
+
+    good = json.dumps(
+        [{"prowadzacy_id": pid, "data": "2024-01-01", "czas_trwania": 1, "obecni": ["Ala"]}]
+    )
+    resp = client.post(
+        "/admin/import",
+        data={"plik": (io.BytesIO(good.encode()), "import.json")},
+        content_type="multipart/form-data",
+        follow_redirects=True,
+    )
+    assert "Zaimportowano 1 zajęć" in resp.data.decode()
+    zaj = Zajecia.query.one()
+    assert [u.imie_nazwisko for u in zaj.obecni] == ["Ala"]
+
+    latin = f"prowadzacy_id,data,obecni\n{pid},2024-01-02,Żaneta\n".encode("iso-8859-2")
+    resp = client.post(
+        "/admin/import",
+        data={"plik": (io.BytesIO(latin), "import.csv")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 200
+    assert "File is not UTF-8 encoded" in resp.data.decode()
+
+    # The quoted names span two lines, so the bad record starts on line 4.
+    csv_bad = f'prowadzacy_id,data,obecni\n{pid},2024-01-02,"Ala;\nAla"\n{pid},jutro,Ala\n'
+    resp = client.post(
+        "/admin/import",
+        data={"plik": (io.BytesIO(csv_bad.encode()), "import.csv")},
+        content_type="multipart/form-data",
+    )
+    assert "Row 4: invalid date" in resp.data.decode()
+    assert Zajecia.query.count() == 1
+
+
+def test_admin_export_streams_csv_and_xlsx(client, app):
+    import csv
+    import zipfile
+    from xml.etree import ElementTree
+    from model import ArchivedParticipant, ArchivedProject
+
+    with app.app_context():
+        p = Prowadzacy(imie="Jan", nazwisko="Nowak")
+        db.session.add(p)
+        db.session.flush()
+        ala = Uczestnik(imie_nazwisko="Ala", prowadzacy_id=p.id)
+        ola = Uczestnik(imie_nazwisko="Ola", prowadzacy_id=p.id)
+        for day, obecni in ((1, [ala, ola]), (2, [ola]), (3, [])):
+            z = Zajecia(prowadzacy_id=p.id, data=datetime(2024, 3, day), czas_trwania=1.5)
+            z.obecni.extend(obecni)
+            db.session.add(z)
+        db.session.add(Zajecia(prowadzacy_id=p.id, data=datetime(2024, 4, 1), czas_trwania=2.0))
+        project = ArchivedProject(name="2023")
+        project.participants.append(
+            ArchivedParticipant(
+                participant_name="Ewa",
+                trainer_name="Jan Nowak",
+                sessions_present=3,
+                total_sessions=4,
+                percent=75.0,
+            )
+        )
+        db.session.add(project)
+        db.session.add(
+            Uzytkownik(
+                login="exp@example.com",
+                haslo_hash=generate_password_hash("adm"),
+                role="admin",
+                approved=True,
+            )
+        )
+        db.session.commit()
+        pid, project_id = p.id, project.id
+
+    client.post("/login", data={"login": "exp@example.com", "hasło": "adm"})
+
+    resp = client.get(
+        f"/admin/eksport?rodzaj=zajecia&prowadzacy_id={pid}&od=2024-03-01&do=2024-03-31"
+    )
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.headers["Content-Disposition"] == 'attachment; filename="zajecia.csv"'
+    rows = list(csv.reader(io.StringIO(resp.data.decode("utf-8-sig"))))
+    assert rows[0][:4] == ["prowadzacy_id", "prowadzacy", "data", "czas_trwania"]
+    assert [r[2:6] for r in rows[1:]] == [
+        ["2024-03-01", "1.5", "2", "Ala;Ola"],
+        ["2024-03-02", "1.5", "1", "Ola"],
+        ["2024-03-03", "1.5", "0", ""],
+    ]
+
+    resp = client.get("/admin/eksport?rodzaj=godziny&format=csv")
+    rows = list(csv.reader(io.StringIO(resp.data.decode("utf-8-sig"))))
+    assert rows[1:] == [
+        [str(pid), "Jan Nowak", "2024", "3", "3", "4.5"],
+        [str(pid), "Jan Nowak", "2024", "4", "1", "2.0"],
+    ]
+
+    resp = client.get(
+        f"/admin/eksport?rodzaj=obecnosci&prowadzacy_id={pid}&do=2024-03-31&format=xlsx"
+    )
+    assert resp.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(resp.data)) as workbook:
+        sheet = ElementTree.fromstring(workbook.read("xl/worksheets/sheet1.xml"))
+    ns = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+    table = [
+        ["".join(c.itertext()) for c in row.findall("s:c", ns)]
+        for row in sheet.iter(f"{{{ns['s']}}}row")
+    ]
+    assert table == [
+        ["data", "czas_trwania", "Ala", "Ola"],
+        ["2024-03-01", "1.5", "1", "1"],
+        ["2024-03-02", "1.5", "0", "1"],
+        ["2024-03-03", "1.5", "0", "0"],
+    ]
+
+    resp = client.get(f"/admin/eksport?rodzaj=archiwum&projekt={project_id}")
+    assert "Ewa,Jan Nowak,3,4,75.0" in resp.data.decode("utf-8-sig")
+
+    assert client.get("/admin/eksport?rodzaj=obecnosci").status_code == 400
+    assert client.get("/admin/eksport?rodzaj=zajecia&od=wczoraj").status_code == 400
+    assert client.get("/admin/eksport?rodzaj=archiwum&projekt=999").status_code == 404
+    assert client.get("/admin/eksport?rodzaj=zajecia&format=pdf").status_code == 404
@@ -7,7 +7,8 @@ import pytest
 from docx import Document
 
 from app import create_app
-from model import db, Prowadzacy, Zajecia
+from model import db, KSeFInvoice, Prowadzacy, TrainerStats, Zajecia
+from utils.settings import get_setting
 
 
 @pytest.fixture
@@ -23,6 +24,7 @@ def app(tmp_path):
     Path("rejestr.docx").touch()
     application = create_app()
     application.config["WTF_CSRF_ENABLED"] = False
+    application.config["TESTING"] = True
     try:
         with application.app_context():
             db.create_all()
@@ -102,7 +104,7 @@ def test_send_demo_invoice_cli(app, monkeypatch, tmp_path):
 
     def fake_email(buf, data, typ=None, course=None, trainer=None, invoice_pdf_buf=None):
         sent["called"] = True
-        sent["to"] = os.environ.get("EMAIL_RECIPIENT")
+        sent["to"] = get_setting("email_recipient")
         sent["invoice_pdf"] = invoice_pdf_buf.read()
 
     def fake_generate_invoice_for_report(**_kwargs):
@@ -132,3 +134,345 @@ def test_send_demo_invoice_cli(app, monkeypatch, tmp_path):
     assert sent["called"]
     assert sent["to"] == "demo@example.com"
     assert sent["invoice_pdf"] == b"pdf"
+
+
+def _setup_invoice_run(app, monkeypatch, tmp_path):
+    """Two trainers with May 2025 sessions, report template and invoice counter 7."""
+    from PIL import Image
+    from model import Setting
+
+    with app.app_context():
+        trainers = [
+            Prowadzacy(imie="A", nazwisko="B", numer_umowy="1", podpis_filename="sig.png"),
+            Prowadzacy(imie="C", nazwisko="D", numer_umowy="2", podpis_filename="sig.png"),
+        ]
+        db.session.add_all(trainers)
+        db.session.flush()
+        db.session.add_all(
+            [
+                Zajecia(prowadzacy_id=trainers[0].id, data=datetime(2025, 5, 1), czas_trwania=1.5),
+                Zajecia(prowadzacy_id=trainers[1].id, data=datetime(2025, 5, 2), czas_trwania=2.0),
+                Setting(key="invoice_number_counter", value="7"),
+            ]
+        )
+        db.session.commit()
+        ids = [t.id for t in trainers]
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("KSEF_ENABLED", "0")
+    monkeypatch.setenv("INVOICE_NUMBER_COUNTER", "7")
+    template = Document()
+    template.add_paragraph("Zleceniobiorca: ...")
+    template.add_paragraph("w ...")
+    table = template.add_table(rows=4, cols=3)
+    for day in range(1, 3):
+        table.cell(day, 0).text = f"{day:02d}."
+    table.cell(3, 0).text = "Łącznie"
+    template.save(tmp_path / "rejestr.docx")
+    (tmp_path / "static").mkdir()
+    Image.new("RGB", (40, 10), (0, 0, 0)).save(tmp_path / "static" / "sig.png")
+    return ids
+
+
+def test_generate_reports_parallel_jobs(app, monkeypatch, tmp_path):
+    from model import Setting
+
+    ids = _setup_invoice_run(app, monkeypatch, tmp_path)
+
+    sent = []
+
+    def fake_email(buf, data, typ=None, course=None, trainer=None, invoice_pdf_buf=None):
+        sent.append((trainer.id, invoice_pdf_buf.read()[:4]))
+
+    monkeypatch.setattr("app.email_do_koordynatora", fake_email)
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=["generate-reports", "--month", "5", "--year", "2025", "--email", "--jobs", "2"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Timing summary:" in result.output
+    for trainer_id, hours in zip(ids, ["1.5h", "2h"]):
+        report = Document(tmp_path / "reports" / f"raport_{trainer_id}_5_2025.docx")
+        assert report.tables[0].rows[-1].cells[1].text == hours
+    assert sorted(sent) == [(ids[0], b"%PDF"), (ids[1], b"%PDF")]
+    invoices = sorted(p.name for p in (tmp_path / "invoices" / "2025" / "05").glob("*.xml"))
+    assert len(invoices) == 2 and invoices[0] != invoices[1]
+    with app.app_context():
+        assert Setting.query.filter_by(key="invoice_number_counter").one().value == "9"
+
+
+def test_generate_reports_batch_invoices(app, monkeypatch, tmp_path):
+    from ksef_client import KSeFSendResult
+    from model import Setting
+
+    ids = _setup_invoice_run(app, monkeypatch, tmp_path)
+    monkeypatch.setenv("KSEF_ENABLED", "1")
+    batches = []
+
+    def fake_send(invoice_xmls):
+        batches.append(list(invoice_xmls))
+        accepted = KSeFSendResult("S1", "I1", invoice_status_code=200, ksef_number="K1")
+        rejected = KSeFSendResult("S1", "I2", invoice_status_code=450)
+        return [(True, accepted, None), (False, rejected, "Błąd weryfikacji")]
+
+    sent = {}
+
+    def fake_email(buf, data, typ=None, course=None, trainer=None, invoice_pdf_buf=None):
+        sent[trainer.id] = invoice_pdf_buf.read()[:4] if invoice_pdf_buf else None
+
+    def fake_send_one(xml, **_kw):
+        singles.append(xml)
+        return False, KSeFSendResult("S2", "I3", invoice_status_code=450), "Błąd weryfikacji"
+
+    singles = []
+    monkeypatch.setattr("ksef_client.send_invoices_to_ksef", fake_send)
+    monkeypatch.setattr("ksef_client.send_invoice_to_ksef", fake_send_one)
+    monkeypatch.setattr("app.email_do_koordynatora", fake_email)
+    result = app.test_cli_runner().invoke(
+        args=["generate-reports", "--month", "5", "--year", "2025", "--email", "--batch-invoices"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert len(batches) == 1 and len(batches[0]) == 2
+    # The rejected invoice was the last one: it is resent alone with its number.
+    assert singles == batches[0][1:]
+    assert "Invoice for A B: Faktura wysłana do KSeF. Numer KSeF: K1." in result.output
+    assert "Invoice error for C D: Błąd generowania faktury: Błąd weryfikacji" in result.output
+    assert sent == {ids[0]: b"%PDF", ids[1]: None}
+    with app.app_context():
+        assert Setting.query.filter_by(key="invoice_number_counter").one().value == "8"
+        records = KSeFInvoice.query.order_by(KSeFInvoice.id).all()
+        assert [(r.prowadzacy_id, r.status, r.ksef_number) for r in records] == [
+            (ids[0], "accepted", "K1"),
+            (ids[1], "rejected", None),
+            (ids[1], "rejected", None),
+        ]
+
+
+def test_generate_reports_batch_keeps_numbers_gap_free(app, monkeypatch, tmp_path):
+    from ksef_client import KSeFSendResult
+    from model import Setting
+
+    ids = _setup_invoice_run(app, monkeypatch, tmp_path)
+    with app.app_context():
+        third = Prowadzacy(imie="E", nazwisko="F", numer_umowy="3", podpis_filename="sig.png")
+        db.session.add(third)
+        db.session.flush()
+        db.session.add(Zajecia(prowadzacy_id=third.id, data=datetime(2025, 5, 3), czas_trwania=1))
+        db.session.commit()
+        ids.append(third.id)
+    monkeypatch.setenv("KSEF_ENABLED", "1")
+
+    def fake_send(invoice_xmls):
+        return [
+            (True, KSeFSendResult("S1", "I1", invoice_status_code=200, ksef_number="K1"), None),
+            (False, KSeFSendResult("S1", "I2", invoice_status_code=450), "Błąd weryfikacji"),
+            (True, KSeFSendResult("S1", "I3", invoice_status_code=200, ksef_number="K3"), None),
+        ]
+
+    singles = []
+
+    def fake_send_one(xml, **_kw):
+        singles.append(xml)
+        return True, KSeFSendResult("S2", "I4", invoice_status_code=200, ksef_number="K2"), None
+
+    monkeypatch.setattr("ksef_client.send_invoices_to_ksef", fake_send)
+    monkeypatch.setattr("ksef_client.send_invoice_to_ksef", fake_send_one)
+    monkeypatch.setattr("app.email_do_koordynatora", lambda *a, **kw: None)
+    result = app.test_cli_runner().invoke(
+        args=["generate-reports", "--month", "5", "--year", "2025", "--email", "--batch-invoices"]
+    )
+
+    assert result.exit_code == 0, result.output
+    # Number 8 was rejected after 9 was accepted, so it is resent unchanged.
+    assert len(singles) == 1 and ">FV/8/2025<" in singles[0]
+    assert "Invoice for C D: Faktura wysłana do KSeF. Numer KSeF: K2." in result.output
+    assert "Invoice error" not in result.output
+    with app.app_context():
+        assert Setting.query.filter_by(key="invoice_number_counter").one().value == "10"
+        records = KSeFInvoice.query.order_by(KSeFInvoice.id).all()
+        assert [(r.prowadzacy_id, r.status, r.ksef_number) for r in records] == [
+            (ids[0], "accepted", "K1"),
+            (ids[1], "rejected", None),
+            (ids[1], "accepted", "K2"),
+            (ids[2], "accepted", "K3"),
+        ]
+
+
+def test_batch_invoice_rejected_past_first_page_is_not_counted(app, monkeypatch):
+    import ksef_client
+    from invoice_helper import submit_invoices
+    from ksef_fake_server import FakeKSeFServer
+    from ksef_invoice import create_invoice_from_monthly_report, generate_fa2_xml
+    from model import Setting
+
+    with app.app_context():
+        db.session.add(Setting(key="invoice_number_counter", value="7"))
+        db.session.commit()
+    monkeypatch.setenv("KSEF_ENABLED", "1")
+    monkeypatch.delenv("KSEF_TOKEN_STORE", raising=False)
+    monkeypatch.delenv("KSEF_CERT_CACHE", raising=False)
+    monkeypatch.setattr(ksef_client, "SESSION_INVOICES_PAGE_SIZE", 10)
+    batch = []
+    for counter in range(7, 19):
+        invoice = create_invoice_from_monthly_report(hours=1, month=5, year=2025, counter=counter)
+        batch.append((invoice, generate_fa2_xml(invoice), BytesIO(b"%PDF"), None))
+    # The last of 12 invoices, on the second page of the listing, is rejected.
+    batch[-1] = batch[-1][:1] + ("<broken",) + batch[-1][2:]
+
+    ksef_client.clear_public_key_cache()
+    ksef_client.reset_ksef_clients()
+    with FakeKSeFServer() as server:
+        try:
+            monkeypatch.setenv("KSEF_BASE_URL", server.url)
+            monkeypatch.setenv("KSEF_NIP", server.nip)
+            monkeypatch.setenv("KSEF_TOKEN_DEMO", server.token)
+            with app.app_context():
+                results = submit_invoices(batch)
+                counter = Setting.query.filter_by(key="invoice_number_counter").one().value
+                rejected = KSeFInvoice.query.filter_by(invoice_number=batch[-1][0].invoice_number)
+                rejected = rejected.one().status
+            pages = server.service.requests["session_invoices"]
+        finally:
+            ksef_client.reset_ksef_clients()
+            ksef_client.clear_public_key_cache()
+
+    assert [success for success, *_ in results] == [True] * 11 + [False]
+    assert (counter, rejected) == ("18", "rejected")
+    assert pages >= 2
+
+
+def test_generate_reports_renumbers_invoice_after_failure(app, monkeypatch, tmp_path):
+    from ksef_client import KSeFSendResult
+
+    _setup_invoice_run(app, monkeypatch, tmp_path)
+    with app.app_context():
+        idle = Prowadzacy(imie="E", nazwisko="F", numer_umowy="3", podpis_filename="sig.png")
+        db.session.add(idle)
+        db.session.flush()
+        db.session.add(Zajecia(prowadzacy_id=idle.id, data=datetime(2025, 5, 3), czas_trwania=0))
+        db.session.commit()
+    monkeypatch.setenv("KSEF_ENABLED", "1")
+    outcomes = iter(
+        [
+            (False, None, "KSeF niedostępny"),
+            (True, KSeFSendResult("S1", "I1", invoice_status_code=200, ksef_number="K1"), None),
+        ]
+    )
+    monkeypatch.setattr("ksef_client.send_invoice_to_ksef", lambda xml, **_kw: next(outcomes))
+    monkeypatch.setattr("app.email_do_koordynatora", lambda *a, **kw: None)
+
+    result = app.test_cli_runner().invoke(
+        args=["generate-reports", "--month", "5", "--year", "2025", "--email"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Invoice error: Błąd generowania faktury: KSeF niedostępny" in result.output
+    assert "Invoice error: Błąd generowania faktury: No hours recorded for this month" in (
+        result.output
+    )
+    # The second invoice took over number 7; its files saved as number 8 are gone.
+    invoice_dir = tmp_path / "invoices" / "2025" / "05"
+    assert sorted(p.suffix for p in invoice_dir.iterdir()) == [".pdf", ".xml"]
+    assert "_7_" in next(invoice_dir.glob("*.xml")).name
+
+
+def test_generate_reports_skips_unchanged_inputs(app, monkeypatch, tmp_path):
+    p1_id, _ = _setup_data(app)
+    calls = []
+
+    def dummy_report(trainer, sessions, *_a, **_k):
+        calls.append(trainer.id)
+        doc = Document()
+        doc.add_paragraph(str(sum(z.czas_trwania for z in sessions)))
+        return doc
+
+    monkeypatch.setattr("app.generuj_raport_miesieczny", dummy_report)
+    runner = app.test_cli_runner()
+    monkeypatch.chdir(tmp_path)
+    args = ["generate-reports", "--month", "5", "--year", "2025"]
+
+    assert runner.invoke(args=args).exit_code == 0
+    result = runner.invoke(args=args)
+    assert "Up to date" in result.output
+    assert calls == [p1_id]
+
+    with app.app_context():
+        db.session.add(Zajecia(prowadzacy_id=p1_id, data=datetime(2025, 5, 2), czas_trwania=2.0))
+        db.session.commit()
+    assert runner.invoke(args=args).exit_code == 0
+    assert calls == [p1_id, p1_id]
+    report = Document(tmp_path / "reports" / f"raport_{p1_id}_5_2025.docx")
+    assert report.paragraphs[0].text == "3.0"
+
+    assert runner.invoke(args=args + ["--force"]).exit_code == 0
+    assert calls == [p1_id, p1_id, p1_id]
+
+
+def test_rebuild_stats(app):
+    p1, p2 = _setup_data(app)
+    with app.app_context():
+        TrainerStats.query.delete()
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["rebuild-stats"])
+
+    assert result.exit_code == 0
+    assert "Rebuilt stats for 2 trainer months" in result.output
+    with app.app_context():
+        row = db.session.get(TrainerStats, (p1, 2025, 5))
+        assert (row.sessions, row.hours) == (1, 1.0)
+
+
+def test_check_project_hours_detects_and_repairs_drift(app):
+    from model import ProjectHours
+    from utils.stats import get_project_used_hours
+
+    _setup_data(app)
+    runner = app.test_cli_runner()
+    with app.app_context():
+        assert get_project_used_hours() == 2.0
+        db.session.get(ProjectHours, 1).used_hours = 5.0
+        db.session.commit()
+
+    result = runner.invoke(args=["check-project-hours", "--check-only"])
+    assert result.exit_code == 1
+    assert "cached 5h, actual 2h" in result.output
+
+    result = runner.invoke(args=["check-project-hours"])
+    assert result.exit_code == 0
+    assert "Counter repaired" in result.output
+    result = runner.invoke(args=["check-project-hours"])
+    assert "Project hours consistent: 2h" in result.output
+
+
+def test_import_attendance(app, tmp_path):
+    from model import Uczestnik
+
+    p1, _p2 = _setup_data(app)
+    path = tmp_path / "obecnosci.csv"
+    path.write_text(
+        "prowadzacy_id,data,czas_trwania,obecni\n"
+        f"{p1},2025-07-01,1.5,Ala;Ola\n"
+        f"{p1},2025-07-08,,Ala\n",
+        encoding="utf-8",
+    )
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["import-attendance", str(path)])
+    assert result.exit_code == 1
+    assert "Row 2: participant 'Ala' not found" in result.output
+    assert "Row 3: czas_trwania missing" in result.output
+
+    with app.app_context():
+        db.session.get(Prowadzacy, p1).domyslny_czas = 2.0
+        db.session.commit()
+    result = runner.invoke(args=["import-attendance", str(path), "--create-participants"])
+    assert result.exit_code == 0
+    assert "Imported 2 sessions, 3 attendance rows, 2 new participants" in result.output
+    with app.app_context():
+        assert Uczestnik.query.filter_by(prowadzacy_id=p1).count() == 2
+        row = db.session.get(TrainerStats, (p1, 2025, 7))
+        assert (row.sessions, row.hours) == (2, 3.5)
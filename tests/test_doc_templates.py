@@ -1,6 +1,10 @@
 import os
+from io import BytesIO
+
 import pytest
+from docx import Document
 
+import doc_generator
 from doc_generator import generuj_liste_obecnosci, generuj_raport_miesieczny
 
 class Dummy:
@@ -25,3 +29,105 @@ def test_missing_report_template(tmp_path):
     with pytest.raises(RuntimeError) as exc:
         generuj_raport_miesieczny(dummy, [], str(path), 'static', 1, 2024)
     assert str(path) in str(exc.value)
+
+
+def _write_lista_template(path, title="Lista obecności"):
+    doc = Document()
+    doc.add_paragraph(title)
+    doc.add_paragraph("Data zajęć: ...    Czas trwania zajęć: ...")
+    doc.add_table(rows=4, cols=2).cell(0, 0).text = "Uczestnik"
+    doc.add_table(rows=2, cols=2).cell(0, 0).text = "Prowadzący"
+    doc.save(path)
+
+
+def _roundtrip(doc):
+    buf = BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    return Document(buf)
+
+
+def test_lista_template_compiled_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_lista_template(tmp_path / 'szablon.docx')
+    parsed = []
+    real_document = doc_generator.Document
+
+    def counting_document(*a, **k):
+        parsed.append(a)
+        return real_document(*a, **k)
+
+    monkeypatch.setattr(doc_generator, 'Document', counting_document)
+
+    first = _roundtrip(
+        generuj_liste_obecnosci('2024-01-01', '1,5', ['Anna', 'Jan'], 'T', None, 'Kurs')
+    )
+    second = _roundtrip(generuj_liste_obecnosci('2024-01-02', '2', ['Ola'], 'T2', None))
+
+    assert len(parsed) == 1
+    assert first.paragraphs[0].text == 'Lista obecności – Kurs'
+    assert second.paragraphs[0].text == 'Lista obecności'
+    assert second.paragraphs[1].text == 'Data zajęć: 2024-01-02    Czas trwania zajęć: 2'
+    assert [r.cells[0].text for r in first.tables[0].rows[1:]] == ['Anna', 'Jan', '']
+    assert [r.cells[0].text for r in second.tables[0].rows[1:]] == ['Ola', '', '']
+    assert second.tables[1].cell(1, 0).text == 'T2'
+
+
+def test_lista_template_recompiled_when_file_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'szablon.docx'
+    _write_lista_template(path)
+    generuj_liste_obecnosci('2024-01-01', '1', [], 'T', None, 'Kurs')
+
+    _write_lista_template(path, title="Lista obecności (nowa)")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    doc = _roundtrip(generuj_liste_obecnosci('2024-01-01', '1', [], 'T', None))
+
+    assert doc.paragraphs[0].text == 'Lista obecności (nowa)'
+
+
+class _Session:
+    def __init__(self, data, czas_trwania):
+        self.data = data
+        self.czas_trwania = czas_trwania
+
+
+def test_raport_buckets_hours_and_embeds_signature_once(tmp_path):
+    from datetime import datetime
+    from PIL import Image
+
+    template = tmp_path / 'rejestr.docx'
+    doc = Document()
+    doc.add_paragraph('Zleceniobiorca: ...')
+    doc.add_paragraph('w ...')
+    table = doc.add_table(rows=5, cols=3)
+    for day in range(1, 4):
+        table.cell(day, 0).text = f'{day:02d}.'
+    table.cell(4, 0).text = 'Łącznie'
+    doc.add_paragraph('(czytelny podpis zleceniobiorcy)')
+    doc.save(template)
+    Image.new('RGB', (40, 10), (0, 0, 0)).save(tmp_path / 'sig.png')
+
+    prow = Dummy()
+    prow.imie = 'A'
+    prow.nazwisko = 'B'
+    prow.numer_umowy = '1'
+    prow.podpis_filename = 'sig.png'
+    sessions = [
+        _Session(datetime(2024, 5, 1), 1.5),
+        _Session(datetime(2024, 5, 1), 1.0),
+        _Session(datetime(2024, 5, 3), 2.0),
+        _Session(datetime(2024, 6, 2), 5.0),
+    ]
+
+    out = _roundtrip(
+        generuj_raport_miesieczny(prow, sessions, str(template), str(tmp_path), 5, 2024)
+    )
+
+    rows = out.tables[0].rows
+    assert out.paragraphs[0].text == 'Zleceniobiorca: A B'
+    assert out.paragraphs[1].text == 'w 05.2024'
+    assert [rows[i].cells[1].text for i in range(1, 5)] == ['2.5h', '', '2h', '4.5h']
+    assert len(out.inline_shapes) == 4
+    assert len({s._inline.graphic.graphicData.pic.blipFill.blip.embed for s in out.inline_shapes}) == 1
@@ -1,5 +1,7 @@
 import os
+from datetime import UTC, datetime, timedelta
 
+import pytest
 from pypdf import PdfReader
 
 from ksef_client import resolve_ksef_token
@@ -142,3 +144,339 @@ def test_generate_invoice_pdf_embeds_unicode_font(monkeypatch):
     assert "jeden tysiąc czterdzieści 00/100 PLN" in extracted_text
     assert "godz." in extracted_text
     assert "mOrganizer finansów" not in extracted_text
+
+
+def _fake_handshake(monkeypatch, calls, lifetime=timedelta(minutes=15)):
+    """Replace the network handshake and refresh with counters."""
+    from ksef_client import KSeFClient, TokenInfo
+
+    def authenticate(self):
+        calls.append("auth")
+        now = datetime.now(UTC)
+        self.access_token = TokenInfo("access-%d" % len(calls), now + lifetime)
+        self.refresh_token = TokenInfo("refresh-%d" % len(calls), now + timedelta(days=7))
+
+    def refresh(self):
+        calls.append("refresh")
+        self.access_token = TokenInfo("refreshed", datetime.now(UTC) + lifetime)
+
+    monkeypatch.setattr(KSeFClient, "_authenticate", authenticate)
+    monkeypatch.setattr(KSeFClient, "refresh_access_token", refresh)
+
+
+def test_ksef_client_registry_reuses_tokens(monkeypatch):
+    from ksef_client import get_ksef_client, reset_ksef_clients
+
+    monkeypatch.delenv("KSEF_TOKEN_STORE", raising=False)
+    calls = []
+    _fake_handshake(monkeypatch, calls)
+    reset_ksef_clients()
+    try:
+        client = get_ksef_client("demo", "1234567890", "secret")
+        client.ensure_authenticated()
+        assert get_ksef_client("demo", "1234567890", "secret") is client
+        get_ksef_client("demo", "1234567890", "secret").ensure_authenticated()
+        assert calls == ["auth"]
+
+        assert get_ksef_client("test", "1234567890", "secret") is not client
+        replaced = get_ksef_client("demo", "1234567890", "other")
+        assert replaced is not client
+        assert replaced.access_token is None
+    finally:
+        reset_ksef_clients()
+
+
+def test_ksef_token_store_shares_tokens_between_processes(monkeypatch, tmp_path):
+    from ksef_client import KSeFClient, KSeFTokenStore
+
+    store_path = tmp_path / "ksef-tokens.json"
+    calls = []
+    _fake_handshake(monkeypatch, calls)
+
+    def client(token="secret"):
+        return KSeFClient("demo", "1234567890", token, token_store=KSeFTokenStore(str(store_path)))
+
+    first = client()
+    first.ensure_authenticated()
+    assert calls == ["auth"]
+    assert "access-1" not in store_path.read_text()
+    assert oct(store_path.stat().st_mode & 0o777) == "0o600"
+
+    # A later run (new client, same store) reuses the stored access token.
+    second = client()
+    second.ensure_authenticated()
+    assert calls == ["auth"]
+    assert second.access_token.token == "access-1"
+
+    # Once the access token expired the refresh token is used instead.
+    second.access_token.valid_until = datetime.now(UTC) - timedelta(minutes=1)
+    second._store_tokens()
+    third = client()
+    third.ensure_authenticated()
+    assert calls == ["auth", "refresh"]
+
+    # Entries encrypted for another KSeF token cannot be read.
+    other = client("changed")
+    other.ensure_authenticated()
+    assert calls == ["auth", "refresh", "auth"]
+
+
+def _certificate_list(valid_to):
+    import base64
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "ksef")])
+    now = datetime.now(UTC)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(valid_to)
+        .sign(key, hashes.SHA256())
+    )
+    der = base64.b64encode(cert.public_bytes(serialization.Encoding.DER)).decode()
+    return [
+        {"certificate": der, "validTo": valid_to.isoformat(), "usage": [usage]}
+        for usage in ("KsefTokenEncryption", "SymmetricKeyEncryption")
+    ]
+
+
+def test_ksef_public_keys_cached_until_valid_to(monkeypatch, tmp_path):
+    from ksef_client import KSeFCertificateCache, KSeFClient, clear_public_key_cache
+
+    monkeypatch.delenv("KSEF_CERT_CACHE", raising=False)
+    certificates = _certificate_list(datetime.now(UTC) + timedelta(days=30))
+    fetches = []
+
+    def fetch(self):
+        fetches.append(self.base_url)
+        return certificates
+
+    monkeypatch.setattr(KSeFClient, "fetch_public_key_certificates", fetch)
+    clear_public_key_cache()
+    try:
+        cache = KSeFCertificateCache(str(tmp_path / "certs.json"))
+        client = KSeFClient("demo", "1234567890", "secret", certificate_cache=cache)
+        for _ in range(2):
+            client._encrypt_with_public_key(b"token|1", "KsefTokenEncryption")
+            client.create_encryption_info()
+        assert len(fetches) == 1
+        assert KSeFClient("demo", "1", "x").get_public_key("KsefTokenEncryption") is (
+            client.get_public_key("KsefTokenEncryption")
+        )
+
+        # A new process starts with an empty memory cache but reads the file.
+        clear_public_key_cache()
+        KSeFClient("demo", "1234567890", "secret", certificate_cache=cache).get_public_key(
+            "SymmetricKeyEncryption"
+        )
+        assert len(fetches) == 1
+
+        # Certificates about to expire are fetched again.
+        certificates = _certificate_list(datetime.now(UTC) + timedelta(seconds=60))
+        cache.save(client.base_url, certificates)
+        clear_public_key_cache()
+        client.get_public_key("KsefTokenEncryption")
+        client.get_public_key("KsefTokenEncryption")
+        assert len(fetches) == 3
+    finally:
+        clear_public_key_cache()
+
+
+def test_send_invoices_uses_one_session_and_polls_together(monkeypatch):
+    from ksef_client import KSeFClient, KSeFException, KSeFSendResult
+
+    calls = []
+    # Second round: I3 is on the second page of the listing.
+    pages = iter(
+        [
+            {"invoices": [{"referenceNumber": "I1", "status": {"code": 100}}]},
+            {
+                "invoices": [{"referenceNumber": "I1", "status": {"code": 200}, "ksefNumber": "K1"}],
+                "continuationToken": "page-2",
+            },
+            {"invoices": [{"referenceNumber": "I3", "status": {"code": 450, "description": "Błąd"}}]},
+        ]
+    )
+    tokens = []
+
+    def session_invoices(self, ref, page_size=None, continuation_token=None):
+        tokens.append(continuation_token)
+        return next(pages)
+
+    def send_encrypted(self, session, xml, key, iv, offline_mode=False):
+        calls.append(("send", session, xml))
+        if xml == "bad":
+            raise KSeFException("HTTP 400")
+        return {"a": "I1", "c": "I3"}[xml]
+
+    def open_session(self):
+        calls.append("open")
+        return "S1", b"k", b"v"
+
+    monkeypatch.setattr(KSeFClient, "ensure_authenticated", lambda self: None)
+    monkeypatch.setattr(KSeFClient, "open_online_session", open_session)
+    monkeypatch.setattr(KSeFClient, "send_encrypted_invoice", send_encrypted)
+    monkeypatch.setattr(KSeFClient, "close_online_session", lambda self, ref: calls.append("close"))
+    monkeypatch.setattr(KSeFClient, "get_session_status", lambda self, ref: {"status": {"code": 170}})
+    monkeypatch.setattr(KSeFClient, "get_session_invoices", session_invoices)
+
+    client = KSeFClient("demo", "1234567890", "secret")
+    first, refused, third = client.send_invoices(["a", "bad", "c"], poll_interval_seconds=0)
+
+    assert calls[0] == "open" and calls[-1] == "close"
+    assert calls.count("open") == 1 and len(calls) == 5
+    assert (first.success, first.ksef_number) == (True, "K1")
+    assert (refused.success, refused.invoice_status_description) == (False, "HTTP 400")
+    assert (third.success, third.invoice_reference_number) == (False, "I3")
+    assert third.invoice_status_description == "Błąd"
+    assert tokens == [None, None, "page-2"]
+    # Without its own status an invoice never counts as accepted.
+    assert not KSeFSendResult("S1", "I4", session_status_code=200).success
+
+
+def test_wait_for_invoice_fetches_statuses_concurrently_with_backoff(monkeypatch):
+    import threading
+
+    import ksef_client
+    from ksef_client import KSeFClient, poll_delays
+
+    schedule = poll_delays()
+    assert [next(schedule) for _ in range(7)] == [0.5, 0.75, 1.125, 1.6875, 2.53125, 3.796875, 5.0]
+
+    threads = set()
+    invoice_codes = iter([100, 150, 200])
+
+    def session_status(self, ref):
+        threads.add(threading.current_thread().name)
+        return {"status": {"code": 170}}
+
+    def invoice_status(self, ref, invoice_ref):
+        threads.add(threading.current_thread().name)
+        return {"status": {"code": next(invoice_codes)}, "ksefNumber": "K1"}
+
+    sleeps = []
+    monkeypatch.setattr(ksef_client.time, "sleep", sleeps.append)
+    monkeypatch.setattr(KSeFClient, "ensure_authenticated", lambda self: None)
+    monkeypatch.setattr(KSeFClient, "get_session_status", session_status)
+    monkeypatch.setattr(KSeFClient, "get_session_invoice_status", invoice_status)
+
+    client = KSeFClient("demo", "1234567890", "secret")
+    try:
+        result = client.wait_for_invoice_processing("S1", "I1")
+    finally:
+        client.close()
+
+    assert (result.success, result.ksef_number) == (True, "K1")
+    assert sleeps == [0.5, 0.75]
+    assert all(name.startswith("ksef-status") for name in threads)
+
+
+def test_send_invoice_end_to_end_against_fake_ksef(monkeypatch):
+    from ksef_client import (
+        KSeFClient,
+        KSeFException,
+        clear_public_key_cache,
+        reset_ksef_clients,
+        send_invoice_to_ksef,
+    )
+    from ksef_fake_server import FakeKSeFServer
+
+    monkeypatch.delenv("KSEF_TOKEN_STORE", raising=False)
+    monkeypatch.delenv("KSEF_CERT_CACHE", raising=False)
+    invoice_xml = generate_fa3_xml(
+        create_invoice_from_monthly_report(hours=2, month=5, year=2025, counter=3)
+    )
+    clear_public_key_cache()
+    reset_ksef_clients()
+    with FakeKSeFServer() as server:
+        try:
+            monkeypatch.setenv("KSEF_BASE_URL", server.url)
+            monkeypatch.setenv("KSEF_NIP", server.nip)
+            monkeypatch.setenv("KSEF_TOKEN_DEMO", server.token)
+            success, result, error = send_invoice_to_ksef(invoice_xml)
+            assert (success, error) == (True, None)
+            assert result.ksef_number.startswith(server.nip)
+            assert result.upo_reference_number
+
+            client = KSeFClient("demo", server.nip, server.token)
+            assert client.base_url == server.url
+            client.ensure_authenticated()
+            assert client.download_invoice_xml(result.ksef_number) == invoice_xml
+            assert result.ksef_number in client.download_invoice_upo(
+                result.session_reference_number, result.ksef_number
+            )
+
+            # An expired access token is refreshed rather than authenticated again.
+            client.access_token.valid_until = datetime.now(UTC)
+            rejected = client.send_invoices([invoice_xml, "<broken"], poll_interval_seconds=0.05)
+            assert [r.invoice_status_code for r in rejected] == [200, 450]
+            assert server.service.requests["refresh"] == 1
+            assert server.service.requests["challenge"] == 2
+
+            server.service.failure_rate = 1.0
+            server.service.fail_endpoints = {"open_session"}
+            with pytest.raises(KSeFException, match="HTTP 503.*open_session"):
+                client.send_invoice(invoice_xml)
+            with pytest.raises(KSeFException, match="HTTP 401"):
+                KSeFClient("demo", server.nip, "wrong-token").ensure_authenticated()
+        finally:
+            reset_ksef_clients()
+            clear_public_key_cache()
+
+
+def test_ksef_tokens_kept_per_base_url_and_renewed_after_401(monkeypatch, tmp_path):
+    from ksef_client import (
+        KSeFClient,
+        KSeFTokenStore,
+        TokenInfo,
+        clear_public_key_cache,
+        get_ksef_client,
+        reset_ksef_clients,
+    )
+    from ksef_fake_server import FakeKSeFServer
+
+    monkeypatch.setenv("KSEF_TOKEN_STORE", str(tmp_path / "ksef-tokens.json"))
+    monkeypatch.delenv("KSEF_CERT_CACHE", raising=False)
+    clear_public_key_cache()
+    reset_ksef_clients()
+    with FakeKSeFServer() as first, FakeKSeFServer() as second:
+        try:
+            # Same environment, NIP and KSeF token, but two different APIs.
+            clients = []
+            for server in (first, second):
+                monkeypatch.setenv("KSEF_BASE_URL", server.url)
+                client = get_ksef_client("demo", server.nip, server.token)
+                client.ensure_authenticated()
+                clients.append(client)
+            assert clients[0] is not clients[1]
+            assert clients[1].base_url == second.url
+            assert clients[0].access_token.token != clients[1].access_token.token
+            assert first.service.requests["challenge"] == 1
+            assert second.service.requests["challenge"] == 1
+
+            # A token the server no longer accepts is dropped after one 401.
+            client = clients[1]
+            client.access_token = TokenInfo("revoked", datetime.now(UTC) + timedelta(hours=1))
+            client._store_tokens()
+            reference, _key, _iv = client.open_online_session()
+            client.close_online_session(reference)
+            assert second.service.requests["challenge"] == 2
+            assert client.access_token.token != "revoked"
+
+            store = KSeFTokenStore(str(tmp_path / "ksef-tokens.json"))
+            stored, _refresh = store.load("demo", second.url, second.nip, second.token)
+            assert stored.token == client.access_token.token
+            fresh = KSeFClient("demo", first.nip, first.token, token_store=store, base_url=first.url)
+            fresh.ensure_authenticated()
+            assert fresh.access_token.token == clients[0].access_token.token
+        finally:
+            reset_ksef_clients()
+            clear_public_key_cache()
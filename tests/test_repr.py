@@ -22,6 +22,7 @@ def app(tmp_path):
     Path('rejestr.docx').touch()
     application = create_app()
     application.config['WTF_CSRF_ENABLED'] = False
+    application.config['TESTING'] = True
     try:
         with application.app_context():
             db.create_all()
@@ -0,0 +1,16 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+_BENCH = Path(__file__).resolve().parent.parent / "benchmarks" / "bench_startup.py"
+_spec = importlib.util.spec_from_file_location("bench_startup", _BENCH)
+bench_startup = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench_startup)
+
+
+@pytest.mark.parametrize("module", ["app", "invoice_helper", "ksef_client"])
+def test_heavy_dependencies_are_not_imported_at_startup(module):
+    result = bench_startup.measure(module)
+    assert result["total_ms"] > 0
+    assert result["heavy_loaded"] == []
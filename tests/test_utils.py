@@ -11,7 +11,7 @@ from email.message import EmailMessage
 import utils
 import pytest
 from utils import is_valid_email
-from model import db, Uzytkownik, PasswordResetToken, Prowadzacy, Zajecia
+from model import db, Uzytkownik, PasswordResetToken, Prowadzacy, Zajecia, Uczestnik
 from werkzeug.security import generate_password_hash
 from app import create_app
 
@@ -29,6 +29,7 @@ def app(tmp_path):
     Path("rejestr.docx").touch()
     application = create_app()
     application.config['WTF_CSRF_ENABLED'] = False
+    application.config['TESTING'] = True
     try:
         with application.app_context():
             db.create_all()
@@ -89,6 +90,41 @@ def test_process_signature(monkeypatch, tmp_path):
     out = Image.open(saved)
     assert out.format == 'PNG'
 
+def _legacy_clear_background(img):
+    img = img.convert('RGBA')
+    img.putdata([
+        (255, 255, 255, 0) if p[0] > 250 and p[1] > 250 and p[2] > 250 else p
+        for p in img.getdata()
+    ])
+    return img
+
+
+def test_clear_white_background_matches_per_pixel_loop():
+    img = Image.new('RGBA', (6, 1))
+    img.putdata([
+        (255, 255, 255, 255), (251, 252, 253, 128), (250, 255, 255, 255),
+        (0, 0, 0, 255), (255, 255, 251, 0), (10, 251, 251, 200),
+    ])
+    out = utils._clear_white_background(img)
+    assert list(out.getdata()) == list(_legacy_clear_background(img).getdata())
+
+
+def test_process_signature_downscales_and_clears_background(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'REMOVE_SIGNATURE_BG', True)
+    monkeypatch.setattr(utils, '_load_rembg', lambda: None)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'static').mkdir()
+    img = Image.new('RGB', (2000, 500), (255, 255, 255))
+    img.paste((0, 0, 0), (0, 0, 1000, 500))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    filename = utils.process_signature(buf)
+    out = Image.open(tmp_path / 'static' / filename)
+    assert out.size == (utils._signature_max_width_px(), 103)
+    assert out.getpixel((10, 50)) == (0, 0, 0, 255)
+    assert out.getpixel((400, 50)) == (255, 255, 255, 0)
+
+
 def test_validate_signature_none():
     name, error = utils.validate_signature(None)
     assert name is None
@@ -106,7 +142,7 @@ def test_validate_signature_exception():
         utils.validate_signature(fs)
 
 
-def test_send_plain_email_queue(monkeypatch):
+def test_send_plain_email_queue(app, monkeypatch):
     called = {}
 
     def fake_send(msg):
@@ -125,7 +161,7 @@ def test_send_plain_email_queue(monkeypatch):
     assert called.get('to') == 'x@example.com'
     assert utils._worker is None or not utils._worker.is_alive()
 
-def test_shutdown_email_worker_thread(monkeypatch):
+def test_shutdown_email_worker_thread(app, monkeypatch):
     utils.shutdown_email_worker()
     monkeypatch.setattr(utils, "_send_message", lambda msg: None)
     utils.send_plain_email(
@@ -369,3 +405,755 @@ def test_attach_cid_images_no_escape(monkeypatch, tmp_path):
     monkeypatch.chdir(tmp_path)
     utils._attach_cid_images(msg, '<img src="cid:../ok.png">')
     assert len(list(msg.iter_attachments())) == 0
+
+
+def _seed_attendance(trainer_id, participants, sessions):
+    """Add ``sessions`` sessions where every other participant is present."""
+    uczestnicy = [
+        Uczestnik(imie_nazwisko=f"U{i}", prowadzacy_id=trainer_id) for i in range(participants)
+    ]
+    db.session.add_all(uczestnicy)
+    for day in range(sessions):
+        zaj = Zajecia(
+            prowadzacy_id=trainer_id,
+            data=datetime(2024, 1, 1) + timedelta(days=day),
+            czas_trwania=1.0,
+        )
+        zaj.obecni.extend(uczestnicy[::2])
+        db.session.add(zaj)
+    db.session.commit()
+    return uczestnicy
+
+
+def _count_statements(fn):
+    from sqlalchemy import event
+
+    statements = []
+
+    def before(conn, cursor, statement, *_a):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before)
+    return result, len(statements)
+
+
+def test_get_attendance_stats_values(app):
+    with app.app_context():
+        prow = Prowadzacy(imie="S", nazwisko="S")
+        other = Prowadzacy(imie="O", nazwisko="O")
+        db.session.add_all([prow, other])
+        db.session.flush()
+        uczestnicy = _seed_attendance(prow.id, 3, 4)
+        foreign = Zajecia(prowadzacy_id=other.id, data=datetime(2024, 2, 1), czas_trwania=1.0)
+        foreign.obecni.append(uczestnicy[1])
+        db.session.add(foreign)
+        db.session.commit()
+
+        stats, total = utils.get_attendance_stats(prow.id, uczestnicy)
+
+        assert total == 4
+        assert stats[uczestnicy[0].id]["present"] == 4
+        assert stats[uczestnicy[0].id]["percent"] == 100
+        assert stats[uczestnicy[1].id]["present"] == 0
+        assert stats[uczestnicy[2].id]["uczestnik"] is uczestnicy[2]
+
+
+def test_get_attendance_stats_query_count_is_flat(app):
+    with app.app_context():
+        small = Prowadzacy(imie="A", nazwisko="A")
+        large = Prowadzacy(imie="B", nazwisko="B")
+        db.session.add_all([small, large])
+        db.session.flush()
+        small_id, large_id = small.id, large.id
+        _seed_attendance(small_id, 2, 2)
+        _seed_attendance(large_id, 40, 60)
+        few = Uczestnik.query.filter_by(prowadzacy_id=small_id).all()
+        many = Uczestnik.query.filter_by(prowadzacy_id=large_id).all()
+
+        _, small_count = _count_statements(lambda: utils.get_attendance_stats(small_id, few))
+        _, large_count = _count_statements(lambda: utils.get_attendance_stats(large_id, many))
+
+        assert small_count == large_count == 2
+
+
+
+def test_get_month_sessions_uses_half_open_window(app):
+    with app.app_context():
+        prow = Prowadzacy(imie="M", nazwisko="M")
+        db.session.add(prow)
+        db.session.flush()
+        for dt in (
+            datetime(2024, 11, 30, 23, 0),
+            datetime(2024, 12, 1),
+            datetime(2024, 12, 31, 23, 59),
+            datetime(2025, 1, 1),
+        ):
+            db.session.add(Zajecia(prowadzacy_id=prow.id, data=dt, czas_trwania=1.0))
+        db.session.commit()
+
+        sessions = utils.get_month_sessions(prow.id, 12, 2024)
+
+        assert [z.data.day for z in sessions] == [1, 31]
+
+
+def test_monthly_hours_summed_in_sql_over_month_window(app):
+    from invoice_helper import calculate_monthly_hours
+    prow = Prowadzacy(imie="H", nazwisko="H")
+    db.session.add(prow)
+    db.session.flush()
+    for dt, hours in (
+        (datetime(2024, 11, 30, 23, 0), 5.0),
+        (datetime(2024, 12, 1), 1.5),
+        (datetime(2024, 12, 31, 23, 59), 2.0),
+        (datetime(2025, 1, 1), 7.0),
+    ):
+        db.session.add(Zajecia(prowadzacy_id=prow.id, data=dt, czas_trwania=hours))
+    db.session.commit()
+
+    assert calculate_monthly_hours(prow.id, 12, 2024) == 3.5
+    assert calculate_monthly_hours(prow.id, 2, 2024) == 0.0
+    predicate = str(utils.in_month(Zajecia.data, 12, 2024).compile(db.engine))
+    assert "extract" not in predicate.lower()
+    assert "zajecia.data >=" in predicate
+
+
+class _FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port):
+        self.sent = []
+        self.logins = 0
+        self.noop_code = 250
+        self.drop_next_send = False
+        _FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, login, password):
+        self.logins += 1
+
+    def noop(self):
+        return self.noop_code, b'OK'
+
+    def send_message(self, msg):
+        if self.drop_next_send:
+            raise smtplib.SMTPServerDisconnected('gone')
+        self.sent.append(msg['To'])
+
+    def quit(self):
+        pass
+
+
+def _smtp_pool(monkeypatch, **kwargs):
+    from utils.smtp_pool import SMTPConnectionPool
+
+    _FakeSMTP.instances = []
+    monkeypatch.setattr(smtplib, 'SMTP', _FakeSMTP)
+    return SMTPConnectionPool(**kwargs)
+
+
+def _mail(to):
+    from email.message import EmailMessage
+
+    msg = EmailMessage()
+    msg['To'] = to
+    return msg
+
+
+def test_smtp_pool_reuses_authenticated_connection(monkeypatch):
+    pool = _smtp_pool(monkeypatch)
+    settings = ('smtp', 25, 'user', 'pass')
+    for to in ('a@example.com', 'b@example.com', 'c@example.com'):
+        pool.send(_mail(to), settings)
+    assert len(_FakeSMTP.instances) == 1
+    assert _FakeSMTP.instances[0].logins == 1
+    assert _FakeSMTP.instances[0].sent == ['a@example.com', 'b@example.com', 'c@example.com']
+
+    pool.send(_mail('d@example.com'), ('smtp', 25, 'other', 'pass'))
+    assert len(_FakeSMTP.instances) == 2
+
+
+def test_smtp_pool_reconnects_after_failed_health_check(monkeypatch):
+    pool = _smtp_pool(monkeypatch, noop_after=0)
+    settings = ('smtp', 25, 'user', 'pass')
+    pool.send(_mail('a@example.com'), settings)
+    _FakeSMTP.instances[0].noop_code = 421
+    pool.send(_mail('b@example.com'), settings)
+    assert len(_FakeSMTP.instances) == 2
+    assert _FakeSMTP.instances[1].sent == ['b@example.com']
+
+
+def test_smtp_pool_retries_once_when_connection_drops(monkeypatch):
+    pool = _smtp_pool(monkeypatch)
+    settings = ('smtp', 25, 'user', 'pass')
+    pool.send(_mail('a@example.com'), settings)
+    _FakeSMTP.instances[0].drop_next_send = True
+    pool.send(_mail('b@example.com'), settings)
+    assert [s.sent for s in _FakeSMTP.instances] == [['a@example.com'], ['b@example.com']]
+
+
+def _outbox_message(to='q@example.com'):
+    msg = EmailMessage()
+    msg['To'] = to
+    msg['Subject'] = 'S'
+    msg.set_content('body')
+    return msg
+
+
+def test_outbox_retries_with_backoff_then_dead_letters(app, monkeypatch):
+    from model import EmailOutbox
+    from utils import outbox
+
+    row_id = outbox.enqueue_email(_outbox_message()).id
+
+    def failing_send(msg):
+        raise smtplib.SMTPException('down')
+
+    assert outbox.drain_outbox(failing_send) == 1
+    row = db.session.get(EmailOutbox, row_id)
+    assert (row.status, row.attempts, row.leased_until) == ('pending', 1, None)
+    assert row.next_attempt_at > datetime.utcnow() + timedelta(seconds=20)
+    assert outbox.drain_outbox(failing_send) == 0
+
+    for _ in range(outbox.MAX_ATTEMPTS - 1):
+        row.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        outbox.drain_outbox(failing_send)
+    assert row.status == 'dead'
+    assert row.last_error == 'down'
+
+    assert outbox.requeue_dead() == 1
+    sent = []
+    assert outbox.drain_outbox(lambda msg: sent.append(msg['To'])) == 1
+    assert sent == ['q@example.com']
+    assert row.status == 'sent' and row.sent_at is not None
+
+
+def test_outbox_leased_rows_are_not_claimed_twice(app):
+    from utils import outbox
+
+    outbox.enqueue_email(_outbox_message('a@example.com'))
+    outbox.enqueue_email(_outbox_message('b@example.com'))
+    first = outbox.claim_batch(limit=1, owner='w1')
+    second = outbox.claim_batch(owner='w2')
+    assert len(first) == 1 and len(second) == 1 and first != second
+    assert outbox.claim_batch(owner='w3') == []
+
+
+def test_request_only_enqueues_email(app, monkeypatch):
+    from model import EmailOutbox
+
+    sent = []
+    monkeypatch.setattr(utils, '_send_message', lambda msg: sent.append(msg['To']))
+    monkeypatch.setattr(utils, '_ensure_worker', lambda: None)
+    with app.test_request_context('/'):
+        utils.send_plain_email('r@example.com', 'S', 'B', 's', 'b')
+    assert sent == []
+    assert [r.recipient for r in EmailOutbox.query.all()] == ['r@example.com']
+
+
+def test_first_request_delivers_mail_left_in_outbox(app, client, monkeypatch):
+    from model import EmailOutbox
+    from utils import outbox
+
+    utils.shutdown_email_worker()
+    sent = []
+    monkeypatch.setattr(utils, '_send_message', lambda msg: sent.append(msg['To']))
+    # Queued by a worker that was restarted before delivering it.
+    outbox.enqueue_email(_outbox_message('left@example.com'))
+    db.session.commit()
+    app.config['TESTING'] = False
+    assert client.get('/healthz').status_code == 200
+    assert utils._worker is not None and utils._worker.is_alive()
+    utils.shutdown_email_worker()
+    assert sent == ['left@example.com']
+    assert EmailOutbox.query.one().status == 'sent'
+
+
+def test_settings_cache_picks_up_changes_from_other_workers(app, monkeypatch):
+    from utils.settings import get_setting, save_settings, settings
+
+    monkeypatch.setenv('EMAIL_FOOTER', 'from env')
+    assert get_setting('email_footer') == 'from env'
+
+    # Another worker saves a setting: only the database changes here.
+    save_settings({'email_footer': 'from db'})
+    db.session.commit()
+    assert get_setting('email_footer') == 'from env'
+
+    monkeypatch.setattr(settings, 'check_interval', 60)
+    monkeypatch.setattr(settings, '_checked_at', 0.0)
+    with app.test_request_context('/'):
+        app.preprocess_request()
+    assert get_setting('email_footer') == 'from db'
+
+    save_settings({'email_footer': 'newer'})
+    db.session.commit()
+    assert _count_statements(settings.maybe_refresh)[1] == 0
+    assert get_setting('email_footer') == 'from db'
+
+
+def test_settings_override_and_typed_getters(monkeypatch):
+    from utils.settings import get_setting, get_setting_bool, get_setting_int, override_setting
+
+    monkeypatch.setenv('SMTP_PORT', '587')
+    monkeypatch.setenv('KSEF_ENABLED', 'yes')
+    assert get_setting_int('smtp_port') == 587
+    assert get_setting_bool('ksef_enabled') is True
+    with override_setting('smtp_port', '2525'):
+        assert get_setting('SMTP_PORT') == '2525'
+    assert get_setting_int('smtp_port') == 587
+
+
+def test_month_sessions_query_uses_trainer_date_index(app):
+    start, end = utils.month_window(5, 2024)
+    query = Zajecia.query.filter(
+        Zajecia.prowadzacy_id == 1,
+        Zajecia.data >= start,
+        Zajecia.data < end,
+    ).order_by(Zajecia.data)
+    compiled = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    with db.engine.connect() as conn:
+        plan = " ".join(
+            row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+        )
+    assert "ix_zajecia_prowadzacy_id_data" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_sqlite_connections_use_tuning_pragmas(app):
+    with db.engine.connect() as conn:
+        def pragma(name):
+            return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("busy_timeout") == 5000
+        assert pragma("foreign_keys") == 1
+        assert pragma("cache_size") == -64000
+
+
+def test_engine_options_size_pool_for_server_databases(monkeypatch):
+    from utils.db_engine import engine_options
+
+    assert engine_options("sqlite:////tmp/x.db") == {}
+    monkeypatch.setenv("DB_POOL_SIZE", "12")
+    monkeypatch.setenv("DB_POOL_RECYCLE", "600")
+    options = engine_options("postgresql://u:p@db/obecnosc")
+    assert options["pool_size"] == 12
+    assert options["max_overflow"] == 10
+    assert options["pool_recycle"] == 600
+    assert options["pool_pre_ping"] is True
+
+
+def test_stats_follow_session_and_attendance_changes(app):
+    from model import ParticipantStats, TrainerStats
+
+    def months():
+        return {
+            (s.year, s.month): (s.sessions, s.hours)
+            for s in TrainerStats.query.filter_by(prowadzacy_id=prow.id)
+        }
+
+    def present(u):
+        row = db.session.get(ParticipantStats, u.id)
+        return row.present if row else None
+
+    prow = Prowadzacy(imie="S", nazwisko="S")
+    db.session.add(prow)
+    db.session.flush()
+    a, b = _seed_attendance(prow.id, 2, 3)
+    assert months() == {(2024, 1): (3, 3.0)}
+    assert (present(a), present(b)) == (3, 0)
+
+    zaj = Zajecia.query.filter_by(prowadzacy_id=prow.id).order_by(Zajecia.data).first()
+    zaj.data = datetime(2024, 2, 10)
+    zaj.czas_trwania = 2.5
+    zaj.obecni = [b]
+    db.session.commit()
+    assert months() == {(2024, 1): (2, 2.0), (2024, 2): (1, 2.5)}
+    assert (present(a), present(b)) == (2, 1)
+
+    db.session.delete(zaj)
+    db.session.commit()
+    assert months() == {(2024, 1): (2, 2.0)}
+    assert present(b) == 0
+
+    db.session.delete(a)
+    db.session.commit()
+    assert present(a) is None
+    assert utils.get_monthly_summary(prow.id) == {(2024, 1): 2.0}
+
+    zaj = Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 3, 1), czas_trwania=1.0)
+    db.session.add(zaj)
+    db.session.flush()
+    db.session.rollback()
+    assert months() == {(2024, 1): (2, 2.0)}
+
+
+def test_stats_follow_date_change_of_expired_session(app):
+    from model import TrainerStats
+
+    prow = Prowadzacy(imie="E", nazwisko="E")
+    db.session.add(prow)
+    db.session.flush()
+    zaj = Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 1, 10), czas_trwania=1.0)
+    db.session.add(zaj)
+    db.session.commit()
+
+    # The commit expired ``zaj``; its old date is not in the attribute history.
+    zaj.data = datetime(2024, 2, 10)
+    db.session.commit()
+    rows = TrainerStats.query.filter_by(prowadzacy_id=prow.id).all()
+    assert [(s.year, s.month, s.sessions) for s in rows] == [(2024, 2, 1)]
+
+
+def test_project_hours_counter_updates_incrementally(app):
+    from model import ProjectHours
+    from utils.settings import override_setting
+    from utils.stats import check_project_hours, get_project_used_hours
+
+    prow = Prowadzacy(imie="P", nazwisko="P")
+    db.session.add(prow)
+    db.session.flush()
+    before = Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 1, 10), czas_trwania=4.0)
+    during = Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 3, 1), czas_trwania=2.0)
+    db.session.add_all([before, during])
+    db.session.commit()
+
+    with override_setting("project_start_date", "2024-02-01"):
+        assert get_project_used_hours() == 2.0
+
+        db.session.add(Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 3, 2), czas_trwania=1.5))
+        before.data = datetime(2024, 2, 15)
+        during.czas_trwania = 3.0
+        db.session.commit()
+        assert db.session.get(ProjectHours, 1).used_hours == 8.5
+        # The edited objects were expired by the commit above; stats still move.
+        assert utils.get_monthly_summary(prow.id) == {(2024, 2): 4.0, (2024, 3): 4.5}
+
+        db.session.delete(before)
+        db.session.commit()
+        assert get_project_used_hours() == 4.5
+
+    # A different start date invalidates the counter and forces a recount.
+    with override_setting("project_start_date", "2024-03-02"):
+        assert get_project_used_hours() == 1.5
+
+        db.session.get(ProjectHours, 1).used_hours = 99.0
+        db.session.commit()
+        assert check_project_hours(repair=False) == (99.0, 1.5)
+        assert check_project_hours() == (99.0, 1.5)
+        assert get_project_used_hours() == 1.5
+
+    # A write under a new start date recounts the stale counter right away.
+    with override_setting("project_start_date", "2024-01-01"):
+        db.session.add(Zajecia(prowadzacy_id=prow.id, data=datetime(2024, 1, 5), czas_trwania=1.0))
+        db.session.commit()
+        row = db.session.get(ProjectHours, 1)
+        assert (row.start_date, row.used_hours) == ("2024-01-01", 5.5)
+
+
+def test_paginate_sessions_walks_keyset_pages(app):
+    from sqlalchemy import event
+    from utils.pagination import paginate_sessions
+
+    prow = Prowadzacy(imie="K", nazwisko="K")
+    db.session.add(prow)
+    db.session.flush()
+    # Pairs of sessions share a timestamp, so ties are broken by id.
+    for i in range(25):
+        db.session.add(
+            Zajecia(prowadzacy_id=prow.id, data=datetime(2020, 1, 1) + timedelta(days=i // 2))
+        )
+    db.session.commit()
+    expected = [
+        z.id
+        for z in Zajecia.query.order_by(Zajecia.data.desc(), Zajecia.id.desc())
+    ]
+    query = Zajecia.query.filter_by(prowadzacy_id=prow.id)
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *_a):
+        statements.append((statement, parameters))
+
+    seen, pages, cursor = [], [], None
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        while True:
+            page = paginate_sessions(query, after=cursor, per_page=10)
+            pages.append(page)
+            seen.extend(z.id for z in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len(statements) == 3
+    for statement, parameters in statements:
+        assert "count(" not in statement
+        # SQLite always renders "LIMIT ? OFFSET ?"; the offset must stay 0.
+        assert "OFFSET" not in statement or parameters[-1] == 0
+    assert seen == expected
+    assert [len(p.items) for p in pages] == [10, 10, 5]
+
+    back = paginate_sessions(query, before=pages[2].prev_cursor, per_page=10)
+    assert [z.id for z in back.items] == expected[10:20]
+    first = paginate_sessions(query, before=back.prev_cursor, per_page=10)
+    assert [z.id for z in first.items] == expected[:10]
+    assert not first.has_prev
+    assert paginate_sessions(query, after="garbage", per_page=10).items == pages[0].items
+
+
+def test_paginate_sessions_lists_dateless_sessions_last(app):
+    from utils.pagination import paginate_sessions
+
+    prow = Prowadzacy(imie="N", nazwisko="N")
+    db.session.add(prow)
+    db.session.flush()
+    dated = [Zajecia(prowadzacy_id=prow.id, data=datetime(2021, 1, d)) for d in (1, 2, 3, 4)]
+    dateless = [Zajecia(prowadzacy_id=prow.id, data=None) for _ in range(3)]
+    db.session.add_all(dated + dateless)
+    db.session.commit()
+    expected = [z.id for z in reversed(dated)] + sorted((z.id for z in dateless), reverse=True)
+    query = Zajecia.query.filter_by(prowadzacy_id=prow.id)
+
+    pages, cursor = [], None
+    while True:
+        page = paginate_sessions(query, after=cursor, per_page=3)
+        pages.append(page)
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert [[z.id for z in p.items] for p in pages] == [expected[:3], expected[3:6], expected[6:]]
+    assert pages[1].next_cursor.startswith("none-")
+
+    back = paginate_sessions(query, before=pages[2].prev_cursor, per_page=3)
+    assert [z.id for z in back.items] == expected[3:6]
+    back = paginate_sessions(query, before=back.prev_cursor, per_page=3)
+    assert [z.id for z in back.items] == expected[:3] and not back.has_prev
+
+
+def test_attendance_import_validates_then_inserts_in_batches(app):
+    from attendance_import import AttendanceImportError, import_records
+    from model import ParticipantStats, TrainerStats, obecnosci
+    from utils.stats import get_project_used_hours
+
+    prow = Prowadzacy(imie="I", nazwisko="I", domyslny_czas=1.5)
+    db.session.add(prow)
+    db.session.flush()
+    db.session.add(Uczestnik(imie_nazwisko="Anna", prowadzacy_id=prow.id))
+    db.session.commit()
+    assert get_project_used_hours() == 0.0
+
+    bad = [
+        {"prowadzacy_id": prow.id, "data": "2024-01-05", "obecni": ["Anna", "Nowy"]},
+        {"prowadzacy_id": 999, "data": "2024-01-06", "obecni": []},
+        {"prowadzacy_id": prow.id, "data": "jutro", "obecni": []},
+        {"prowadzacy_id": prow.id, "data": "2024-01-05T10:00:00+01:00", "obecni": []},
+    ]
+    with pytest.raises(AttendanceImportError) as exc:
+        import_records(bad)
+    assert exc.value.errors == [
+        "Row 1: participant 'Nowy' not found for trainer %s" % prow.id,
+        "Row 2: trainer 999 does not exist",
+        "Row 3: invalid date 'jutro'",
+        "Row 4: date '2024-01-05T10:00:00+01:00' must not have a time zone",
+    ]
+    assert Zajecia.query.count() == 0
+
+    records = [
+        {"prowadzacy_id": prow.id, "data": f"2024-01-{day:02d}", "obecni": ["anna", "Nowy"]}
+        for day in range(1, 6)
+    ]
+    records.append(
+        {"prowadzacy_id": str(prow.id), "data": "2024-02-01T10:00", "czas_trwania": "2,5",
+         "obecni": "Anna"}
+    )
+    result = import_records(records, create_participants=True, batch_size=2)
+
+    assert (result.sessions, result.attendance, result.participants_created) == (6, 11, 1)
+    assert db.session.execute(db.select(db.func.count()).select_from(obecnosci)).scalar() == 11
+    nowy = Uczestnik.query.filter_by(imie_nazwisko="Nowy").one()
+    assert db.session.get(ParticipantStats, nowy.id).present == 5
+    assert db.session.get(TrainerStats, (prow.id, 2024, 1)).hours == 7.5
+    assert db.session.get(TrainerStats, (prow.id, 2024, 2)).hours == 2.5
+    assert get_project_used_hours() == 10.0
+
+
+def test_export_writers_yield_chunks_as_rows_arrive(monkeypatch):
+    import zipfile
+    import exports
+
+    monkeypatch.setattr(exports, "CHUNK_ROWS", 10)
+    consumed = []
+
+    def rows():
+        for i in range(35):
+            consumed.append(i)
+            yield (i, f"a<b&{i}", datetime(2024, 1, 1, 9, 30), None)
+
+    chunks = exports.csv_chunks(exports.Export("t", ["n", "s", "d", "x"], rows()))
+    first = next(chunks)
+    assert first.startswith("\ufeffn,s,d,x\r\n0,a<b&0,2024-01-01 09:30,\r\n")
+    assert len(consumed) == 10
+    assert len(list(chunks)) == 3
+
+    consumed.clear()
+    chunks = exports.xlsx_chunks(exports.Export("t", ["n", "s", "d", "x"], rows()))
+    data = [next(chunks)]
+    assert consumed == []
+    data.extend(chunks)
+    assert len(data) > 4
+    with zipfile.ZipFile(io.BytesIO(b"".join(data))) as workbook:
+        sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+    assert "<c><v>34</v></c>" in sheet
+    assert "a&lt;b&amp;34" in sheet
+
+
+def test_ksef_poller_records_final_status_with_backoff(app, monkeypatch):
+    from ksef_client import KSeFSendResult
+    from model import KSeFInvoice
+    from utils import ksef_poller
+
+    pending = KSeFSendResult('S1', 'I1', session_status_code=170, invoice_status_code=150)
+    row = ksef_poller.record_submission(pending, 'A1/1/2026', prowadzacy_id=3)
+    assert (row.status, row.environment) == ('pending', 'demo')
+
+    statuses = iter([pending, KSeFSendResult('S1', 'I1', 170, None, 200, 'OK', 'K1')])
+    polled = []
+
+    class FakeClient:
+        def wait_for_invoice_processing(self, session_ref, invoice_ref, timeout_seconds):
+            polled.append((session_ref, invoice_ref, timeout_seconds))
+            return next(statuses)
+
+    monkeypatch.setattr(ksef_poller, '_client_for', lambda environment: FakeClient())
+    assert ksef_poller.poll_pending_invoices() == 1
+    assert (row.status, row.polls, row.leased_until) == ('pending', 1, None)
+    assert row.next_poll_at > datetime.utcnow()
+    assert ksef_poller.poll_pending_invoices() == 0
+
+    row.next_poll_at = datetime.utcnow()
+    db.session.commit()
+    assert ksef_poller.poll_pending_invoices() == 1
+    assert polled == [('S1', 'I1', 0)] * 2
+    assert (row.status, row.ksef_number, row.status_code) == ('accepted', 'K1', 200)
+    assert row.completed_at is not None
+    assert ksef_poller.seconds_until_next_poll() is None
+    assert ksef_poller.next_poll_delay(30) == timedelta(seconds=ksef_poller.BACKGROUND_POLL_MAX_SECONDS)
+
+    row.status, row.next_poll_at = 'pending', datetime.utcnow()
+    row.created_at = datetime.utcnow() - ksef_poller.POLL_TIMEOUT - timedelta(minutes=1)
+    db.session.commit()
+    statuses = iter([pending])
+    notified = []
+    monkeypatch.setenv('EMAIL_RECIPIENT', 'koordynator@example.com')
+    monkeypatch.setattr(utils, 'send_plain_email', lambda to, *a, **kw: notified.append((to, kw)))
+    ksef_poller.poll_pending_invoices()
+    assert KSeFInvoice.query.one().status == 'expired'
+    assert [(to, kw['invoice_number'], kw['status']) for to, kw in notified] == [
+        ('koordynator@example.com', 'A1/1/2026', 'expired')
+    ]
+
+
+def test_request_sends_invoice_to_ksef_without_waiting(app, monkeypatch):
+    import ksef_client
+    from ksef_client import KSeFSendResult
+    from ksef_invoice import create_invoice_from_monthly_report
+    from model import KSeFInvoice
+    from utils import ksef_poller
+    import invoice_helper
+
+    waits = []
+
+    def fake_send(invoice_xml, wait_for_completion=True):
+        waits.append(wait_for_completion)
+        return True, KSeFSendResult('S1', 'I1', session_status_code=100), None
+
+    started = []
+    monkeypatch.setenv('KSEF_ENABLED', '1')
+    monkeypatch.setattr(ksef_client, 'send_invoice_to_ksef', fake_send)
+    monkeypatch.setattr(ksef_poller, 'start_ksef_poller', lambda: started.append(True))
+    invoice = create_invoice_from_monthly_report(hours=2, month=5, year=2025)
+
+    with app.test_request_context('/'):
+        success, message, error, _pdf = invoice_helper.submit_invoice(
+            invoice, '<xml/>', io.BytesIO(b'%PDF'), None, prowadzacy_id=7
+        )
+    assert (success, error, waits, started) == (True, None, [False], [True])
+    assert 'faktura: I1' in message
+    row = KSeFInvoice.query.one()
+    assert (row.status, row.prowadzacy_id, row.invoice_reference_number) == ('pending', 7, 'I1')
+
+    invoice_helper.submit_invoice(invoice, '<xml/>', io.BytesIO(b'%PDF'), None)
+    assert waits == [False, True] and started == [True]
+
+
+def test_poller_releases_number_of_rejected_invoice(app, monkeypatch):
+    import ksef_client
+    from ksef_client import KSeFSendResult
+    from ksef_invoice import create_invoice_from_monthly_report, next_invoice_counter
+    from model import KSeFInvoice, Setting
+    from utils import ksef_poller
+    from utils.settings import reload_settings
+    import invoice_helper
+
+    db.session.add(Setting(key='invoice_number_counter', value='7'))
+    db.session.commit()
+    reload_settings()
+    references = iter(['I1', 'I2', 'I3'])
+    monkeypatch.setenv('KSEF_ENABLED', '1')
+    monkeypatch.setattr(
+        ksef_client,
+        'send_invoice_to_ksef',
+        lambda xml, wait_for_completion=True: (True, KSeFSendResult('S1', next(references)), None),
+    )
+    monkeypatch.setattr(ksef_poller, 'start_ksef_poller', lambda: None)
+    monkeypatch.setattr(utils, 'send_plain_email', lambda *a, **kw: None)
+
+    def upload():
+        invoice = create_invoice_from_monthly_report(hours=2, month=5, year=2025)
+        with app.test_request_context('/'):
+            invoice_helper.submit_invoice(invoice, '<xml/>', io.BytesIO(b'%PDF'), None)
+        return invoice
+
+    def counter():
+        return Setting.query.filter_by(key='invoice_number_counter').one().value
+
+    first, second = upload(), upload()
+    assert (first.counter, second.counter, counter()) == (7, 8, '9')
+    row = KSeFInvoice.query.filter_by(invoice_reference_number='I1').one()
+    assert row.reserved_counter == 7
+
+    statuses = {
+        'I1': KSeFSendResult('S1', 'I1', 200, None, 450, 'Błąd weryfikacji'),
+        'I2': KSeFSendResult('S1', 'I2', 200, None, 150, 'Trwa przetwarzanie'),
+    }
+
+    class FakeClient:
+        def wait_for_invoice_processing(self, session_ref, invoice_ref, timeout_seconds):
+            return statuses[invoice_ref]
+
+    monkeypatch.setattr(ksef_poller, '_client_for', lambda environment: FakeClient())
+    ksef_poller.poll_pending_invoices()
+    assert row.status == 'rejected'
+    # Number 8 is still held, so 7 waits for the next invoice.
+    assert (counter(), next_invoice_counter()) == ('9', 7)
+    assert upload().counter == 7
+    assert (counter(), next_invoice_counter()) == ('9', 9)
+
+    # Once 8 and then 7 are rejected as well, the counter steps back to 7.
+    for invoice_row in KSeFInvoice.query.filter_by(status='pending'):
+        invoice_row.next_poll_at = datetime.utcnow()
+    db.session.commit()
+    statuses['I2'] = KSeFSendResult('S1', 'I2', 200, None, 450, 'Błąd weryfikacji')
+    statuses['I3'] = KSeFSendResult('S1', 'I3', 200, None, 450, 'Błąd weryfikacji')
+    assert ksef_poller.poll_pending_invoices() == 2
+    assert (counter(), next_invoice_counter()) == ('7', 7)
@@ -1,14 +1,30 @@
-from model import db, Zajecia, Uczestnik, PasswordResetToken, Uzytkownik, Prowadzacy
-from sqlalchemy.exc import OperationalError
+from model import (
+    db,
+    ParticipantStats,
+    PasswordResetToken,
+    Prowadzacy,
+    TrainerStats,
+    Uczestnik,
+    Uzytkownik,
+    Zajecia,
+)
+from flask import current_app, has_request_context
 from doc_generator import generuj_liste_obecnosci
+from utils.smtp_pool import close_smtp_pool, get_smtp_pool
+from utils.outbox import drain_outbox, enqueue_email
+from utils.settings import (
+    get_setting,
+    get_setting_bool,
+    get_setting_int,
+    reload_settings,
+    settings,
+)
 from io import BytesIO
 from datetime import datetime
-from collections import defaultdict
 import os
 import smtplib
 import logging
 import threading
-import queue
 import atexit
 from email.message import EmailMessage
 import mimetypes
@@ -17,11 +33,7 @@ import json
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
 import uuid
-from PIL import Image
-try:
-    from rembg import remove as rembg_remove  # type: ignore
-except Exception:  # rembg is optional
-    rembg_remove = None
+from PIL import Image, ImageChops
 
 logger = logging.getLogger(__name__)
 
@@ -65,72 +77,97 @@ def month_name(value):
     except (KeyError, ValueError, TypeError):
         return ""
 
-# simple asynchronous e-mail dispatch
-_email_queue: "queue.Queue[EmailMessage | None]" = queue.Queue()
+# asynchronous e-mail dispatch through the durable outbox table
+OUTBOX_POLL_INTERVAL = 5.0
 _worker: threading.Thread | None = None
+_worker_stop = threading.Event()
+_worker_wake = threading.Event()
 
 
-def _email_worker() -> None:
-    """Background thread sending messages from ``_email_queue``."""
+def _send_outbox_message(msg: EmailMessage) -> None:
+    _send_message(msg)
+
+
+def _email_worker(app) -> None:
+    """Background thread delivering due messages from the e-mail outbox."""
     while True:
-        msg = _email_queue.get()
-        if msg is None:
-            _email_queue.task_done()
+        with app.app_context():
+            try:
+                settings.maybe_refresh()
+                delivered = drain_outbox(_send_outbox_message)
+            except Exception:
+                logger.exception("E-mail outbox worker failed")
+                db.session.rollback()
+                delivered = 0
+        if delivered:
+            continue
+        if _worker_stop.is_set():
             break
-        try:
-            _send_message(msg)
-        finally:
-            _email_queue.task_done()
+        _worker_wake.wait(OUTBOX_POLL_INTERVAL)
+        _worker_wake.clear()
 
 
 def _ensure_worker() -> None:
     global _worker
     if _worker is None or not _worker.is_alive():
-        _worker = threading.Thread(target=_email_worker, daemon=True)
+        _worker_stop.clear()
+        _worker = threading.Thread(
+            target=_email_worker, args=(current_app._get_current_object(),), daemon=True
+        )
         _worker.start()
 
 
-def _dispatch(msg: EmailMessage, use_queue: bool) -> None:
+def start_email_worker() -> None:
+    """Start the outbox worker in this process if it is not running.
+
+    Called on the first request of every web worker, so mail left pending or
+    waiting for a retry by a previous process is delivered after a restart.
+    """
+    _ensure_worker()
+
+
+def _dispatch(msg: EmailMessage, use_queue: bool | None) -> None:
+    """Send ``msg`` now or store it in the outbox for the background worker.
+
+    ``use_queue=None`` queues inside web requests, so they return without
+    waiting for SMTP, and sends synchronously elsewhere (CLI commands).
+    """
+    if use_queue is None:
+        use_queue = has_request_context()
     if use_queue:
+        enqueue_email(msg)
         _ensure_worker()
-        _email_queue.put(msg)
+        _worker_wake.set()
     else:
         _send_message(msg)
 
 
 def shutdown_email_worker() -> None:
-    """Stop the background email worker after processing remaining messages."""
+    """Stop the background email worker after delivering messages that are due."""
     global _worker
     if _worker and _worker.is_alive():
-        _email_queue.join()
-        _email_queue.put(None)
+        _worker_stop.set()
+        _worker_wake.set()
         _worker.join()
-        _worker = None
+    _worker = None
 
 
 def get_smtp_settings() -> tuple[str | None, int | None, str | None, str | None]:
-    """Return SMTP host, port, login and password from environment."""
-    host = os.getenv("SMTP_HOST")
-    port_str = os.getenv("SMTP_PORT")
-    port = int(port_str) if port_str is not None else None
-    login = os.getenv("EMAIL_LOGIN")
-    password = os.getenv("EMAIL_PASSWORD")
+    """Return SMTP host, port, login and password from the settings cache."""
+    host = get_setting("smtp_host")
+    port = get_setting_int("smtp_port")
+    login = get_setting("email_login")
+    password = get_setting("email_password")
     return host, port, login, password
 
 
 def _send_message(msg: EmailMessage) -> None:
-    """Send ``msg`` immediately using SMTP settings from environment."""
-    host, port, login, password = get_smtp_settings()
+    """Send ``msg`` immediately using SMTP settings from environment.
 
-    if port == 465:
-        with smtplib.SMTP_SSL(host, port) as smtp:
-            smtp.login(login, password)
-            smtp.send_message(msg)
-    else:
-        with smtplib.SMTP(host, port) as smtp:
-            smtp.starttls()
-            smtp.login(login, password)
-            smtp.send_message(msg)
+    Connections are kept open in :mod:`utils.smtp_pool` and reused by both the
+    background worker and synchronous sends.
+    """
+    get_smtp_pool().send(msg, get_smtp_settings())
     logger.info("Mail sent to %s", msg.get("To"))
 
 
@@ -168,56 +205,62 @@ ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 ALLOWED_MIME_TYPES = {"image/png", "image/jpeg"}
 
 # Maximum allowed size of uploaded signature files in bytes
-SIGNATURE_MAX_SIZE = int(os.getenv("MAX_SIGNATURE_SIZE", 1024 * 1024))
+SIGNATURE_MAX_SIZE = get_setting_int("max_signature_size", 1024 * 1024)
 # Whether to clean white background from signatures
-REMOVE_SIGNATURE_BG = os.getenv("REMOVE_SIGNATURE_BG", "0").lower() in {"1", "true", "yes"}
+REMOVE_SIGNATURE_BG = get_setting_bool("remove_signature_bg")
+# Signatures are never embedded wider than this (see doc_generator)
+SIGNATURE_MAX_WIDTH_CM = 3.5
+SIGNATURE_DPI = 300
 
 # Mapping of column width percentages loaded from the database
 TABLE_COLUMN_WIDTHS: dict[str, list[float]] = {}
 
 
 def load_db_settings(app) -> None:
-    """Load configuration from the Setting table into ``os.environ``.
+    """Load configuration from the Setting table into the settings cache.
 
-    All entries from :class:`~model.Setting` are loaded into environment
-    variables named after the key in upper case, e.g. ``email_list_subject``
-    becomes ``EMAIL_LIST_SUBJECT``.
+    Values are read with :func:`utils.settings.get_setting` using the setting
+    key, e.g. ``email_list_subject``; keys missing from the table fall back to
+    the upper-case environment variable (``EMAIL_LIST_SUBJECT``).
     """
-    from model import Setting  # imported lazily to avoid circular imports
-
     with app.app_context():
+        reload_settings()
+
+
+def _parse_table_widths(value: str | None) -> list[float]:
+    widths: list[float] = []
+    for part in (value or "").split(","):
+        if not part:
+            continue
+        if "=" in part:
+            _, num = part.split("=", 1)
+        else:
+            num = part
         try:
-            settings = Setting.query.all()
-        except OperationalError:
-            logger.warning("Settings table missing, skipping load.")
-            settings = []
+            widths.append(float(num))
+        except ValueError:
+            continue
+    return widths
 
-        for setting in settings:
-            os.environ[setting.key.upper()] = setting.value
 
+def _apply_settings() -> None:
+    """Refresh module-level values derived from settings after a reload."""
     global SIGNATURE_MAX_SIZE, REMOVE_SIGNATURE_BG, TABLE_COLUMN_WIDTHS
-    TABLE_COLUMN_WIDTHS = {}
-    for key, value in os.environ.items():
-        if not key.startswith("TABLE_") or not key.endswith("_WIDTHS"):
+    widths_by_table = {}
+    for key, value in settings.items("table_").items():
+        if not key.endswith("_widths"):
             continue
-        table = key[len("TABLE_") : -len("_WIDTHS")].lower().replace("_", "-")
-        widths: list[float] = []
-        for part in (value or "").split(","):
-            if not part:
-                continue
-            if "=" in part:
-                _, num = part.split("=", 1)
-            else:
-                num = part
-            try:
-                widths.append(float(num))
-            except ValueError:
-                continue
+        table = key[len("table_") : -len("_widths")].replace("_", "-")
+        widths = _parse_table_widths(value)
         if widths:
-            TABLE_COLUMN_WIDTHS[table] = widths
+            widths_by_table[table] = widths
+    TABLE_COLUMN_WIDTHS = widths_by_table
+
+    SIGNATURE_MAX_SIZE = get_setting_int("max_signature_size", 1024 * 1024)
+    REMOVE_SIGNATURE_BG = get_setting_bool("remove_signature_bg")
 
-    SIGNATURE_MAX_SIZE = int(os.getenv("MAX_SIGNATURE_SIZE", 1024 * 1024))
-    REMOVE_SIGNATURE_BG = os.getenv("REMOVE_SIGNATURE_BG", "0").lower() in {"1", "true", "yes"}
+
+settings.on_reload(_apply_settings)
 
 
 def is_valid_email(value: str) -> bool:
@@ -300,11 +343,11 @@ def email_do_koordynatora(
     data,
     typ: str = "lista",
     course: str | None = None,
-    queue: bool = False,
+    queue: bool | None = None,
     trainer: object | None = None,
     invoice_pdf_buf: object | None = None,
 ):
-    odbiorca = os.getenv("EMAIL_RECIPIENT")
+    odbiorca = get_setting("email_recipient")
     if not odbiorca:
         logger.warning("EMAIL_RECIPIENT not configured, skipping mail send.")
         return
@@ -312,37 +355,37 @@ def email_do_koordynatora(
     msg = EmailMessage()
 
     if typ == "raport":
-        subject_tmpl = os.getenv(
-            "EMAIL_REPORT_SUBJECT", "Raport miesięczny – {date}"
+        subject_tmpl = get_setting(
+            "email_report_subject", "Raport miesięczny – {date}"
         )
-        body_tmpl = os.getenv(
-            "EMAIL_REPORT_BODY", "W załączniku raport miesięczny do umowy."
+        body_tmpl = get_setting(
+            "email_report_body", "W załączniku raport miesięczny do umowy."
         )
         filename = f"raport_{data}.docx"
     else:
-        subject_tmpl = os.getenv(
-            "EMAIL_LIST_SUBJECT", "Lista obecności – {date}"
+        subject_tmpl = get_setting(
+            "email_list_subject", "Lista obecności – {date}"
         )
-        body_tmpl = os.getenv(
-            "EMAIL_LIST_BODY", "W załączniku lista obecności z zajęć."
+        body_tmpl = get_setting(
+            "email_list_body", "W załączniku lista obecności z zajęć."
         )
         filename = f"lista_{data}.docx"
     msg["Subject"] = safe_format(subject_tmpl, date=data, course=course or "")
     body = safe_format(body_tmpl, date=data, course=course or "")
 
-    footer = os.getenv("EMAIL_FOOTER", "")
+    footer = get_setting("email_footer", "")
     if footer:
         body = f"{body}\n\n{footer}"
     msg.set_content(body)
 
-    sender_name = os.getenv("EMAIL_SENDER_NAME", "Vest Media")
-    use_trainer = os.getenv("EMAIL_USE_TRAINER_NAME", "0").lower() in {"1", "true", "yes"}
+    sender_name = get_setting("email_sender_name", "Vest Media")
+    use_trainer = get_setting_bool("email_use_trainer_name")
     if use_trainer and trainer is not None:
         try:
             sender_name = f"{trainer.imie} {trainer.nazwisko}"
         except Exception:
             pass
-    login = os.getenv("EMAIL_LOGIN")
+    login = get_setting("email_login")
     msg["From"] = f"{sender_name} <{login}>"
     msg["To"] = odbiorca
 
@@ -375,10 +418,11 @@ def email_do_koordynatora(
         raise
 
 
-def send_attendance_list(zajecie, queue: bool = False) -> bool:
+def send_attendance_list(zajecie, queue: bool | None = None) -> bool:
     """Generate and e-mail the attendance list for ``zajecie``.
 
-    Returns ``True`` on success, ``False`` when sending fails."""
+    Returns ``True`` once the message is sent (or stored in the outbox when
+    queued), ``False`` when sending fails."""
 
     prow = zajecie.prowadzacy
     obecni = [u.imie_nazwisko for u in zajecie.obecni]
@@ -420,22 +464,22 @@ def send_plain_email(
     body_key: str,
     default_subject: str,
     default_body: str,
-    queue: bool = False,
+    queue: bool | None = None,
     **fmt,
 ) -> None:
-    """Send a simple text e-mail using templates from environment variables."""
-    subject_tmpl = os.getenv(subject_key, default_subject)
+    """Send a simple text e-mail using templates from settings."""
+    subject_tmpl = get_setting(subject_key, default_subject)
     subject = safe_format(subject_tmpl, **fmt)
-    body_tmpl = os.getenv(body_key, default_body)
+    body_tmpl = get_setting(body_key, default_body)
     body = safe_format(body_tmpl, **fmt)
     msg = EmailMessage()
     msg["Subject"] = subject
-    footer = os.getenv("EMAIL_FOOTER", "")
+    footer = get_setting("email_footer", "")
     if footer:
         body = f"{body}\n\n{footer}"
     msg.set_content(body)
-    sender_name = os.getenv("EMAIL_SENDER_NAME", "Vest Media")
-    login = os.getenv("EMAIL_LOGIN")
+    sender_name = get_setting("email_sender_name", "Vest Media")
+    login = get_setting("email_login")
     msg["From"] = f"{sender_name} <{login}>"
     msg["To"] = to_addr
 
@@ -446,12 +490,60 @@ def send_plain_email(
         raise
 
 
+_rembg_remove = None
+_rembg_loaded = False
+
+
+def _load_rembg():
+    """Import ``rembg`` on first use; it pulls in onnxruntime and its models.
+
+    Returns the ``remove`` function or ``None`` when rembg is unavailable.
+    """
+    global _rembg_remove, _rembg_loaded
+    if not _rembg_loaded:
+        try:
+            from rembg import remove as _rembg_remove  # type: ignore
+        except Exception:  # rembg is optional
+            _rembg_remove = None
+        _rembg_loaded = True
+    return _rembg_remove
+
+
+def _signature_max_width_px() -> int:
+    return round(SIGNATURE_MAX_WIDTH_CM / 2.54 * SIGNATURE_DPI)
+
+
+def _downscale_signature(img: Image.Image) -> Image.Image:
+    """Shrink ``img`` to the widest size it is ever embedded at."""
+    max_width = _signature_max_width_px()
+    if img.width <= max_width:
+        return img
+    height = max(1, round(img.height * max_width / img.width))
+    if img.mode in ("1", "P"):
+        img = img.convert("RGBA")
+    return img.resize((max_width, height), Image.Resampling.LANCZOS)
+
+
+def _clear_white_background(img: Image.Image) -> Image.Image:
+    """Make near-white pixels (all channels above 250) transparent white.
+
+    Works on whole bands instead of individual pixels.
+    """
+    r, g, b, a = img.convert("RGBA").split()
+    near_white = [band.point(lambda v: 255 if v > 250 else 0) for band in (r, g, b)]
+    white = ImageChops.multiply(ImageChops.multiply(near_white[0], near_white[1]), near_white[2])
+    r, g, b = (ImageChops.lighter(band, white) for band in (r, g, b))
+    a = ImageChops.subtract(a, white)
+    return Image.merge("RGBA", (r, g, b, a))
+
+
 def process_signature(file):
     """Process an uploaded signature image and save it to ``static/`` as PNG.
 
     ``file`` should be a file-like object positioned at the start. A random
-    filename is generated and returned. When ``REMOVE_SIGNATURE_BG`` is enabled,
-    white background is removed using ``rembg`` when available.
+    filename is generated and returned. The image is downscaled to the largest
+    width it is embedded at in documents. When ``REMOVE_SIGNATURE_BG`` is
+    enabled, white background is removed using ``rembg`` when available.
     """
 
     filename = f"{uuid.uuid4().hex}.png"
@@ -459,18 +551,15 @@ def process_signature(file):
     try:
         file.seek(0)
         img = Image.open(file)
+        # JPEG scans can be decoded at a reduced scale straight away.
+        max_width = _signature_max_width_px()
+        img.draft("RGB", (max_width, max_width))
+        img = _downscale_signature(img)
         if REMOVE_SIGNATURE_BG:
+            rembg_remove = _load_rembg()
             if rembg_remove:
                 img = rembg_remove(img)
-            img = img.convert("RGBA")
-            datas = img.getdata()
-            new_data = []
-            for item in datas:
-                if item[0] > 250 and item[1] > 250 and item[2] > 250:
-                    new_data.append((255, 255, 255, 0))
-                else:
-                    new_data.append(item)
-            img.putdata(new_data)
+            img = _clear_white_background(img)
         img.save(path, format="PNG")
     except Exception:
         logger.exception("Failed to process signature image")
@@ -578,30 +667,110 @@ def create_trainer(data):
     return user, None
 
 
-def get_participant_stats(prow):
-    """Return sorted participants, sessions, stats map and total session count."""
-    uczestnicy = sorted(prow.uczestnicy, key=lambda x: x.imie_nazwisko.lower())
-    zajecia = (
-        Zajecia.query.filter_by(prowadzacy_id=prow.id)
-        .order_by(Zajecia.data.desc())
-        .all()
-    )
-    total_sessions = len(zajecia)
+def get_attendance_stats(prowadzacy_id, uczestnicy, total_sessions=None):
+    """Return attendance stats for ``uczestnicy`` of the given trainer.
+
+    Counts are read from the ``participant_stats`` and ``trainer_stats``
+    tables maintained by :mod:`utils.stats`. ``total_sessions`` is looked up
+    unless supplied. Returns a ``(stats, total_sessions)`` tuple where
+    ``stats`` maps participant id to a dict with ``uczestnik``, ``present``
+    and ``percent`` keys.
+    """
+    if total_sessions is None:
+        total_sessions = get_session_count(prowadzacy_id)
+    present_counts = {}
+    if uczestnicy:
+        present_counts = dict(
+            db.session.query(ParticipantStats.uczestnik_id, ParticipantStats.present)
+            .filter(ParticipantStats.uczestnik_id.in_([u.id for u in uczestnicy]))
+            .all()
+        )
     stats = {}
     for u in uczestnicy:
-        present = sum(1 for z in u.zajecia if z.prowadzacy_id == prow.id)
+        present = present_counts.get(u.id, 0)
         percent = (present / total_sessions * 100) if total_sessions else 0
         stats[u.id] = {"uczestnik": u, "present": present, "percent": percent}
-    return uczestnicy, zajecia, stats, total_sessions
+    return stats, total_sessions
+
+
+def get_session_count(prowadzacy_id: int | None = None) -> int:
+    """Return how many sessions the trainer (or everyone) has held in total."""
+    query = db.session.query(db.func.coalesce(db.func.sum(TrainerStats.sessions), 0))
+    if prowadzacy_id is not None:
+        query = query.filter(TrainerStats.prowadzacy_id == prowadzacy_id)
+    return query.scalar()
+
+
+def get_last_session_dates() -> dict[int, datetime]:
+    """Return the date of each trainer's most recent session."""
+    return dict(
+        db.session.query(TrainerStats.prowadzacy_id, db.func.max(TrainerStats.last_session))
+        .group_by(TrainerStats.prowadzacy_id)
+        .all()
+    )
+
+
+def get_last_session(prowadzacy_id: int):
+    """Return the trainer's most recent session or ``None``."""
+    return (
+        Zajecia.query.filter_by(prowadzacy_id=prowadzacy_id)
+        .order_by(Zajecia.data.desc())
+        .limit(1)
+        .first()
+    )
 
 
-def get_monthly_summary(zajecia):
-    """Return a dictionary summarizing hours for each (year, month)."""
-    summary = defaultdict(float)
-    for z in zajecia:
-        key = (z.data.year, z.data.month)
-        summary[key] += z.czas_trwania
-    return summary
+def month_window(month: int, year: int) -> tuple[datetime, datetime]:
+    """Return the half-open ``[start, end)`` datetime range of a month."""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def in_month(column, month: int, year: int):
+    """SQL predicate selecting ``column`` values within the given month.
+
+    Compares against the :func:`month_window` bounds rather than extracting
+    the month and year, so an index on ``column`` can be used.
+    """
+    start, end = month_window(month, year)
+    return db.and_(column >= start, column < end)
+
+
+def get_month_sessions(prowadzacy_id: int, month: int, year: int):
+    """Return the trainer's sessions from the given month ordered by date."""
+    return (
+        Zajecia.query.filter(
+            Zajecia.prowadzacy_id == prowadzacy_id,
+            in_month(Zajecia.data, month, year),
+        )
+        .order_by(Zajecia.data)
+        .all()
+    )
+
+
+def get_month_hours(prowadzacy_id: int, month: int, year: int) -> float:
+    """Return the trainer's total session hours in the given month."""
+    return (
+        db.session.query(db.func.coalesce(db.func.sum(Zajecia.czas_trwania), 0.0))
+        .filter(
+            Zajecia.prowadzacy_id == prowadzacy_id,
+            in_month(Zajecia.data, month, year),
+        )
+        .scalar()
+    )
+
+
+def get_monthly_summary(prowadzacy_id: int) -> dict[tuple[int, int], float]:
+    """Return the trainer's hours for each (year, month) with sessions."""
+    rows = (
+        db.session.query(TrainerStats.year, TrainerStats.month, TrainerStats.hours)
+        .filter(TrainerStats.prowadzacy_id == prowadzacy_id)
+        .all()
+    )
+    return {(year, month): hours for year, month, hours in rows}
 
 
+# atexit runs handlers in reverse order: stop the outbox worker before closing SMTP.
+atexit.register(close_smtp_pool)
 atexit.register(shutdown_email_worker)
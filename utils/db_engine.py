@@ -0,0 +1,81 @@
+import logging
+from functools import partial
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from model import db
+from utils.settings import get_setting_bool, get_setting_int
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the SQLite profile; each can be overridden with the upper-case
+# environment variable of the same name.
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_MMAP_SIZE = 256 * 2**20
+SQLITE_CACHE_KB = 64000
+
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_RECYCLE = 1800
+
+
+def is_sqlite(uri: str) -> bool:
+    return make_url(uri).get_backend_name() == "sqlite"
+
+
+def engine_options(uri: str) -> dict:
+    """Return ``SQLALCHEMY_ENGINE_OPTIONS`` for the database at ``uri``.
+
+    SQLite is tuned per connection instead (see :func:`sqlite_pragmas`); other
+    backends get a connection pool sized from the ``DB_POOL_SIZE``,
+    ``DB_MAX_OVERFLOW`` and ``DB_POOL_RECYCLE`` settings. The engine is created
+    before the Setting table is read, so these come from the environment.
+    """
+    if is_sqlite(uri):
+        return {}
+    return {
+        "pool_size": get_setting_int("db_pool_size", DB_POOL_SIZE),
+        "max_overflow": get_setting_int("db_max_overflow", DB_MAX_OVERFLOW),
+        "pool_recycle": get_setting_int("db_pool_recycle", DB_POOL_RECYCLE),
+        "pool_pre_ping": True,
+    }
+
+
+def sqlite_pragmas() -> dict[str, str | int]:
+    """PRAGMA values applied to every new SQLite connection, in order."""
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": get_setting_int("sqlite_busy_timeout_ms", SQLITE_BUSY_TIMEOUT_MS),
+        "mmap_size": get_setting_int("sqlite_mmap_size", SQLITE_MMAP_SIZE),
+        # Negative values are in KiB rather than pages.
+        "cache_size": -get_setting_int("sqlite_cache_kb", SQLITE_CACHE_KB),
+        "foreign_keys": "ON" if get_setting_bool("sqlite_foreign_keys", True) else "OFF",
+    }
+
+
+def _apply_pragmas(pragmas, dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def init_engine(app) -> None:
+    """Apply the SQLite tuning profile to every connection of ``db.engine``.
+
+    Must run right after ``db.init_app`` so that no connection is opened
+    before the listener is in place. WAL lets readers proceed while another
+    worker writes, and the busy timeout makes concurrent writers wait for the
+    lock instead of failing with "database is locked".
+    """
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas()
+    event.listen(engine, "connect", partial(_apply_pragmas, pragmas))
+    logger.debug("SQLite connection pragmas: %s", pragmas)
@@ -0,0 +1,293 @@
+"""Background polling of KSeF processing status for uploaded invoices.
+
+Web requests upload an invoice and return; the outcome is tracked in a
+:class:`~model.KSeFInvoice` row. A thread in each worker process (or
+``flask poll-ksef`` from cron) leases due rows, fetches their status and
+records the final status and KSeF number. Polls back off from about a second
+to ``BACKGROUND_POLL_MAX_SECONDS``. When an invoice ends up rejected or
+expired, the invoice number reserved at upload is released for the next
+invoice and the report recipient, who already has its PDF, is e-mailed.
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_, update
+
+from ksef_client import (
+    INVOICE_FINAL_STATUS_CODES,
+    POLL_BACKOFF_FACTOR,
+    SESSION_FINAL_STATUS_CODES,
+    KSeFException,
+    KSeFSendResult,
+    get_ksef_client,
+    resolve_ksef_token,
+)
+from model import db, KSeFInvoice
+from utils.settings import get_setting, settings
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 120
+BACKGROUND_POLL_INITIAL_SECONDS = 1.0
+BACKGROUND_POLL_MAX_SECONDS = 300.0
+# Invoices still processing after this long are marked ``expired``.
+POLL_TIMEOUT = timedelta(hours=24)
+POLLER_IDLE_SECONDS = 30.0
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def next_poll_delay(polls: int) -> timedelta:
+    """Pause before the next background poll after ``polls`` polls."""
+    seconds = BACKGROUND_POLL_INITIAL_SECONDS * POLL_BACKOFF_FACTOR ** max(polls - 1, 0)
+    return timedelta(seconds=min(seconds, BACKGROUND_POLL_MAX_SECONDS))
+
+
+def _is_final(result: KSeFSendResult) -> bool:
+    # A session processed with 200 says nothing about this invoice.
+    return result.invoice_status_code in INVOICE_FINAL_STATUS_CODES or (
+        result.session_status_code in SESSION_FINAL_STATUS_CODES
+        and result.session_status_code != 200
+    )
+
+
+def _apply_result(row: KSeFInvoice, result: KSeFSendResult) -> None:
+    row.status_code = result.invoice_status_code or result.session_status_code
+    row.status_description = (
+        result.invoice_status_description or result.session_status_description
+    )
+    row.ksef_number = result.ksef_number or row.ksef_number
+    if _is_final(result):
+        row.status = "accepted" if result.success else "rejected"
+        row.completed_at = datetime.utcnow()
+
+
+def record_submission(
+    result: KSeFSendResult,
+    invoice_number: str,
+    prowadzacy_id: int | None = None,
+    environment: str | None = None,
+    reserved_counter: int | None = None,
+) -> KSeFInvoice:
+    """Store an uploaded invoice with whatever status is known and commit.
+
+    ``reserved_counter`` is the invoice counter value taken for the upload;
+    it is released if the invoice ends up rejected or expired.
+    """
+    row = KSeFInvoice(
+        invoice_number=invoice_number,
+        prowadzacy_id=prowadzacy_id,
+        reserved_counter=reserved_counter,
+        environment=environment or get_setting("ksef_environment", "demo"),
+        session_reference_number=result.session_reference_number,
+        invoice_reference_number=result.invoice_reference_number,
+        status="pending",
+        next_poll_at=datetime.utcnow(),
+    )
+    _apply_result(row, result)
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def _lease_available(now: datetime):
+    return or_(KSeFInvoice.leased_until.is_(None), KSeFInvoice.leased_until < now)
+
+
+def claim_due(limit: int = 20, owner: str | None = None) -> list[int]:
+    """Lease up to ``limit`` pending invoices due for a poll and return their ids."""
+    owner = owner or _worker_id()
+    now = datetime.utcnow()
+    candidates = (
+        db.session.query(KSeFInvoice.id)
+        .filter(
+            KSeFInvoice.status == "pending",
+            KSeFInvoice.next_poll_at <= now,
+            _lease_available(now),
+        )
+        .order_by(KSeFInvoice.next_poll_at, KSeFInvoice.id)
+        .limit(limit)
+        .all()
+    )
+    claimed = []
+    for (row_id,) in candidates:
+        result = db.session.execute(
+            update(KSeFInvoice)
+            .where(
+                KSeFInvoice.id == row_id,
+                KSeFInvoice.status == "pending",
+                _lease_available(now),
+            )
+            .values(lease_owner=owner, leased_until=now + timedelta(seconds=LEASE_SECONDS))
+        )
+        if result.rowcount == 1:
+            claimed.append(row_id)
+    db.session.commit()
+    return claimed
+
+
+def _client_for(environment: str):
+    nip = get_setting("ksef_nip", "")
+    token = resolve_ksef_token(environment)
+    if not nip or not token:
+        raise KSeFException("KSeF credentials not configured")
+    return get_ksef_client(environment, nip, token)
+
+
+def _release_number(row: KSeFInvoice) -> None:
+    """Give back the invoice number the upload of ``row`` reserved."""
+    from ksef_invoice import release_invoice_counter
+
+    if row.reserved_counter is None:
+        return
+    try:
+        release_invoice_counter(row.reserved_counter)
+    except Exception:
+        logger.exception("Could not release invoice number %s", row.invoice_number)
+        db.session.rollback()
+    else:
+        logger.info("Invoice number %s released", row.invoice_number)
+
+
+def _notify_failure(row: KSeFInvoice) -> None:
+    """Tell the report recipient that an invoice they were sent was not accepted."""
+    from utils import send_plain_email
+
+    recipient = get_setting("email_recipient")
+    if not recipient:
+        return
+    try:
+        send_plain_email(
+            recipient,
+            "email_ksef_failed_subject",
+            "email_ksef_failed_body",
+            "Faktura {invoice_number} nie została przyjęta przez KSeF",
+            "Faktura {invoice_number} wysłana w raporcie miesięcznym ma w KSeF status"
+            " {status}: {description}\nFaktura nie jest wystawiona.",
+            queue=True,
+            invoice_number=row.invoice_number,
+            status=row.status,
+            description=row.status_description or "brak opisu",
+        )
+    except Exception:
+        logger.exception("Could not report KSeF invoice %s", row.invoice_number)
+
+
+def poll_invoice(row: KSeFInvoice) -> None:
+    """Fetch the status of ``row`` once, record it and release the lease."""
+    try:
+        client = _client_for(row.environment)
+        # With no time left the wait makes exactly one (concurrent) status fetch.
+        result = client.wait_for_invoice_processing(
+            row.session_reference_number, row.invoice_reference_number, timeout_seconds=0
+        )
+    except Exception as exc:
+        logger.warning("Polling KSeF invoice %s failed: %s", row.invoice_number, exc)
+        row.status_description = str(exc) or exc.__class__.__name__
+    else:
+        _apply_result(row, result)
+    row.polls += 1
+    now = datetime.utcnow()
+    if row.status == "pending":
+        if row.created_at and now - row.created_at > POLL_TIMEOUT:
+            row.status = "expired"
+            row.completed_at = now
+            logger.error("KSeF invoice %s still not processed, giving up", row.invoice_number)
+        else:
+            row.next_poll_at = now + next_poll_delay(row.polls)
+    else:
+        logger.info(
+            "KSeF invoice %s %s: %s %s",
+            row.invoice_number,
+            row.status,
+            row.ksef_number or "",
+            row.status_description or "",
+        )
+    row.lease_owner = None
+    row.leased_until = None
+    db.session.commit()
+    if row.status in ("rejected", "expired"):
+        _release_number(row)
+        _notify_failure(row)
+
+
+def poll_pending_invoices(limit: int = 20) -> int:
+    """Poll one batch of due invoices and return how many were polled."""
+    ids = claim_due(limit)
+    for row_id in ids:
+        row = db.session.get(KSeFInvoice, row_id)
+        if row is not None:
+            poll_invoice(row)
+    return len(ids)
+
+
+def seconds_until_next_poll() -> float | None:
+    """Seconds until the earliest pending invoice is due, ``None`` if none is pending."""
+    due = (
+        db.session.query(func.min(KSeFInvoice.next_poll_at))
+        .filter(KSeFInvoice.status == "pending")
+        .scalar()
+    )
+    if due is None:
+        return None
+    return max((due - datetime.utcnow()).total_seconds(), 0.0)
+
+
+_poller: threading.Thread | None = None
+_poller_stop = threading.Event()
+_poller_wake = threading.Event()
+
+
+def _poller_loop(app) -> None:
+    """Background thread polling pending invoices until :func:`shutdown_ksef_poller`."""
+    while True:
+        with app.app_context():
+            try:
+                settings.maybe_refresh()
+                polled = poll_pending_invoices()
+                wait = seconds_until_next_poll()
+            except Exception:
+                logger.exception("KSeF status poller failed")
+                db.session.rollback()
+                polled, wait = 0, POLLER_IDLE_SECONDS
+        if polled:
+            continue
+        if _poller_stop.is_set():
+            break
+        _poller_wake.wait(POLLER_IDLE_SECONDS if wait is None else min(wait, POLLER_IDLE_SECONDS))
+        _poller_wake.clear()
+
+
+def start_ksef_poller() -> None:
+    """Make sure this process polls pending invoices and wake it up."""
+    global _poller
+    if _poller is None or not _poller.is_alive():
+        _poller_stop.clear()
+        _poller = threading.Thread(
+            target=_poller_loop,
+            args=(current_app._get_current_object(),),
+            name="ksef-poller",
+            daemon=True,
+        )
+        _poller.start()
+    _poller_wake.set()
+
+
+def shutdown_ksef_poller() -> None:
+    """Stop the background poller after its current round."""
+    global _poller
+    if _poller and _poller.is_alive():
+        _poller_stop.set()
+        _poller_wake.set()
+        _poller.join()
+    _poller = None
+
+
+atexit.register(shutdown_ksef_poller)
@@ -0,0 +1,131 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+from typing import Callable
+
+from sqlalchemy import or_, update
+
+from model import db, EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+MAX_ATTEMPTS = 6
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff after ``attempts`` failed deliveries."""
+    seconds = BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, BACKOFF_MAX_SECONDS))
+
+
+def enqueue_email(msg: EmailMessage) -> EmailOutbox:
+    """Store ``msg`` in the outbox and commit; delivery happens later."""
+    row = EmailOutbox(
+        message=msg.as_bytes(),
+        recipient=msg.get("To"),
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def _lease_available(now: datetime):
+    return or_(EmailOutbox.leased_until.is_(None), EmailOutbox.leased_until < now)
+
+
+def claim_batch(limit: int = 20, owner: str | None = None) -> list[int]:
+    """Lease up to ``limit`` due messages for this worker and return their ids.
+
+    Each row is claimed with a conditional ``UPDATE`` so that several processes
+    can drain the same outbox without sending a message twice.
+    """
+    owner = owner or _worker_id()
+    now = datetime.utcnow()
+    candidates = (
+        db.session.query(EmailOutbox.id)
+        .filter(
+            EmailOutbox.status == "pending",
+            EmailOutbox.next_attempt_at <= now,
+            _lease_available(now),
+        )
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+        .all()
+    )
+    claimed = []
+    for (row_id,) in candidates:
+        result = db.session.execute(
+            update(EmailOutbox)
+            .where(
+                EmailOutbox.id == row_id,
+                EmailOutbox.status == "pending",
+                _lease_available(now),
+            )
+            .values(lease_owner=owner, leased_until=now + timedelta(seconds=LEASE_SECONDS))
+        )
+        if result.rowcount == 1:
+            claimed.append(row_id)
+    db.session.commit()
+    return claimed
+
+
+def _deliver(row: EmailOutbox, send: Callable[[EmailMessage], None]) -> None:
+    msg = message_from_bytes(row.message, policy=policy.default)
+    try:
+        send(msg)
+    except Exception as exc:
+        row.attempts += 1
+        row.last_error = str(exc) or exc.__class__.__name__
+        if row.attempts >= MAX_ATTEMPTS:
+            row.status = "dead"
+            logger.error(
+                "Giving up on e-mail %s to %s after %s attempts: %s",
+                row.id, row.recipient, row.attempts, row.last_error,
+            )
+        else:
+            row.next_attempt_at = datetime.utcnow() + retry_delay(row.attempts)
+            logger.warning(
+                "E-mail %s to %s failed (attempt %s), retrying at %s: %s",
+                row.id, row.recipient, row.attempts, row.next_attempt_at, row.last_error,
+            )
+    else:
+        row.status = "sent"
+        row.sent_at = datetime.utcnow()
+    row.lease_owner = None
+    row.leased_until = None
+    db.session.commit()
+
+
+def drain_outbox(send: Callable[[EmailMessage], None], limit: int = 20) -> int:
+    """Deliver one batch of due messages and return how many were attempted."""
+    ids = claim_batch(limit)
+    for row_id in ids:
+        row = db.session.get(EmailOutbox, row_id)
+        if row is not None:
+            _deliver(row, send)
+    return len(ids)
+
+
+def requeue_dead() -> int:
+    """Move dead-lettered messages back to ``pending`` with a fresh attempt count."""
+    count = EmailOutbox.query.filter_by(status="dead").update(
+        {
+            EmailOutbox.status: "pending",
+            EmailOutbox.attempts: 0,
+            EmailOutbox.next_attempt_at: datetime.utcnow(),
+        }
+    )
+    db.session.commit()
+    return count
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from model import Zajecia
+
+CURSOR_FORMAT = "%Y%m%dT%H%M%S%f"
+# Stands for a missing ``data``; such sessions are listed after all dated ones.
+NO_DATE = "none"
+
+
+def encode_cursor(zajecia: Zajecia) -> str:
+    """Return an opaque, URL-safe position of ``zajecia`` in the session list."""
+    data = zajecia.data.strftime(CURSOR_FORMAT) if zajecia.data is not None else NO_DATE
+    return f"{data}-{zajecia.id}"
+
+
+def decode_cursor(value: str | None) -> tuple[datetime | None, int] | None:
+    """Parse a cursor made by :func:`encode_cursor`; ``None`` if malformed."""
+    if not value:
+        return None
+    try:
+        data, _, session_id = value.partition("-")
+        if data == NO_DATE:
+            return None, int(session_id)
+        return datetime.strptime(data, CURSOR_FORMAT), int(session_id)
+    except ValueError:
+        return None
+
+
+def _newer_than(data: datetime | None, session_id: int):
+    """Rows listed before the cursor ``(data, session_id)``."""
+    if data is None:
+        return or_(Zajecia.data.is_not(None), Zajecia.id > session_id)
+    return or_(Zajecia.data > data, and_(Zajecia.data == data, Zajecia.id > session_id))
+
+
+def _older_than(data: datetime | None, session_id: int):
+    """Rows listed after the cursor ``(data, session_id)``."""
+    if data is None:
+        return and_(Zajecia.data.is_(None), Zajecia.id < session_id)
+    return or_(
+        Zajecia.data < data,
+        and_(Zajecia.data == data, Zajecia.id < session_id),
+        Zajecia.data.is_(None),
+    )
+
+
+@dataclass
+class SessionPage:
+    """One page of sessions, newest first, addressed by cursors."""
+
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+    total: int | None = None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+
+def paginate_sessions(
+    query,
+    after: str | None = None,
+    before: str | None = None,
+    per_page: int = 10,
+    total: int | None = None,
+) -> SessionPage:
+    """Return the page of ``query`` after (or before) the given cursor.
+
+    Sessions are ordered by ``(data, id)`` descending and each page starts
+    from the boundary row's key instead of an ``OFFSET``, so with the
+    ``zajecia`` date indexes a page deep in the history costs the same as the
+    first one. Sessions without a date come last. No ``COUNT(*)`` is run;
+    pass ``total`` (e.g. from the stats tables) to show an approximate size.
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if after_key is None else None
+
+    if before_key is not None:
+        data, session_id = before_key
+        rows = (
+            query.filter(_newer_than(data, session_id))
+            .order_by(Zajecia.data.asc().nulls_first(), Zajecia.id.asc())
+            .limit(per_page + 1)
+            .all()
+        )
+        more_before = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return SessionPage(
+            items=items,
+            next_cursor=encode_cursor(items[-1]) if items else None,
+            prev_cursor=encode_cursor(items[0]) if more_before else None,
+            total=total,
+        )
+
+    if after_key is not None:
+        data, session_id = after_key
+        query = query.filter(_older_than(data, session_id))
+    rows = (
+        query.order_by(Zajecia.data.desc().nulls_last(), Zajecia.id.desc())
+        .limit(per_page + 1)
+        .all()
+    )
+    items = rows[:per_page]
+    return SessionPage(
+        items=items,
+        next_cursor=encode_cursor(items[-1]) if len(rows) > per_page else None,
+        prev_cursor=encode_cursor(items[0]) if after_key is not None and items else None,
+        total=total,
+    )
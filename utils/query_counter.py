@@ -0,0 +1,49 @@
+import logging
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+
+from model import db
+from utils.settings import get_setting_bool
+
+logger = logging.getLogger(__name__)
+
+HEADER_NAME = "X-Query-Count"
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "sql_query_count" in g:
+        g.sql_query_count += 1
+
+
+def _reset_counter() -> None:
+    g.sql_query_count = 0
+
+
+def _report_counter(response):
+    count = get_query_count()
+    logger.debug("SQL statements for this request: %s", count)
+    if current_app.config.get("QUERY_COUNT_HEADER"):
+        response.headers[HEADER_NAME] = str(count)
+    return response
+
+
+def get_query_count() -> int:
+    """Return the number of SQL statements issued in the current request."""
+    if not has_app_context():
+        return 0
+    return g.get("sql_query_count", 0)
+
+
+def init_query_counter(app) -> None:
+    """Count SQL statements executed while handling each request.
+
+    The total is logged at debug level and, when ``QUERY_COUNT_HEADER`` is
+    enabled, returned to the client in the ``X-Query-Count`` header.
+    """
+    app.config.setdefault("QUERY_COUNT_HEADER", get_setting_bool("query_count_header"))
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _count_query)
+    app.before_request(_reset_counter)
+    app.after_request(_report_counter)
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+from sqlalchemy.exc import OperationalError
+
+from model import db, Setting
+
+logger = logging.getLogger(__name__)
+
+# Setting row whose value changes whenever any other setting is saved.
+VERSION_KEY = "settings_version"
+TRUE_VALUES = {"1", "true", "yes"}
+
+_overrides: ContextVar[dict[str, str]] = ContextVar("setting_overrides", default={})
+
+
+class SettingsCache:
+    """Process-local copy of the :class:`~model.Setting` table.
+
+    Values are looked up by the lower-case setting key. Keys missing from the
+    table fall back to the upper-case environment variable, so deployment
+    configuration (``.env``) still works. Other processes notice changes
+    through the ``settings_version`` row, polled at most once per
+    ``check_interval`` seconds.
+    """
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self._values: dict[str, str] = {}
+        self._version: str | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[], None]] = []
+
+    def on_reload(self, callback: Callable[[], None]) -> None:
+        """Call ``callback`` after every reload, e.g. to refresh derived values."""
+        self._listeners.append(callback)
+
+    def _replace(self, values: dict[str, str], version: str | None) -> None:
+        with self._lock:
+            self._values = values
+            self._version = version
+            self._checked_at = time.monotonic()
+        for callback in self._listeners:
+            callback()
+
+    def load(self) -> None:
+        """Read every setting from the database (requires an app context)."""
+        try:
+            rows = db.session.query(Setting.key, Setting.value).all()
+        except OperationalError:
+            logger.warning("Settings table missing, skipping load.")
+            db.session.rollback()
+            rows = []
+        values = {key.lower(): value for key, value in rows if value is not None}
+        self._replace(values, values.get(VERSION_KEY))
+
+    def prime(self, values: dict[str, str]) -> None:
+        """Install a snapshot taken in another process (see :meth:`snapshot`)."""
+        self._replace(dict(values), values.get(VERSION_KEY))
+
+    def snapshot(self) -> dict[str, str]:
+        with self._lock:
+            return dict(self._values)
+
+    def maybe_refresh(self) -> None:
+        """Reload if another process changed settings; cheap between checks."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            version = db.session.query(Setting.value).filter_by(key=VERSION_KEY).scalar()
+        except OperationalError:
+            db.session.rollback()
+            return
+        if version != self._version:
+            logger.info("Settings changed in another process, reloading")
+            self.load()
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        key = key.lower()
+        overrides = _overrides.get()
+        if key in overrides:
+            return overrides[key]
+        value = self._values.get(key)
+        if value is None:
+            value = os.environ.get(key.upper())
+        return default if value is None else value
+
+    def items(self, prefix: str = "") -> dict[str, str]:
+        """Return all known settings (environment and table) starting with ``prefix``."""
+        merged = {
+            key.lower(): value
+            for key, value in os.environ.items()
+            if key.lower().startswith(prefix)
+        }
+        merged.update(
+            (key, value) for key, value in self.snapshot().items() if key.startswith(prefix)
+        )
+        merged.update(
+            (key, value) for key, value in _overrides.get().items() if key.startswith(prefix)
+        )
+        return merged
+
+
+settings = SettingsCache(
+    check_interval=float(os.getenv("SETTINGS_CHECK_INTERVAL", "5")),
+)
+
+
+def get_setting(key: str, default: str | None = None) -> str | None:
+    """Return setting ``key`` (e.g. ``"smtp_host"``) as a string."""
+    return settings.get(key, default)
+
+
+def get_setting_bool(key: str, default: bool = False) -> bool:
+    value = settings.get(key)
+    if value is None:
+        return default
+    return value.strip().lower() in TRUE_VALUES
+
+
+def get_setting_int(key: str, default: int | None = None) -> int | None:
+    value = settings.get(key)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def get_setting_float(key: str, default: float | None = None) -> float | None:
+    value = settings.get(key)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def save_settings(values: dict[str, str]) -> None:
+    """Stage ``values`` in the Setting table and bump the settings version.
+
+    The caller commits; call :func:`reload_settings` afterwards so this
+    process sees the change immediately.
+    """
+    for key, value in values.items():
+        setting = db.session.get(Setting, key)
+        if setting:
+            setting.value = value
+        else:
+            db.session.add(Setting(key=key, value=value))
+    version = db.session.get(Setting, VERSION_KEY)
+    if version:
+        version.value = uuid.uuid4().hex
+    else:
+        db.session.add(Setting(key=VERSION_KEY, value=uuid.uuid4().hex))
+
+
+def reload_settings() -> None:
+    settings.load()
+
+
+def prime_settings(values: dict[str, str]) -> None:
+    """Process-pool initializer installing the parent's settings snapshot."""
+    settings.prime(values)
+
+
+@contextmanager
+def override_setting(key: str, value: str | None):
+    """Temporarily replace ``key`` in the current context; ``None`` is a no-op."""
+    if value is None:
+        yield
+        return
+    token = _overrides.set({**_overrides.get(), key.lower(): value})
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+
+def init_settings(app) -> None:
+    """Load settings and check for changes before each request.
+
+    Registered before the query counter so the version check is not counted
+    against the request.
+    """
+    with app.app_context():
+        settings.load()
+    app.before_request(settings.maybe_refresh)
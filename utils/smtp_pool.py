@@ -0,0 +1,135 @@
+import logging
+import smtplib
+import threading
+import time
+
+from utils.settings import get_setting_float, get_setting_int
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection is discarded and the send retried once.
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class SMTPConnectionPool:
+    """Keep authenticated SMTP connections open between messages.
+
+    Idle connections are checked with ``NOOP`` before reuse once they have
+    been idle for ``noop_after`` seconds and are dropped after ``max_idle``
+    seconds, since most servers close quiet sessions on their own. The pool
+    is shared by the background e-mail worker and synchronous sends.
+    """
+
+    def __init__(self, max_size: int = 2, noop_after: float = 10.0, max_idle: float = 240.0):
+        self.max_size = max_size
+        self.noop_after = noop_after
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: list[tuple[tuple, smtplib.SMTP, float]] = []
+
+    @staticmethod
+    def _connect(settings: tuple) -> smtplib.SMTP:
+        host, port, login, password = settings
+        if port == 465:
+            smtp = smtplib.SMTP_SSL(host, port)
+        else:
+            smtp = smtplib.SMTP(host, port)
+            smtp.starttls()
+        try:
+            smtp.login(login, password)
+        except Exception:
+            _close(smtp)
+            raise
+        logger.debug("Opened SMTP connection to %s:%s", host, port)
+        return smtp
+
+    def _is_alive(self, smtp: smtplib.SMTP) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except _CONNECTION_ERRORS + (smtplib.SMTPException,):
+            return False
+
+    def _acquire(self, settings: tuple) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                key, smtp, released = self._idle.pop()
+            idle_for = time.monotonic() - released
+            if key != settings or idle_for > self.max_idle:
+                _close(smtp)
+            elif idle_for < self.noop_after or self._is_alive(smtp):
+                return smtp
+            else:
+                _close(smtp)
+        return self._connect(settings)
+
+    def _release(self, settings: tuple, smtp: smtplib.SMTP) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((settings, smtp, time.monotonic()))
+                return
+        _close(smtp)
+
+    def send(self, msg, settings: tuple) -> None:
+        """Send ``msg`` on a pooled connection, reconnecting once if it dropped."""
+        smtp = self._acquire(settings)
+        try:
+            smtp.send_message(msg)
+        except _CONNECTION_ERRORS:
+            _close(smtp)
+            logger.info("SMTP connection lost, reconnecting")
+            smtp = self._connect(settings)
+            try:
+                smtp.send_message(msg)
+            except BaseException:
+                _close(smtp)
+                raise
+        except smtplib.SMTPException:
+            # The session is still usable, e.g. after a refused recipient.
+            self._release(settings, smtp)
+            raise
+        except BaseException:
+            _close(smtp)
+            raise
+        self._release(settings, smtp)
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _key, smtp, _released in idle:
+            _close(smtp)
+
+
+def _close(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.quit()
+    except Exception:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+
+_pool: SMTPConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    """Return the process-wide pool, configured from settings on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPConnectionPool(
+                max_size=get_setting_int("smtp_pool_size", 2),
+                noop_after=get_setting_float("smtp_noop_after", 10.0),
+                max_idle=get_setting_float("smtp_max_idle", 240.0),
+            )
+        return _pool
+
+
+def close_smtp_pool() -> None:
+    """Close pooled connections at interpreter exit."""
+    if _pool is not None:
+        _pool.close()
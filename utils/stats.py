@@ -0,0 +1,326 @@
+import logging
+from itertools import chain
+
+from datetime import datetime
+
+from sqlalchemy import and_, delete, event, extract, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import attributes
+
+from model import (
+    db,
+    obecnosci,
+    ParticipantStats,
+    ProjectHours,
+    TrainerStats,
+    Uczestnik,
+    Zajecia,
+)
+from utils import month_window
+from utils.settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+trainer_stats = TrainerStats.__table__
+participant_stats = ParticipantStats.__table__
+project_hours = ProjectHours.__table__
+
+PROJECT_HOURS_ID = 1
+# Incremental float updates may differ from a fresh SUM by rounding only.
+PROJECT_HOURS_TOLERANCE = 1e-6
+
+
+def refresh_trainer_months(conn, months) -> None:
+    """Recompute the :class:`~model.TrainerStats` rows of the given buckets."""
+    for trainer_id, year, month in months:
+        start, end = month_window(month, year)
+        conn.execute(
+            delete(trainer_stats).where(
+                trainer_stats.c.prowadzacy_id == trainer_id,
+                trainer_stats.c.year == year,
+                trainer_stats.c.month == month,
+            )
+        )
+        sessions, hours, last_session = conn.execute(
+            select(
+                func.count(Zajecia.id),
+                func.coalesce(func.sum(Zajecia.czas_trwania), 0.0),
+                func.max(Zajecia.data),
+            ).where(
+                Zajecia.prowadzacy_id == trainer_id,
+                Zajecia.data >= start,
+                Zajecia.data < end,
+            )
+        ).one()
+        if sessions:
+            conn.execute(
+                insert(trainer_stats).values(
+                    prowadzacy_id=trainer_id,
+                    year=year,
+                    month=month,
+                    sessions=sessions,
+                    hours=hours,
+                    last_session=last_session,
+                )
+            )
+
+
+def _present_counts():
+    """``SELECT`` of (participant, trainer, present) for attendance of own-trainer sessions."""
+    return (
+        select(
+            Uczestnik.id,
+            Uczestnik.prowadzacy_id,
+            func.count(Zajecia.id),
+        )
+        .select_from(Uczestnik)
+        .outerjoin(obecnosci, obecnosci.c.uczestnik_id == Uczestnik.id)
+        .outerjoin(
+            Zajecia,
+            and_(
+                Zajecia.id == obecnosci.c.zajecia_id,
+                Zajecia.prowadzacy_id == Uczestnik.prowadzacy_id,
+            ),
+        )
+        .group_by(Uczestnik.id, Uczestnik.prowadzacy_id)
+    )
+
+
+def refresh_participants(conn, participant_ids) -> None:
+    """Recompute the :class:`~model.ParticipantStats` rows of ``participant_ids``."""
+    ids = sorted(participant_ids)
+    if not ids:
+        return
+    conn.execute(delete(participant_stats).where(participant_stats.c.uczestnik_id.in_(ids)))
+    conn.execute(
+        insert(participant_stats).from_select(
+            ["uczestnik_id", "prowadzacy_id", "present"],
+            _present_counts().where(Uczestnik.id.in_(ids)),
+        )
+    )
+
+
+def refresh_stats(conn, months=(), participant_ids=()) -> None:
+    """Refresh stats after writes that bypass the ORM (e.g. bulk inserts)."""
+    refresh_trainer_months(conn, months)
+    refresh_participants(conn, participant_ids)
+
+
+def rebuild_stats() -> tuple[int, int]:
+    """Recompute both stats tables from scratch and commit.
+
+    Returns the number of trainer-month and participant rows written.
+    """
+    conn = db.session.connection()
+    year = extract("year", Zajecia.data)
+    month = extract("month", Zajecia.data)
+    conn.execute(delete(trainer_stats))
+    conn.execute(delete(participant_stats))
+    conn.execute(
+        insert(trainer_stats).from_select(
+            ["prowadzacy_id", "year", "month", "sessions", "hours", "last_session"],
+            select(
+                Zajecia.prowadzacy_id,
+                year,
+                month,
+                func.count(Zajecia.id),
+                func.coalesce(func.sum(Zajecia.czas_trwania), 0.0),
+                func.max(Zajecia.data),
+            )
+            .where(Zajecia.prowadzacy_id.is_not(None), Zajecia.data.is_not(None))
+            .group_by(Zajecia.prowadzacy_id, year, month),
+        )
+    )
+    conn.execute(
+        insert(participant_stats).from_select(
+            ["uczestnik_id", "prowadzacy_id", "present"], _present_counts()
+        )
+    )
+    counts = (
+        conn.execute(select(func.count()).select_from(trainer_stats)).scalar(),
+        conn.execute(select(func.count()).select_from(participant_stats)).scalar(),
+    )
+    db.session.commit()
+    logger.info("Rebuilt stats: %s trainer months, %s participants", *counts)
+    return counts
+
+
+def project_start() -> tuple[str, datetime | None]:
+    """Return ``project_start_date`` as (cache key, datetime).
+
+    A missing or invalid date counts every session, as the dashboard always
+    did, and is keyed as ``""``.
+    """
+    try:
+        start = datetime.strptime(get_setting("project_start_date", "") or "", "%Y-%m-%d")
+    except ValueError:
+        return "", None
+    return start.strftime("%Y-%m-%d"), start
+
+
+def count_project_hours(conn, start: datetime | None) -> float:
+    """Sum session hours since ``start`` straight from ``zajecia``."""
+    query = select(func.coalesce(func.sum(Zajecia.czas_trwania), 0.0))
+    if start is not None:
+        query = query.where(Zajecia.data >= start)
+    return float(conn.execute(query).scalar())
+
+
+def recount_project_hours() -> float:
+    """Store a fresh project-hours total for the current start date and commit."""
+    key, start = project_start()
+    used = count_project_hours(db.session.connection(), start)
+    row = db.session.get(ProjectHours, PROJECT_HOURS_ID)
+    if row is None:
+        db.session.add(ProjectHours(id=PROJECT_HOURS_ID, start_date=key, used_hours=used))
+    else:
+        row.start_date = key
+        row.used_hours = used
+    try:
+        db.session.commit()
+    except IntegrityError:  # another worker created the row first
+        db.session.rollback()
+    return used
+
+
+def get_project_used_hours() -> float:
+    """Return hours used since ``project_start_date`` from the cached counter.
+
+    The counter is recounted when missing or when it was counted from a
+    different start date.
+    """
+    key, _start = project_start()
+    row = db.session.get(ProjectHours, PROJECT_HOURS_ID)
+    if row is None or row.start_date != key:
+        return recount_project_hours()
+    return row.used_hours
+
+
+def check_project_hours(repair: bool = True) -> tuple[float | None, float]:
+    """Compare the cached counter with a fresh count; optionally repair it.
+
+    Returns ``(cached, actual)``; ``cached`` is ``None`` when the counter is
+    missing or was counted from another start date.
+    """
+    key, start = project_start()
+    row = db.session.get(ProjectHours, PROJECT_HOURS_ID)
+    cached = row.used_hours if row is not None and row.start_date == key else None
+    actual = count_project_hours(db.session.connection(), start)
+    if repair and (cached is None or abs(cached - actual) > PROJECT_HOURS_TOLERANCE):
+        recount_project_hours()
+    return cached, actual
+
+
+def _contribution(data, hours, start: datetime | None) -> float:
+    if data is None or (start is not None and data < start):
+        return 0.0
+    return hours or 0.0
+
+
+def _persisted_id(obj):
+    identity = attributes.instance_state(obj).identity
+    return identity[0] if identity else None
+
+
+def _before_flush(session, flush_context, instances) -> None:
+    """Remember the stored rows of sessions this flush updates or deletes.
+
+    Old values are read from the database rather than attribute history,
+    which lacks them when an expired object was modified.
+    """
+    ids = [
+        _persisted_id(obj)
+        for obj in chain(session.dirty, session.deleted)
+        if isinstance(obj, Zajecia) and (obj in session.deleted or session.is_modified(obj))
+    ]
+    ids = [i for i in ids if i is not None]
+    previous = []
+    attendees = set()
+    if ids:
+        conn = session.connection()
+        previous = conn.execute(
+            select(Zajecia.prowadzacy_id, Zajecia.data, Zajecia.czas_trwania).where(
+                Zajecia.id.in_(ids)
+            )
+        ).all()
+        attendees.update(
+            conn.execute(
+                select(obecnosci.c.uczestnik_id).where(obecnosci.c.zajecia_id.in_(ids))
+            ).scalars()
+        )
+    session.info["stats_previous"] = (previous, attendees)
+
+
+def changes(session) -> tuple[set, set, list, list]:
+    """Describe the flushed changes to sessions and participants.
+
+    Returns the affected (trainer, year, month) buckets and participant ids,
+    and the (trainer, date, hours) of sessions before and after the flush.
+    """
+    previous, participants = session.info.pop("stats_previous", ([], set()))
+    participants = set(participants)
+    current = []
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Zajecia) and (obj in session.new or session.is_modified(obj)):
+            current.append((obj.prowadzacy_id, obj.data, obj.czas_trwania))
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Zajecia):
+            history = attributes.instance_state(obj).get_history(
+                "obecni", attributes.PASSIVE_NO_INITIALIZE
+            )
+            participants.update(_persisted_id(u) or u.id for u in history.sum())
+        elif isinstance(obj, Uczestnik):
+            participants.add(_persisted_id(obj) or obj.id)
+    participants.discard(None)
+    months = {
+        (trainer_id, data.year, data.month)
+        for trainer_id, data, _hours in chain(previous, current)
+        if trainer_id is not None and data is not None
+    }
+    return months, participants, previous, current
+
+
+def adjust_project_hours(conn, previous=(), current=()) -> None:
+    """Move the project-hours counter by the difference between session rows.
+
+    ``previous`` and ``current`` are (trainer, date, hours) tuples of the
+    sessions before and after a write; pass only ``current`` for inserts.
+    """
+    key, start = project_start()
+    delta = sum(_contribution(data, hours, start) for _t, data, hours in current) - sum(
+        _contribution(data, hours, start) for _t, data, hours in previous
+    )
+    if not delta:
+        return
+    adjusted = conn.execute(
+        update(project_hours)
+        .where(project_hours.c.id == PROJECT_HOURS_ID, project_hours.c.start_date == key)
+        .values(used_hours=project_hours.c.used_hours + delta)
+    )
+    if adjusted.rowcount == 0:
+        # Counted from another start date: recount it in the same transaction.
+        # A missing row is left for get_project_used_hours to create.
+        conn.execute(
+            update(project_hours)
+            .where(project_hours.c.id == PROJECT_HOURS_ID)
+            .values(start_date=key, used_hours=count_project_hours(conn, start))
+        )
+
+
+def _after_flush(session, flush_context) -> None:
+    months, participants, previous, current = changes(session)
+    if months or participants:
+        refresh_stats(session.connection(), months, participants)
+    if previous or current:
+        adjust_project_hours(session.connection(), previous, current)
+
+
+def init_stats() -> None:
+    """Refresh the stats of every session and participant a flush touches.
+
+    The refresh, and the adjustment of the project-hours counter, run in the
+    flush's transaction, so they commit or roll back together with the change.
+    """
+    for name, listener in (("before_flush", _before_flush), ("after_flush", _after_flush)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)